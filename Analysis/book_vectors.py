@@ -0,0 +1,352 @@
+"""
+Book recommendations from a user's profile. Each book is described by a single vector of the TF-IDF weights of the words
+of its summary, its category (one-hot) and its scaled page count, and a user's profile is the rating weighted sum of the
+vectors of the books they rated, so the books recommended are those most similar to the profile.
+
+Rather than comparing a profile with every book, books are found with random projection locality sensitive hashing:
+each of several tables hashes a vector to the side of a set of random hyperplanes it lies on, and similar vectors are
+likely to share a hash within at least one table. Only the books sharing a hash with the profile are then compared.
+
+The vector of every book is saved to Data/Processed/Part/book_vectors.npz, the hashes are computed again from the
+vectors when the index is loaded.
+"""
+from os import path
+from time import perf_counter
+from scipy import sparse
+from data_context import DATA, SHORT_SUMMARIES_FILE
+from data_store import DATASETS
+from item_recommender import ratings_matrix, top_k_per_row
+import numpy as np
+import pandas as pd
+
+BOOK_VECTORS_FILE = "../Data/Processed/Part/book_vectors.npz"
+# Weight of each part of a book's vector, every part is first scaled to unit length
+WORD_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.5
+PAGE_COUNT_WEIGHT = 0.25
+# Number of hash tables and the number of hyperplanes (bits of the hash) of each table. More tables find more of the
+# most similar books, more bits compare the profile with fewer books
+TABLES = 16
+BITS = 10
+SEED = 0
+# Number of profiles searched for at once, and the most profile and book pairs compared at once by an exact search,
+# limiting the memory used
+BATCH_SIZE = 256
+EXACT_COMPARISONS = 1 << 24
+
+
+def normalise_rows(matrix):
+    """
+    :param matrix: scipy sparse matrix
+    :return: CSR matrix with every row scaled to unit length, rows of zeros are left as they are
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+
+    return sparse.csr_matrix(sparse.diags(1 / np.maximum(norms, 1e-12)).astype(np.float32) @ matrix)
+
+
+def book_vectors(descriptors, word_matrix):
+    """
+    :param descriptors: Dataframe indexed by ISBN, containing "Page_Count", "Category" and "Word_Row", as returned by
+        DataContext.book_descriptors
+    :param word_matrix: WordMatrix of the shortened summaries, whose rows are given by "Word_Row"
+    :return: scipy CSR matrix of unit length vectors with a row for each book, so the dot product of two books is their
+        cosine similarity
+    """
+    # TF-IDF of the summary words, books without a summary have no words
+    rows = descriptors["Word_Row"].values
+    counts = sparse.diags((rows >= 0).astype(np.float32)) @ word_matrix.counts[np.maximum(rows, 0)]
+    document_frequency = np.diff(sparse.csc_matrix(counts).indptr)
+    idf = np.log((1 + len(rows)) / (1 + document_frequency)) + 1
+    words = normalise_rows(counts @ sparse.diags(idf.astype(np.float32)))
+
+    # One-hot categories, books without a category have none set
+    codes, _ = pd.factorize(descriptors["Category"])
+    has_category = np.flatnonzero(codes >= 0)
+    categories = sparse.csr_matrix((np.ones(len(has_category), dtype=np.float32), (has_category, codes[has_category])),
+                                   shape=(len(codes), codes.max(initial=-1) + 1))
+
+    # Page counts are standardised, missing page counts are treated as the average
+    page_counts = descriptors["Page_Count"].astype(np.float64)
+    page_counts = ((page_counts - page_counts.mean()) / (page_counts.std() or 1)).fillna(0).values
+    page_counts = sparse.csr_matrix(page_counts.astype(np.float32).reshape(-1, 1))
+
+    return normalise_rows(sparse.hstack([WORD_WEIGHT * words, CATEGORY_WEIGHT * categories,
+                                         PAGE_COUNT_WEIGHT * page_counts]))
+
+
+def expand_ranges(starts, ends):
+    """
+    :param starts: Array of the start of each range
+    :param ends: Array of the end (exclusive) of each range
+    :return: Array of the range each position is from, and array of every position within the ranges
+    """
+    lengths = ends - starts
+    ranges = np.repeat(np.arange(len(lengths)), lengths)
+
+    return ranges, np.arange(len(ranges)) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+
+
+class VectorIndex:
+    """
+    The vector of every book, hashed within several tables. Each table is kept sorted by hash, so the books sharing a
+    hash are found by a binary search
+    """
+    def __init__(self, vectors, isbns, tables=TABLES, bits=BITS, seed=SEED):
+        """
+        :param vectors: scipy CSR matrix of unit length vectors, with a row for each book
+        :param isbns: Array of the ISBN of each row
+        :param tables: The number of hash tables
+        :param bits: The number of hyperplanes of each table, up to 62
+        :param seed: Seed of the random hyperplanes
+        """
+        self.vectors = sparse.csr_matrix(vectors, dtype=np.float32)
+        self.isbns = pd.Index(isbns)
+        self.tables = tables
+        self.bits = bits
+        self.seed = seed
+
+        # The hyperplanes are generated from the seed rather than saved
+        self.hyperplanes = np.random.default_rng(seed).standard_normal((self.vectors.shape[1], tables * bits),
+                                                                       dtype=np.float32)
+
+        hashes = self.hashes(self.vectors)
+        self.order = np.argsort(hashes, axis=0, kind="stable").T
+        self.sorted_hashes = np.take_along_axis(hashes, self.order.T, axis=0).T
+
+    @classmethod
+    def build(cls, descriptors=None, word_matrix=None, **parameters):
+        """
+        :param descriptors: Dataframe of the book descriptors, None to use DataContext.book_descriptors
+        :param word_matrix: WordMatrix of the shortened summaries, None to use DataContext.word_matrix
+        :param parameters: tables, bits and seed of the index
+        :return: VectorIndex of the books
+        """
+        descriptors = DATA.book_descriptors if descriptors is None else descriptors
+        word_matrix = DATA.word_matrix if word_matrix is None else word_matrix
+
+        return cls(book_vectors(descriptors, word_matrix), np.asarray(descriptors.index, dtype=str), **parameters)
+
+    @classmethod
+    def load(cls, filename=BOOK_VECTORS_FILE):
+        """
+        :param filename: Location of the index saved by save()
+        :return: The saved VectorIndex
+        """
+        with np.load(filename) as saved:
+            vectors = sparse.csr_matrix((saved["data"], saved["indices"], saved["indptr"]), shape=tuple(saved["shape"]))
+            tables, bits, seed = saved["parameters"]
+
+            return cls(vectors, saved["isbns"], int(tables), int(bits), int(seed))
+
+    def save(self, filename=BOOK_VECTORS_FILE):
+        """
+        :param filename: Location the index is saved to
+        """
+        np.savez(filename, data=self.vectors.data, indices=self.vectors.indices, indptr=self.vectors.indptr,
+                 shape=np.array(self.vectors.shape), isbns=np.asarray(self.isbns, dtype=str),
+                 parameters=np.array([self.tables, self.bits, self.seed]))
+
+    def hashes(self, vectors):
+        """
+        :param vectors: scipy sparse matrix of vectors, with a row for each vector
+        :return: Array of shape (vectors, tables) of the hash of each vector within each table
+        """
+        sides = np.asarray(vectors @ self.hyperplanes) > 0
+
+        return sides.reshape(-1, self.tables, self.bits) @ (np.int64(1) << np.arange(self.bits, dtype=np.int64))
+
+    def candidates(self, vectors, probe=True):
+        """
+        Find the books sharing a hash with each vector within any table
+
+        :param vectors: scipy sparse matrix of vectors, with a row for each vector
+        :param probe: True to also search the hashes differing by a single hyperplane, finding more of the most similar
+            books at the cost of comparing with more books
+        :return: scipy CSR matrix of shape (vectors, books), with an entry for every book found for each vector
+        """
+        hashes = self.hashes(vectors)
+        if probe:
+            hashes = np.concatenate([hashes[:, :, np.newaxis],
+                                     hashes[:, :, np.newaxis] ^ (np.int64(1) << np.arange(self.bits, dtype=np.int64))],
+                                    axis=2)
+        else:
+            hashes = hashes[:, :, np.newaxis]
+
+        vector_rows, book_rows = [], []
+        for table in range(self.tables):
+            table_hashes = hashes[:, table].ravel()
+            starts = np.searchsorted(self.sorted_hashes[table], table_hashes, side="left")
+            ends = np.searchsorted(self.sorted_hashes[table], table_hashes, side="right")
+
+            ranges, positions = expand_ranges(starts, ends)
+            vector_rows.append(ranges // hashes.shape[2])
+            book_rows.append(self.order[table, positions])
+
+        # Books found within several tables are combined into a single entry, so are only compared once
+        vector_rows, book_rows = np.concatenate(vector_rows), np.concatenate(book_rows)
+        found = sparse.csr_matrix((np.ones(len(book_rows), dtype=np.float32), (vector_rows, book_rows)),
+                                  shape=(vectors.shape[0], len(self.isbns)))
+        found.sum_duplicates()
+
+        return found
+
+    def compare(self, vectors, found):
+        """
+        :param vectors: scipy CSR matrix of vectors, with a row for each vector
+        :param found: scipy CSR matrix of the books found for each vector, as returned by candidates()
+        :return: scipy CSR matrix with the same entries as found, of the similarity of each vector and book
+        """
+        similarities = np.zeros(found.nnz, dtype=np.float32)
+
+        # Each vector is compared with only the books found for it
+        for row in range(vectors.shape[0]):
+            start, end = found.indptr[row], found.indptr[row + 1]
+            if end > start:
+                similarities[start:end] = self.vectors[found.indices[start:end]] @ vectors[row].toarray().ravel()
+
+        return sparse.csr_matrix((similarities, found.indices, found.indptr), shape=found.shape)
+
+    def query(self, vectors, k=10, exclude=None, probe=True, exact=False):
+        """
+        Find the most similar books to many vectors at once
+
+        :param vectors: scipy sparse matrix or array of vectors (i.e. user profiles), with a row for each vector
+        :param k: The number of books found for each vector
+        :param exclude: scipy sparse matrix of shape (vectors, books), non-zero for the books not to be returned for
+            each vector (i.e. books the user has already rated), None to return any book
+        :param probe: True to also search the hashes differing by a single hyperplane, see candidates()
+        :param exact: True to compare every vector with every book rather than using the hashes
+        :return: Arrays of shape (vectors, k) of the rows and the similarities of the books found, most similar first.
+            Vectors with fewer than k books found are padded with a row of -1 and similarity of 0
+        """
+        vectors = sparse.csr_matrix(vectors, dtype=np.float32)
+        rows = np.full((vectors.shape[0], k), -1, dtype=np.int32)
+        similarities = np.zeros((vectors.shape[0], k), dtype=np.float32)
+
+        batch_size = max(1, min(BATCH_SIZE, EXACT_COMPARISONS // max(len(self.isbns), 1))) if exact else BATCH_SIZE
+
+        for start in range(0, vectors.shape[0], batch_size):
+            end = min(start + batch_size, vectors.shape[0])
+            batch = vectors[start:end]
+
+            scores = batch @ self.vectors.T if exact else self.compare(batch, self.candidates(batch, probe))
+
+            if exclude is not None:
+                scores = scores.tocoo()
+                kept = np.asarray(exclude[start:end][scores.row, scores.col]).ravel() == 0
+                scores = sparse.csr_matrix((scores.data[kept], (scores.row[kept], scores.col[kept])),
+                                           shape=scores.shape)
+
+            rows[start:end], similarities[start:end] = top_k_per_row(scores, k)
+
+        return rows, similarities
+
+    def similar(self, vector, n=10, exact=False):
+        """
+        :param vector: A single vector, i.e. a user's profile
+        :param n: The number of books returned
+        :param exact: True to compare the vector with every book rather than using the hashes
+        :return: A list of up to n (ISBN, similarity) tuples, most similar first
+        """
+        rows, similarities = self.query(sparse.csr_matrix(vector).reshape(1, -1), n, exact=exact)
+        found = rows[0] >= 0
+
+        return list(zip(self.isbns[rows[0][found]], similarities[0][found].tolist()))
+
+    def profiles(self, ratings):
+        """
+        :param ratings: Dataframe of ratings, containing "ISBN", "Rating" and "User"
+        :return: scipy CSR matrix of the unit length profile of each user, the user of each row and a CSR matrix of the
+            ratings of each user (row) for each book (column). Ratings of books without a vector are ignored
+        """
+        user_ratings, users, _ = ratings_matrix(ratings, self.isbns)
+
+        return normalise_rows(user_ratings @ self.vectors), users, user_ratings
+
+    def recommend(self, ratings, n=10, exact=False):
+        """
+        Recommend books for many users at once, from the books most similar to their profile which they have not
+        already rated
+
+        :param ratings: Dataframe of the ratings of the users to recommend for, containing "ISBN", "Rating" and "User"
+        :param n: The number of books recommended to each user
+        :param exact: True to compare every profile with every book rather than using the hashes
+        :return: Dataframe with the columns "User", "Rank", "ISBN" and "Score", ordered by user then rank
+        """
+        profiles, users, user_ratings = self.profiles(ratings)
+
+        rows, similarities = self.query(profiles, n, exclude=user_ratings, exact=exact)
+        user_rows, ranks = np.nonzero(rows >= 0)
+
+        return pd.DataFrame({"User": users[user_rows], "Rank": ranks + 1,
+                             "ISBN": np.asarray(self.isbns)[rows[user_rows, ranks]],
+                             "Score": similarities[user_rows, ranks]})
+
+
+def recall_benchmark(vectors, queries, k=10,
+                     settings=((32, 10, False), (8, 12, True), (16, 12, True), (16, 10, True))):
+    """
+    Compare the recall and time taken of the hashed search against comparing every query with every vector
+
+    :param vectors: scipy CSR matrix of unit length book vectors
+    :param queries: scipy CSR matrix of the query vectors
+    :param k: The number of books found for each query
+    :param settings: (tables, bits, probe) of each index compared
+    :return: Dataframe with a row for each setting and the exact search, containing "Tables", "Bits", "Probe",
+        "Build_Seconds", "Milliseconds_Per_Query", "Compared_Per_Query" and "Recall"
+    """
+    results = []
+    isbns = np.arange(vectors.shape[0]).astype(str)
+
+    for tables, bits, probe in [(None, None, None)] + list(settings):
+        start = perf_counter()
+        index = VectorIndex(vectors, isbns, tables or 1, bits or 1)
+        build_seconds = perf_counter() - start
+
+        start = perf_counter()
+        rows, _ = index.query(queries, k, probe=probe, exact=tables is None)
+        query_seconds = perf_counter() - start
+
+        if tables is None:
+            exact_rows = rows
+            compared = vectors.shape[0]
+        else:
+            compared = index.candidates(queries, probe).nnz / queries.shape[0]
+
+        # Share of the exact top k also found, ignoring padding
+        found = [len(np.intersect1d(row[row >= 0], exact[exact >= 0])) for row, exact in zip(rows, exact_rows)]
+        recall = sum(found) / max((exact_rows >= 0).sum(), 1)
+
+        results.append({"Tables": tables, "Bits": bits, "Probe": probe,
+                        "Build_Seconds": None if tables is None else round(build_seconds, 3),
+                        "Milliseconds_Per_Query": round(1000 * query_seconds / queries.shape[0], 3),
+                        "Compared_Per_Query": round(compared, 1), "Recall": round(recall, 4)})
+
+    return pd.DataFrame(results)
+
+
+def load_vector_index(source_files=(SHORT_SUMMARIES_FILE, DATASETS["books_complete_details"][0]),
+                      filename=BOOK_VECTORS_FILE):
+    """
+    Load the saved index, building and saving it first if it does not exist or is older than any of its sources
+
+    :param source_files: Files the vectors are built from: the summaries, and the books with their categories and page
+        counts. Used to check whether the saved index is out of date
+    :param filename: Location of the saved index
+    :return: VectorIndex of the books
+    """
+    if path.isfile(filename) and all(path.getmtime(filename) >= path.getmtime(source_file)
+                                     for source_file in source_files if path.isfile(source_file)):
+        return VectorIndex.load(filename)
+
+    vector_index = VectorIndex.build()
+    vector_index.save(filename)
+
+    return vector_index
+
+
+if __name__ == "__main__":
+    VECTOR_INDEX = load_vector_index()
+    print("Vectors of {} features for {} books".format(VECTOR_INDEX.vectors.shape[1], len(VECTOR_INDEX.isbns)))
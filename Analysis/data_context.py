@@ -0,0 +1,97 @@
+"""
+The datasets used for analysis are accessed through a single shared data context. Each dataset is only loaded the first
+time it is used and is then shared between all modules, so importing a module or producing a single plot only loads the
+files it needs.
+"""
+from functools import cached_property
+import sys
+import pandas as pd
+
+sys.path.append("../Processing")
+from data_store import load
+from word_matrix import load_word_matrix
+
+SHORT_SUMMARIES_FILE = "../Data/Processed/Part/shortened_summaries.csv"
+
+
+class DataContext:
+    """
+    Lazily loaded datasets, each property is loaded on first access and memoized
+    """
+    @cached_property
+    def rating_details(self):
+        return load("rating_details")
+
+    @cached_property
+    def books_complete_details(self):
+        return load("books_complete_details")
+
+    @cached_property
+    def user_demographics(self):
+        return pd.read_csv("../Data/Stats/user_demographics.csv", index_col=False)
+
+    @cached_property
+    def short_summaries(self):
+        """
+        :return: Dataframe of the shortened summaries, empty summaries are read as missing
+        """
+        return pd.read_csv(SHORT_SUMMARIES_FILE, dtype={"ISBN": str})
+
+    @cached_property
+    def books(self):
+        """
+        :return: Dataframe of the books with complete details and a shortened summary, within "Short_Summary"
+        """
+        books = self.books_complete_details.copy()
+
+        # Shortened summaries are matched to books by ISBN
+        if "ISBN" in self.short_summaries.columns:
+            short_summaries = self.short_summaries.drop_duplicates(subset="ISBN").set_index("ISBN")
+            books["Short_Summary"] = books["ISBN"].map(short_summaries["Summary"])
+        else:  # Saved before summaries were keyed by ISBN, so these only line up with the books by row order
+            books["Short_Summary"] = self.short_summaries["Summary"]
+
+        return books.dropna()
+
+    @cached_property
+    def books_by_isbn(self):
+        """
+        :return: Books indexed by ISBN so groups can be joined in bulk, only the first entry for an ISBN is used
+        """
+        return self.books.drop_duplicates(subset="ISBN").set_index("ISBN")
+
+    @cached_property
+    def word_matrix(self):
+        return load_word_matrix(self.books_by_isbn.index, self.books_by_isbn["Short_Summary"], SHORT_SUMMARIES_FILE)
+
+    @cached_property
+    def book_descriptors(self):
+        """
+        Prepare the descriptors used for statistics once for every book, rather than for every group the book is in
+
+        :return: Dataframe indexed by ISBN with the columns "Page_Count", "Category", "Word_Row", "Title" and "Author"
+        """
+        books_by_isbn = self.books_by_isbn
+        categories = books_by_isbn["Categories"].astype(str).str.translate(str.maketrans("", "", "[']"))
+
+        return pd.DataFrame({
+            "Page_Count": books_by_isbn["Page_Count"],
+            # Removing irrelevant categories
+            "Category": categories.where(~categories.isin(["nan", "Fiction"])),
+            # Synopsis is used for most common words, these are counted within the word matrix
+            "Word_Row": self.word_matrix.rows(books_by_isbn.index),
+            "Title": books_by_isbn["Title"],
+            "Author": books_by_isbn["Author"]})
+
+    def clear(self, *names):
+        """
+        Forget loaded datasets, so they are loaded again on next access
+
+        :param names: Names of the datasets to forget, all datasets if none are given
+        """
+        for name in names or list(self.__dict__):
+            self.__dict__.pop(name, None)
+
+
+# Shared by all modules
+DATA = DataContext()
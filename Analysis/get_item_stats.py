@@ -5,11 +5,14 @@ ensure relevance with summary data for the stats the summaries are cleaned, so a
 (i.e. "The") and irrelevant words are removed.
 """
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from os import path
+from data_context import DATA, SHORT_SUMMARIES_FILE
+from instrumentation import METRICS
 from nltk.corpus import stopwords
 import pandas as pd
 import numpy as np
-import re
-
 
 # Expanded stopwords with own observations
 STOP_WORDS = set(
@@ -17,8 +20,48 @@ STOP_WORDS = set(
                                   "bestselling", "life", "world", "first", "year", "author", "edition", "published",
                                   "novel", "school", "come", "bestseller", "unforgettable", "many", "stories"])
 
-RATINGS = pd.read_csv("../Data/Processed/Part/rating_details.csv", encoding="cp1252")
-books = pd.read_csv("../Data/Processed/books_complete_details.csv")
+
+def select_group(group, secondary, sample_size):
+    """
+    Select the rating details for the ISBNs most rated by a group, which the statistics are based on
+
+    :param group: First subset to be used, can be an age group or country, or None for all ISBNs
+    :param secondary: Second subset to be used, this is not required (Can pass None if so), usually a country
+    :param sample_size: The number of records to select, can be set to None to select all records
+    :return: Dataframe of the selected rating details, keeping the index of the rating details
+    """
+    ratings = DATA.rating_details
+
+    # Equal counts are kept in the order of the rating details, the same as the rows selected by select_rows()
+    if secondary:
+        group_stats = ratings.loc[ratings[group] > 0]
+        group_stats = group_stats.loc[ratings[secondary] > 0]
+        group_stats = group_stats[["ISBN", group]].sort_values(by=[group], ascending=False, kind="stable")
+        group_stats = group_stats.head(sample_size)
+    elif group:
+        group_stats = ratings.loc[ratings[group] > 0]
+        group_stats = group_stats[["ISBN", group]].sort_values(by=[group], ascending=False, kind="stable")
+        group_stats = group_stats.head(sample_size)
+    else:
+        group_stats = ratings[["ISBN"]].head(sample_size)
+
+    return group_stats
+
+
+def describe(group_details):
+    """
+    Compile the statistics for the book descriptors of a group
+
+    :param group_details: Rows of the book descriptors for every ISBN selected for the group
+    :return: average page counts, common categories, common words, common titles and common authors
+    """
+    avg_page_count = np.nanmean(group_details["Page_Count"]).round()
+    common_categories = Counter(group_details["Category"].dropna().tolist()).most_common(5)
+    common_words = DATA.word_matrix.top_words(group_details["Word_Row"].values, 5)
+    common_titles = Counter(group_details["Title"].tolist()).most_common(5)
+    common_authors = Counter(group_details["Author"].tolist()).most_common(5)
+
+    return avg_page_count, common_categories, common_words, common_titles, common_authors
 
 
 def stats(group, secondary, sample_size):
@@ -29,84 +72,147 @@ def stats(group, secondary, sample_size):
     :param group: First subset to be used, this is required and can be an age group or country
     :param secondary: Second subset to be used, this is not required (Can pass None if so), usually a country
     :param sample_size: The number of records to base the statistics of, mainly used for testing
-    :return: average page counts, common categories, common words and common titles for the given group
+    :return: average page counts, common categories, common words, common titles and common authors for the group
     """
-    if secondary:
-        group_stats = RATINGS.loc[RATINGS[group] > 0]
-        group_stats = group_stats.loc[RATINGS[secondary] > 0]
-        group_stats = group_stats[["ISBN", group]].sort_values(by=[group], ascending=False).head(sample_size)
-    elif group:
-        group_stats = RATINGS.loc[RATINGS[group] > 0]
-        group_stats = group_stats[["ISBN", group]].sort_values(by=[group], ascending=False).head(sample_size)
-    else:
-        group_stats = RATINGS[["ISBN"]].head(sample_size)
+    group_stats = select_group(group, secondary, sample_size)
 
-    # Store all statistics
-    page_counts, authors, categories, titles, all_synopsis = [], [], [], [], []
+    # Single join with the book details, not all ISBNs in rating details have complete details available
+    return describe(group_stats[["ISBN"]].join(DATA.book_descriptors, on="ISBN", how="inner"))
 
-    for isbn in group_stats["ISBN"]:
-        isbn_details = books.loc[books["ISBN"] == isbn]
 
-        # Not all ISBNs in rating details have complete details available
-        if len(isbn_details) > 0:
-            # Modified for easier processing later
-            category = str(isbn_details["Categories"].values[0])
-            category = category.translate(str.maketrans("", "", "[']"))  # Removing redundant characters
+def group_combinations(primary_groups, secondary_groups):
+    """
+    :param primary_groups: List of groups used as the first subset, usually the age groups
+    :param secondary_groups: List of groups used as the second subset, usually the countries
+    :return: List of every (group, secondary) statistics are compiled for: all ISBNs, each primary and secondary group
+        alone and each combination of a primary with a secondary group
+    """
+    combinations = [(None, None)] + [(group, None) for group in primary_groups + secondary_groups]
+    return combinations + [(group, secondary) for secondary in secondary_groups for group in primary_groups]
 
-            synopsis_split = isbn_details["Short_Summary"].values[0].split()  # Synopsis is used for most common words
-            page_counts.append(isbn_details["Page_Count"])
-            authors.append(isbn_details["Author"].values[0])
 
-            categories.append(category)
-            all_synopsis += synopsis_split
-            titles.append(isbn_details["Title"].values[0])
+def group_orders(counts):
+    """
+    :param counts: Array of the count of each group (column) for each row of the rating details
+    :return: Array of the rows of each column sorted by descending count, equal counts kept in the order of the rows
+    """
+    return np.argsort(-counts, axis=0, kind="stable")
+
 
-    categories = [x for x in categories if str(x) not in ["nan", "Fiction"]]  # Removing irrelevant categories
-    all_synopsis = [word.capitalize() for word in all_synopsis]  # Ensuring all words start with capital letter
+def select_rows(counts, orders, group_column, secondary_column, sample_size):
+    """
+    Select the same rows of the rating details as select_group(), from the order of each group sorted a single time
+
+    :param counts: Array of the count of each group (column) for each row of the rating details
+    :param orders: Array of the rows of each column sorted by descending count, as returned by group_orders()
+    :param group_column: Column of the first subset, or None for all ISBNs
+    :param secondary_column: Column of the second subset, or None
+    :param sample_size: The number of records to select, can be set to None to select all records
+    :return: Array of the position of each selected row within the rating details
+    """
+    if group_column is None:
+        return np.arange(len(counts))[:sample_size]
 
-    avg_page_count = np.nanmean(page_counts).round()
-    common_categories = Counter(categories).most_common(5)
-    common_words = Counter(all_synopsis).most_common(5)
-    common_titles = Counter(titles).most_common(5)
-    common_authors = Counter(authors).most_common(5)
+    order = orders[:, group_column]
+    included = counts[order, group_column] > 0
+    if secondary_column is not None:
+        included &= counts[order, secondary_column] > 0
 
-    return avg_page_count, common_categories, common_words, common_titles, common_authors
+    return order[included][:sample_size]
 
 
-def process_summary():
+def all_stats(primary_groups, secondary_groups, sample_size):
     """
-    This is used to improve the usability of all summaries given by removing stop words, illegal characters and
-    irrelevant words (I.E. "Edition"), usability is improved for statistics.
+    Compile the statistics for every group at once: all ISBNs, each primary and secondary group alone and each
+    combination of a primary with a secondary group. Each group column is sorted a single time and the book details are
+    joined to the rating details a single time, so each combination only selects its rows.
+
+    :param primary_groups: List of groups used as the first subset, usually the age groups
+    :param secondary_groups: List of groups used as the second subset, usually the countries
+    :param sample_size: The number of records to base the statistics of, can be set to None to use all records
+    :return: Dictionary of (group, secondary) to the values returned by stats(group, secondary, sample_size), where
+    either can be None
+    """
+    ratings = DATA.rating_details
+    groups = list(dict.fromkeys(primary_groups + secondary_groups))
+    counts = ratings[groups].to_numpy()
+    orders = group_orders(counts)
 
-    These summaries are saved to Data/Processed/Part/shortened_summaries.csv
+    # Not all ISBNs in rating details have complete details available
+    rating_descriptors = ratings[["ISBN"]].join(DATA.book_descriptors, on="ISBN", how="inner")
+    all_group_stats = {}
+
+    for group, secondary in group_combinations(primary_groups, secondary_groups):
+        selected = ratings.index[select_rows(counts, orders, groups.index(group) if group else None,
+                                             groups.index(secondary) if secondary else None, sample_size)]
+        selected = selected[selected.isin(rating_descriptors.index)]
+
+        all_group_stats[(group, secondary)] = describe(rating_descriptors.loc[selected])
 
-    :return: an array containing processed summaries
+    return all_group_stats
+
+
+def normalise_summaries(summaries):
+    """
+    Remove illegal characters and stop words from summaries, with each step applied to all the summaries at once
+
+    :param summaries: Series of summaries, missing summaries are returned as empty strings
+    :return: Series of the processed summaries with the same index
     """
-    books["Summary"] = books["Summary"]
-    count = 0
-    total = len(books["Summary"].index)
-    new_summaries = []
+    standardised_summaries = summaries.fillna("").str.replace("\"", "", regex=False)
+    standardised_summaries = standardised_summaries.str.replace("[^a-zA-Z]", " ", regex=True).str.lower()
 
-    for summary in books["Summary"]:
-        if str(summary) != "nan":
-            standardised_summary = re.sub("\"", "", summary)
-            standardised_summary = re.sub("[^a-zA-Z]", " ", standardised_summary)
-            standardised_summary = " ".join(standardised_summary.split())
-            standardised_summary = standardised_summary.lower()
+    return standardised_summaries.str.split().map(lambda words: " ".join(w for w in words if w not in STOP_WORDS))
 
-            cleaned_summary = [w for w in standardised_summary.split() if w not in STOP_WORDS]
 
-            new_summaries.append(" ".join(cleaned_summary))
+def process_summary(workers=None, chunk_size=10000):
+    """
+    This is used to improve the usability of all summaries given by removing stop words, illegal characters and
+    irrelevant words (I.E. "Edition"), usability is improved for statistics. Summaries are processed in chunks, and
+    summaries which have not changed since they were last processed are reused.
+
+    These summaries are saved to Data/Processed/Part/shortened_summaries.csv
+
+    :param workers: The number of processes used for the chunks, None to process them within this process
+    :param chunk_size: The number of summaries within each chunk
+    :return: a dataframe containing the ISBN, processed summary and hash of the original summary for each book
+    """
+    source = DATA.books_complete_details[["ISBN", "Summary"]].drop_duplicates(subset="ISBN")
+    source = source.set_index("ISBN")["Summary"]
+    source_hashes = source.fillna("").map(lambda summary: sha1(summary.encode("utf-8")).hexdigest())
+    short_summaries = pd.Series("", index=source.index)
+
+    # Only summaries which have changed since the last run need processing
+    if path.isfile(SHORT_SUMMARIES_FILE):
+        previous = pd.read_csv(SHORT_SUMMARIES_FILE, dtype=str, keep_default_na=False)
+
+        if "Source_Hash" in previous.columns:  # Files saved by row order alone cannot be matched to the books
+            previous = previous.drop_duplicates(subset="ISBN").set_index("ISBN")
+            unchanged = source_hashes.eq(previous["Source_Hash"].reindex(source.index))
+            short_summaries[unchanged] = previous["Summary"].reindex(source.index)[unchanged]
+            source = source[~unchanged]
+
+    chunks = [source.iloc[i:i + chunk_size] for i in range(0, len(source.index), chunk_size)]
+
+    with METRICS.timer("normalise"):
+        if workers and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                processed_chunks = list(executor.map(normalise_summaries, chunks))
         else:
-            new_summaries.append("")
+            processed_chunks = [normalise_summaries(chunk) for chunk in chunks]
+    METRICS.count("summaries", len(short_summaries.index))
+    METRICS.count("changed_summaries", len(source.index))
+
+    for processed_chunk in processed_chunks:
+        short_summaries[processed_chunk.index] = processed_chunk
 
-        count += 1
-        print("{} out of {}".format(count, total))
+    print("Processed {} changed summaries out of {}".format(len(source.index), len(short_summaries.index)))
 
-    pd.DataFrame({"Summary": new_summaries}).to_csv("../data/Processed/Part/shortened_summaries.csv", header=True,
-                                                    index=False)
+    short_summaries_df = pd.DataFrame({"ISBN": short_summaries.index, "Summary": short_summaries.values,
+                                       "Source_Hash": source_hashes.values})
+    short_summaries_df.to_csv(SHORT_SUMMARIES_FILE, header=True, index=False)
 
+    # Datasets built from the previous summaries are out of date
+    DATA.clear("short_summaries", "books", "books_by_isbn", "word_matrix", "book_descriptors")
 
-books["Short_Summary"] = pd.read_csv("../Data/Processed/Part/shortened_summaries.csv")
-books["Short_Summary"].replace("", np.nan, inplace=True)
-books.dropna(inplace=True)
+    return short_summaries_df
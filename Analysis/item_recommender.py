@@ -0,0 +1,212 @@
+"""
+Book recommendations from the ratings of similar books, i.e. "users who rated this book also liked". The ratings are
+stored as a sparse user x ISBN matrix and the cosine similarity between every pair of ISBNs is computed in blocks of
+ISBNs, only keeping the most similar neighbours of each ISBN, so the full ISBN x ISBN similarity matrix is never held
+in memory.
+
+The neighbours of every ISBN are saved to Data/Processed/Part/item_neighbours.npz
+"""
+from os import path
+import sys
+from scipy import sparse
+import numpy as np
+import pandas as pd
+
+sys.path.append("../Processing")
+from data_store import DATASETS, load
+
+NEIGHBOURS_FILE = "../Data/Processed/Part/item_neighbours.npz"
+# Number of neighbours kept for each ISBN
+NEIGHBOURS = 20
+# Number of ISBNs whose similarities are computed at once
+BLOCK_SIZE = 2048
+
+
+def ratings_matrix(ratings, isbns=None):
+    """
+    :param ratings: Dataframe of ratings, containing "ISBN", "Rating" and "User"
+    :param isbns: The ISBN of each column, None to use every rated ISBN in order of first appearance
+    :return: scipy CSR matrix of the ratings with a row for each user and a column for each ISBN, along with the user
+        of each row and the ISBN of each column. Ratings of ISBNs not within isbns are dropped
+    """
+    # Only the latest rating of a book by a user is used
+    ratings = ratings.drop_duplicates(subset=["User", "ISBN"], keep="last")
+
+    rows, users = pd.factorize(ratings["User"])
+    if isbns is None:
+        columns, isbns = pd.factorize(ratings["ISBN"].astype(str))
+    else:
+        isbns = pd.Index(isbns)
+        columns = isbns.get_indexer(ratings["ISBN"].astype(str))
+
+    known = columns >= 0
+    matrix = sparse.csr_matrix((ratings["Rating"].values[known].astype(np.float32), (rows[known], columns[known])),
+                               shape=(len(users), len(isbns)))
+
+    return matrix, np.asarray(users), np.asarray(isbns, dtype=str)
+
+
+def top_k_per_row(matrix, k):
+    """
+    Select the largest k entries of every row of a sparse matrix, with a single sort rather than one per row
+
+    :param matrix: scipy CSR matrix
+    :param k: The number of entries kept for each row
+    :return: Arrays of the columns and values of the top k entries of each row, largest first, with a shape of
+        (rows, k). Rows with fewer than k entries are padded with a column of -1 and value of 0
+    """
+    matrix = matrix.tocsr()
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+    # Sorted by a single key of the row plus the value scaled to within [0, 1), largest first, which is several times
+    # faster than sorting by the row and then the value
+    low, high = matrix.data.min(initial=0), matrix.data.max(initial=0)
+    order = np.argsort(rows + (high - matrix.data.astype(np.float64)) / ((high - low) * (1 + 1e-6) + 1e-12))
+    rank = np.arange(len(order)) - matrix.indptr[rows[order]]
+    kept = order[rank < k]
+
+    columns = np.full((matrix.shape[0], k), -1, dtype=np.int32)
+    values = np.zeros((matrix.shape[0], k), dtype=np.float32)
+    columns[rows[kept], rank[rank < k]] = matrix.indices[kept]
+    values[rows[kept], rank[rank < k]] = matrix.data[kept]
+
+    return columns, values
+
+
+class ItemNeighbours:
+    """
+    The most similar ISBNs of every ISBN, by the cosine similarity of their ratings
+    """
+    def __init__(self, neighbours, similarities, isbns):
+        """
+        :param neighbours: Array of shape (ISBNs, k) of the column of each neighbour, -1 where there are fewer than k
+        :param similarities: Array of shape (ISBNs, k) of the similarity of each neighbour, most similar first
+        :param isbns: Array of the ISBN of each row
+        """
+        self.neighbours = neighbours
+        self.similarities = similarities
+        self.isbns = pd.Index(isbns)
+
+    @classmethod
+    def build(cls, ratings, k=NEIGHBOURS, block_size=BLOCK_SIZE):
+        """
+        Compute the k nearest neighbours of every ISBN, block by block
+
+        :param ratings: Dataframe of ratings, containing "ISBN", "Rating" and "User"
+        :param k: The number of neighbours kept for each ISBN
+        :param block_size: The number of ISBNs whose similarities are computed at once, limiting the memory used
+        :return: ItemNeighbours of the rated ISBNs
+        """
+        matrix, _, isbns = ratings_matrix(ratings)
+
+        # Scaling each ISBN's ratings to unit length makes the dot product of two ISBNs their cosine similarity
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+        items = sparse.csr_matrix(matrix @ sparse.diags(1 / np.maximum(norms, 1e-12)).astype(np.float32)).T.tocsr()
+        users = items.T.tocsr()
+
+        neighbours = np.full((len(isbns), k), -1, dtype=np.int32)
+        similarities = np.zeros((len(isbns), k), dtype=np.float32)
+
+        for start in range(0, len(isbns), block_size):
+            end = min(start + block_size, len(isbns))
+            block = (items[start:end] @ users).tocoo()
+
+            # An ISBN is not its own neighbour
+            not_self = block.row + start != block.col
+            block = sparse.csr_matrix((block.data[not_self], (block.row[not_self], block.col[not_self])),
+                                      shape=block.shape)
+
+            neighbours[start:end], similarities[start:end] = top_k_per_row(block, k)
+
+        return cls(neighbours, similarities, isbns)
+
+    @classmethod
+    def load(cls, filename=NEIGHBOURS_FILE):
+        """
+        :param filename: Location of the neighbours saved by save()
+        :return: The saved ItemNeighbours
+        """
+        with np.load(filename) as saved:
+            return cls(saved["neighbours"], saved["similarities"], saved["isbns"])
+
+    def save(self, filename=NEIGHBOURS_FILE):
+        """
+        :param filename: Location the neighbours are saved to
+        """
+        np.savez(filename, neighbours=self.neighbours, similarities=self.similarities,
+                 isbns=np.asarray(self.isbns, dtype=str))
+
+    def similar(self, isbn, n=10):
+        """
+        :param isbn: ISBN to find similar books for
+        :param n: The maximum number of books returned, up to the number of neighbours kept
+        :return: A list of up to n (ISBN, similarity) tuples, most similar first. Empty if the ISBN has no ratings
+        """
+        row = self.isbns.get_indexer([isbn])[0]
+        if row < 0:
+            return []
+
+        kept = self.neighbours[row, :n] >= 0
+        return list(zip(self.isbns[self.neighbours[row, :n][kept]], self.similarities[row, :n][kept].tolist()))
+
+    def neighbour_matrix(self):
+        """
+        :return: scipy CSR matrix of shape (ISBNs, ISBNs) of the similarity of each ISBN to each of its neighbours
+        """
+        rows = np.repeat(np.arange(len(self.isbns)), self.neighbours.shape[1])
+        columns = self.neighbours.ravel()
+        kept = columns >= 0
+
+        return sparse.csr_matrix((self.similarities.ravel()[kept], (rows[kept], columns[kept])),
+                                 shape=(len(self.isbns), len(self.isbns)))
+
+    def recommend(self, ratings, n=10):
+        """
+        Recommend books for many users at once. Each book is scored by the similarity weighted sum of the user's ratings
+        of its neighbours, books the user has already rated are not recommended.
+
+        :param ratings: Dataframe of the ratings of the users to recommend for, containing "ISBN", "Rating" and "User"
+        :param n: The number of books recommended to each user
+        :return: Dataframe with the columns "User", "Rank", "ISBN" and "Score", ordered by user then rank
+        """
+        user_ratings, users, _ = ratings_matrix(ratings, self.isbns)
+
+        # Neighbour lists are not symmetric, so the scores are summed from the neighbours of each rated book
+        scores = (user_ratings @ self.neighbour_matrix()).tocsr()
+        rated = user_ratings.copy()
+        rated.data[:] = 1
+        scores = scores - scores.multiply(rated)
+        scores.eliminate_zeros()
+
+        columns, values = top_k_per_row(scores, n)
+        user_rows, ranks = np.nonzero(columns >= 0)
+
+        return pd.DataFrame({"User": users[user_rows], "Rank": ranks + 1,
+                             "ISBN": np.asarray(self.isbns)[columns[user_rows, ranks]],
+                             "Score": values[user_rows, ranks]})
+
+
+def load_item_neighbours(ratings=None, source_file=DATASETS["ratings"][0], filename=NEIGHBOURS_FILE):
+    """
+    Load the saved neighbours, building and saving them first if they do not exist or are older than the ratings
+
+    :param ratings: Dataframe of ratings used if building the neighbours, None to load the cleaned ratings
+    :param source_file: File the ratings were read from, used to check whether the saved neighbours are out of date
+    :param filename: Location of the saved neighbours
+    :return: ItemNeighbours of the rated ISBNs
+    """
+    if path.isfile(filename) and path.getmtime(filename) >= path.getmtime(source_file):
+        return ItemNeighbours.load(filename)
+
+    if ratings is None:
+        ratings = load("ratings", columns=["ISBN", "Rating", "User"])
+
+    item_neighbours = ItemNeighbours.build(ratings)
+    item_neighbours.save(filename)
+
+    return item_neighbours
+
+
+if __name__ == "__main__":
+    ITEM_NEIGHBOURS = load_item_neighbours()
+    print("Neighbours found for {} ISBNs".format(len(ITEM_NEIGHBOURS.isbns)))
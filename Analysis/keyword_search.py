@@ -0,0 +1,190 @@
+"""
+Keyword search over the titles and summaries of every book, ranked with BM25. The words of each book are normalised as
+the summaries are for statistics (see get_item_stats.py), so stop words are not indexed, and stored as an inverted
+index, i.e. a sparse word x book matrix of word counts, so a query only reads the books containing its words.
+
+The index is updated incrementally, only books which are new or whose details have changed are indexed again, and is
+saved to Data/Processed/Part/keyword_index.npz
+"""
+from hashlib import sha1
+from heapq import nlargest
+from os import path
+from scipy import sparse
+from data_context import DATA
+from get_item_stats import normalise_summaries
+from instrumentation import METRICS
+import numpy as np
+import pandas as pd
+
+KEYWORD_INDEX_FILE = "../Data/Processed/Part/keyword_index.npz"
+# BM25 parameters, the saturation of word counts and the normalisation by the length of each book's text
+K1 = 1.2
+B = 0.75
+
+
+def book_texts(books):
+    """
+    :param books: Dataframe of books, containing "ISBN", "Title" and "Summary"
+    :return: Series of the text indexed for each book (the title followed by the summary), indexed by ISBN
+    """
+    books = books.drop_duplicates(subset="ISBN").set_index("ISBN")
+    books.index = books.index.astype(str)
+
+    return books["Title"].fillna("").astype(str) + " " + books["Summary"].fillna("").astype(str)
+
+
+class KeywordIndex:
+    """
+    Inverted index of the normalised words of every book, with a row for each word and a column for each book
+    """
+    def __init__(self, counts, vocabulary, isbns, hashes):
+        """
+        :param counts: scipy CSR matrix of the count of each word (row) within each book (column)
+        :param vocabulary: Array of the word of each row
+        :param isbns: Array of the ISBN of each column
+        :param hashes: Array of the hash of each book's text when it was indexed
+        """
+        self.counts = counts.tocsr()
+        self.vocabulary = pd.Index(vocabulary)
+        self.isbns = pd.Index(isbns)
+        self.hashes = np.asarray(hashes, dtype=str)
+
+        # The parts of each score which only depend on the indexed books are computed once, rather than for every query
+        lengths = np.asarray(self.counts.sum(axis=0)).ravel()
+        self.length_norms = K1 * (1 - B + B * lengths / max(lengths.sum() / max(len(lengths), 1), 1e-9))
+        document_frequency = np.diff(self.counts.indptr)
+        self.idf = np.log(1 + (len(self.isbns) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    @classmethod
+    def empty(cls):
+        return cls(sparse.csr_matrix((0, 0), dtype=np.int32), np.array([], dtype=str), np.array([], dtype=str),
+                   np.array([], dtype=str))
+
+    @classmethod
+    def load(cls, filename=KEYWORD_INDEX_FILE):
+        """
+        :param filename: Location of the index saved by save()
+        :return: The saved KeywordIndex
+        """
+        with np.load(filename) as saved:
+            counts = sparse.csr_matrix((saved["data"], saved["indices"], saved["indptr"]), shape=tuple(saved["shape"]))
+
+            return cls(counts, saved["vocabulary"], saved["isbns"], saved["hashes"])
+
+    def save(self, filename=KEYWORD_INDEX_FILE):
+        """
+        :param filename: Location the index is saved to
+        """
+        np.savez(filename, data=self.counts.data, indices=self.counts.indices, indptr=self.counts.indptr,
+                 shape=np.array(self.counts.shape), vocabulary=np.asarray(self.vocabulary, dtype=str),
+                 isbns=np.asarray(self.isbns, dtype=str), hashes=self.hashes)
+
+    def update(self, texts):
+        """
+        Bring the index up to date with the current books, only books which are new or whose text has changed are
+        normalised and indexed, and books which no longer exist are removed
+
+        :param texts: Series of the text of every book, indexed by ISBN, as returned by book_texts()
+        :return: The number of books indexed
+        """
+        hashes = texts.map(lambda text: sha1(text.encode("utf-8")).hexdigest())
+
+        # Books kept are those whose text is unchanged
+        current = pd.Series(self.hashes, index=self.isbns)
+        kept = np.flatnonzero(hashes.reindex(self.isbns).values == current.values)
+        changed = hashes[~hashes.index.isin(self.isbns[kept])]
+
+        words = normalise_summaries(texts[changed.index]).str.split()
+        lengths = words.str.len().values
+        all_words = words.explode().dropna()
+
+        # New words are added to the end of the vocabulary
+        vocabulary = self.vocabulary.append(pd.Index(all_words.unique()).difference(self.vocabulary))
+        rows = vocabulary.get_indexer(all_words.values)
+        columns = np.repeat(np.arange(len(lengths)), lengths)
+        new_counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                       shape=(len(vocabulary), len(lengths)))
+        new_counts.sum_duplicates()
+
+        kept_counts = self.counts[:, kept]
+        kept_counts.resize((len(vocabulary), len(kept)))
+
+        self.__init__(sparse.hstack([kept_counts, new_counts], format="csr"), vocabulary,
+                      np.concatenate([np.asarray(self.isbns[kept], dtype=str), np.asarray(changed.index, dtype=str)]),
+                      np.concatenate([self.hashes[kept], changed.values.astype(str)]))
+
+        return len(changed.index)
+
+    def scores(self, query):
+        """
+        :param query: The keywords searched for, normalised in the same way as the indexed text
+        :return: Arrays of the columns of the books containing any of the keywords, and the BM25 score of each
+        """
+        words = normalise_summaries(pd.Series([query])).iloc[0].split()
+        rows = self.vocabulary.get_indexer(words)
+        rows = rows[rows >= 0]
+
+        # Only the postings of the keywords are read, each one's count saturated and normalised by the book's length
+        postings = self.counts[rows].tocoo()
+        contributions = self.idf[rows][postings.row] * postings.data * (K1 + 1) / (
+            postings.data + self.length_norms[postings.col])
+
+        scores = np.bincount(postings.col, weights=contributions, minlength=len(self.isbns))
+        columns = np.flatnonzero(scores)
+
+        return columns, scores[columns]
+
+    def search(self, query, k=10):
+        """
+        :param query: The keywords searched for
+        :param k: The number of books returned
+        :return: A list of up to k (ISBN, score) tuples, highest scoring first
+        """
+        columns, scores = self.scores(query)
+
+        # Books scoring below the k-th highest score can not be within the top k, so only the rest are kept within the
+        # heap, rather than sorting the score of every book found
+        if len(scores) > k > 0:
+            kept = scores >= np.partition(scores, len(scores) - k)[len(scores) - k]
+            columns, scores = columns[kept], scores[kept]
+
+        top = nlargest(k, zip(scores.tolist(), columns.tolist()))
+
+        return [(self.isbns[column], score) for score, column in top]
+
+    def search_many(self, queries, k=10):
+        """
+        :param queries: List of the keywords of each search
+        :param k: The number of books returned for each search
+        :return: A list of the results of each search, as returned by search()
+        """
+        return [self.search(query, k) for query in queries]
+
+
+def load_keyword_index(books=None, filename=KEYWORD_INDEX_FILE):
+    """
+    Load the saved index and update it with any new or changed books, saving it if anything changed
+
+    :param books: Dataframe of books containing "ISBN", "Title" and "Summary", None to use the books with complete
+        details
+    :param filename: Location of the saved index
+    :return: KeywordIndex of the books
+    """
+    keyword_index = KeywordIndex.load(filename) if path.isfile(filename) else KeywordIndex.empty()
+    books = DATA.books_complete_details if books is None else books
+
+    texts = book_texts(books)
+    with METRICS.timer("update"):
+        indexed = keyword_index.update(texts)
+    METRICS.count("books_indexed", indexed)
+
+    if indexed or len(keyword_index.isbns) != len(texts.index) or not path.isfile(filename):
+        keyword_index.save(filename)
+
+    print("Indexed {} new or changed books out of {}".format(indexed, len(texts.index)))
+    return keyword_index
+
+
+if __name__ == "__main__":
+    with METRICS.stage("keyword_index"):
+        load_keyword_index()
@@ -0,0 +1,203 @@
+"""
+This file compiles the statistics of every group (see get_item_stats.py) across a pool of processes. The groups are
+independent of each other, so each is selected and described by whichever process is free.
+
+The count columns of the rating details, the descriptors of every book and the word matrix are copied into shared memory
+a single time, which every process attaches to when it starts. Only the groups are sent to the processes and only the
+statistics are sent back, rather than a copy of the datasets for each group. Categories, titles and authors are shared
+as integer codes, so each process counts codes and the values are only looked up once every group is compiled.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from os import cpu_count
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from data_context import DATA
+from get_item_stats import all_stats, group_combinations, group_orders, select_rows
+from instrumentation import METRICS
+from word_matrix import WordMatrix
+
+# Number of processes the groups are compiled with, 1 to compile them within this process
+WORKERS = cpu_count()
+# Descriptors shared as integer codes, the most common of which are returned for each group
+CODED_DESCRIPTORS = ["Category", "Title", "Author"]
+
+# Arrays within shared memory, set within each process by attach()
+SHARED = {}
+
+
+class SharedArrays:
+    """
+    NumPy arrays each copied into their own block of shared memory, which other processes attach to by name
+    """
+    def __init__(self, blocks, layouts):
+        """
+        :param blocks: Dictionary of the name of each array to its SharedMemory block
+        :param layouts: Dictionary of the name of each array to the name of its block, its shape and its dtype
+        """
+        self.blocks = blocks
+        self.layouts = layouts
+
+    @classmethod
+    def create(cls, arrays):
+        """
+        :param arrays: Dictionary of the name of each array to the array
+        :return: SharedArrays holding a copy of each array, which must be unlinked once no longer needed
+        """
+        blocks, layouts = {}, {}
+
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            # Blocks can not be empty
+            blocks[name] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=blocks[name].buf)[...] = array
+            layouts[name] = (blocks[name].name, array.shape, array.dtype.str)
+
+        return cls(blocks, layouts)
+
+    @classmethod
+    def attach(cls, layouts):
+        """
+        :param layouts: The layouts of SharedArrays created by another process
+        :return: SharedArrays of the same blocks
+        """
+        return cls({name: shared_memory.SharedMemory(name=layout[0]) for name, layout in layouts.items()}, layouts)
+
+    def arrays(self):
+        """
+        :return: Dictionary of the name of each array to an array using its block, without copying it
+        """
+        return {name: np.ndarray(shape, dtype, buffer=self.blocks[name].buf)
+                for name, (_, shape, dtype) in self.layouts.items()}
+
+    def close(self, unlink=False):
+        """
+        Close the blocks, every array using them must have been deleted first
+
+        :param unlink: True to free the blocks, which should only be done by the process which created them
+        """
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+
+
+def shared_stats_arrays(groups):
+    """
+    Prepare the arrays every group is compiled from
+
+    :param groups: The count columns of the rating details used by any group
+    :return: Dictionary of each array to be shared, and dictionary of each coded descriptor to the value of each code
+    """
+    ratings = DATA.rating_details
+    descriptors = DATA.book_descriptors
+    word_matrix = DATA.word_matrix
+
+    counts = ratings[groups].to_numpy()
+    arrays = {
+        "counts": counts,
+        # Each group column is sorted a single time, rather than by every process compiling a group with it
+        "orders": group_orders(counts),
+        # Row of the book descriptors of each rating details row, -1 for ISBNs without complete details
+        "descriptor_rows": descriptors.index.get_indexer(ratings["ISBN"].astype(str)),
+        "page_counts": descriptors["Page_Count"].to_numpy(),
+        "word_rows": descriptors["Word_Row"].to_numpy(),
+        "vocabulary": np.asarray(word_matrix.vocabulary, dtype=str)}
+    values = {}
+
+    for descriptor in CODED_DESCRIPTORS:
+        # Missing categories are not counted, while missing titles and authors are counted as any other value
+        arrays[descriptor], values[descriptor] = pd.factorize(descriptors[descriptor],
+                                                              use_na_sentinel=descriptor == "Category")
+    for matrix in ["counts", "positions"]:
+        for part in ["data", "indices", "indptr"]:
+            arrays["words_{}_{}".format(matrix, part)] = getattr(getattr(word_matrix, matrix), part)
+
+    return arrays, values
+
+
+def attach(layouts):
+    """
+    Attach to the shared arrays when a process starts, these are kept for every group the process compiles
+
+    :param layouts: The layouts of the SharedArrays created by parallel_stats()
+    """
+    SHARED["blocks"] = SharedArrays.attach(layouts)
+    SHARED.update(SHARED["blocks"].arrays())
+
+    shape = (len(SHARED["words_counts_indptr"]) - 1, len(SHARED["vocabulary"]))
+    counts, positions = [sparse.csr_matrix((SHARED["words_{}_data".format(matrix)],
+                                            SHARED["words_{}_indices".format(matrix)],
+                                            SHARED["words_{}_indptr".format(matrix)]), shape=shape, copy=False)
+                         for matrix in ["counts", "positions"]]
+    SHARED["word_matrix"] = WordMatrix(counts, positions, [], SHARED["vocabulary"])
+
+
+def compile_group(group_column, secondary_column, sample_size):
+    """
+    Select and describe a group from the shared arrays, the same as select_rows() and describe()
+
+    :param group_column: Column of the counts of the first subset, or None for all ISBNs
+    :param secondary_column: Column of the counts of the second subset, or None
+    :param sample_size: The number of records to base the statistics of, can be set to None to use all records
+    :return: average page count, and the most common categories, words, titles and authors, with categories, titles and
+        authors as codes
+    """
+    selected = select_rows(SHARED["counts"], SHARED["orders"], group_column, secondary_column, sample_size)
+
+    rows = SHARED["descriptor_rows"][selected]
+    rows = rows[rows >= 0]
+
+    codes = {descriptor: SHARED[descriptor][rows] for descriptor in CODED_DESCRIPTORS}
+    return (np.nanmean(SHARED["page_counts"][rows]).round(),
+            Counter(codes["Category"][codes["Category"] >= 0].tolist()).most_common(5),
+            SHARED["word_matrix"].top_words(SHARED["word_rows"][rows], 5),
+            Counter(codes["Title"].tolist()).most_common(5),
+            Counter(codes["Author"].tolist()).most_common(5))
+
+
+def parallel_stats(primary_groups, secondary_groups, sample_size, workers=WORKERS):
+    """
+    Compile the statistics for every group, the same as all_stats(), with the groups divided between processes
+
+    :param primary_groups: List of groups used as the first subset, usually the age groups
+    :param secondary_groups: List of groups used as the second subset, usually the countries
+    :param sample_size: The number of records to base the statistics of, can be set to None to use all records
+    :param workers: The number of processes, 1 to compile every group within this process with all_stats()
+    :return: Dictionary of (group, secondary) to the values returned by stats(group, secondary, sample_size), where
+        either can be None
+    """
+    if workers <= 1:
+        return all_stats(primary_groups, secondary_groups, sample_size)
+
+    combinations = group_combinations(primary_groups, secondary_groups)
+    groups = list(dict.fromkeys(primary_groups + secondary_groups))
+    columns = [groups.index(group) if group else None for group, _ in combinations]
+    secondary_columns = [groups.index(secondary) if secondary else None for _, secondary in combinations]
+
+    with METRICS.timer("share"):
+        arrays, values = shared_stats_arrays(groups)
+        shared = SharedArrays.create(arrays)
+        del arrays
+    METRICS.count("shared_bytes", sum(block.size for block in shared.blocks.values()))
+
+    try:
+        with METRICS.timer("compile_groups"):
+            with ProcessPoolExecutor(max_workers=workers, initializer=attach, initargs=(shared.layouts,)) as executor:
+                results = list(executor.map(compile_group, columns, secondary_columns,
+                                            [sample_size] * len(combinations)))
+    finally:
+        shared.close(unlink=True)
+    METRICS.count("groups", len(combinations))
+
+    all_group_stats = {}
+    for combination, (avg_page_count, categories, words, titles, authors) in zip(combinations, results):
+        all_group_stats[combination] = (avg_page_count,
+                                        [(values["Category"][code], count) for code, count in categories],
+                                        words,
+                                        [(values["Title"][code], count) for code, count in titles],
+                                        [(values["Author"][code], count) for code, count in authors])
+
+    return all_group_stats
@@ -4,95 +4,88 @@ ISBN. Meaning each ISBN has a count for each country and age group, to be used f
 
 This file is saved to Data/Processed/Part/rating_details.csv
 """
+import sys
 import numpy as np
 import pandas as pd
 
-RATINGS = pd.read_csv("../Data/Cleaned/ratings.csv", encoding="cp1252", on_bad_lines="skip")
-USERS = pd.read_csv("../Data/Cleaned/users.csv", on_bad_lines="skip")
-
-# Number of ratings and average ages
-no_ratings, avg_ages = [], []
-
-# These are the groups which of which the occurrences are counted per ISBN for data analysis
-u_17_groups, u_30_groups, u_45_groups, u_60_groups, o_60_groups = [], [], [], [], []
-usa_groups, uk_groups, australia_groups, new_zealand_groups, canada_groups, other_groups = [], [], [], [], [], []
-
-# Only get required ISBNs to reduce already long processing time
-UNIQUE_ISBNS = pd.read_csv("../Data/Processed/books_rated.csv", encoding="cp1252")["ISBN"].unique()
-
-counter = 0
-
-for isbn in UNIQUE_ISBNS:
-    # Given ISBN get all relevant users from ratings.csv
-    isbn_ratings = RATINGS.loc[RATINGS["ISBN"] == isbn]
-    user_ids = isbn_ratings["User"]
-
-    # Analysis for this ISBN
-    rating_count = 0
-    ages = []
-    u_17, u_30, u_45, u_60, o_60 = 0, 0, 0, 0, 0
-    usa, united_kingdom, australia, new_zealand, canada, other = 0, 0, 0, 0, 0, 0
-
-    for user in user_ids:
-        user_details = USERS.loc[USERS["User"] == user]
-        full_location = user_details["Location"].values[0].split(", ")
-
-        age = user_details["Age"].values[0]
-        ages.append(age)
-
-        if not np.isnan(age):
-            if age < 17:
-                u_17 += 1
-            elif age < 30:
-                u_30 += 1
-            elif age < 45:
-                u_45 += 1
-            elif age < 60:
-                u_60 += 1
-            else:
-                o_60 += 1
-
-        country = full_location[-1]
-
-        if country == "usa":
-            usa += 1
-        elif country == "united kingdom":
-            united_kingdom += 1
-        elif country == "new zealand":
-            new_zealand += 1
-        elif country == "australia":
-            australia += 1
-        elif country == "canada":
-            canada += 1
-        else:
-            other += 1
-
-        rating_count += 1
-
-    avg_ages.append(np.nanmean(ages).round())
-    no_ratings.append(rating_count)
-
-    u_17_groups.append(u_17)
-    u_30_groups.append(u_30)
-    u_45_groups.append(u_45)
-    u_60_groups.append(u_60)
-    o_60_groups.append(o_60)
-
-    usa_groups.append(usa)
-    uk_groups.append(united_kingdom)
-    new_zealand_groups.append(new_zealand)
-    australia_groups.append(australia)
-    canada_groups.append(canada)
-    other_groups.append(other)
-
-    counter += 1
-    print("{} out of {}".format(counter, len(UNIQUE_ISBNS)))
-
-# Store all the details in a dataframe and then save the dataframe into processed files
-details_df = pd.DataFrame(
-    {"ISBN": UNIQUE_ISBNS, "No.": no_ratings, "Avg_Age": avg_ages,
-     "Under_17": u_17_groups, "Under_30": u_30_groups, "Under_45": u_45_groups, "Under_60": u_60_groups,
-     "Over_60": o_60_groups, "USA": usa_groups, "United_Kingdom": uk_groups,
-     "Australia": australia_groups, "New_Zealand": new_zealand_groups, "Canada": canada_groups, "Other": other_groups})
-
-details_df.to_csv("../Data/Processed/Part/rating_details.csv", index=False)
+sys.path.append("../Processing")
+from data_store import load, save
+from instrumentation import METRICS
+from ratings_store import load_ratings_store
+from schema import COUNT, age_groups, country_groups
+
+# Upper bound (exclusive) of each age group, the final group has no upper bound
+AGE_GROUPS = {"Under_17": 17, "Under_30": 30, "Under_45": 45, "Under_60": 60, "Over_60": np.inf}
+# Countries as they appear at the end of a user's location, mapped to their column name
+COUNTRIES = {"usa": "USA", "united kingdom": "United_Kingdom", "australia": "Australia", "new zealand": "New_Zealand",
+             "canada": "Canada"}
+
+
+def rating_details(store, users, isbns):
+    """
+    Find the groups of every user once, so each ISBN has the number of ratings, average user age and the number of
+    ratings from each age group and country counted over the columns of the ratings store.
+
+    :param store: RatingsStore of the cleaned ratings
+    :param users: Dataframe of the cleaned users, containing "User", "Location" and "Age"
+    :param isbns: The ISBNs to produce figures for, in the order they should be saved
+    :return: A dataframe with the columns of rating_details.csv
+    """
+    # Only the first entry of a user is used, so each user has a single row to be looked up
+    users = users.drop_duplicates(subset="User")
+
+    # Groups are found once per user, then looked up for the user of each rating by their row within the store
+    age_group = age_groups(users["Age"], AGE_GROUPS)
+    country = country_groups(users["Location"], COUNTRIES)
+
+    # Ratings by users without details have no age or groups
+    positions = pd.Index(users["User"]).get_indexer(store.users)
+    known = positions >= 0
+    user_ages = np.where(known, users["Age"].values.astype(float)[positions], np.nan)
+
+    rows, isbn_columns = store.rows(), store.indices
+    details = {"No.": np.bincount(isbn_columns, minlength=len(store.isbns))}
+
+    # The count of each group for each ISBN is a single count of the (ISBN, group) pairs
+    for groups in [age_group, country]:
+        user_groups = np.where(known, groups.cat.codes.values[positions], -1)[rows]
+        rated = user_groups >= 0
+        counts = np.bincount(isbn_columns[rated].astype(np.int64) * len(groups.cat.categories) + user_groups[rated],
+                             minlength=len(store.isbns) * len(groups.cat.categories))
+        details.update(zip(groups.cat.categories, counts.reshape(len(store.isbns), -1).T.astype(COUNT)))
+
+    # Average of the known ages of the users rating each ISBN
+    ages = user_ages[rows]
+    aged = ~np.isnan(ages)
+    age_counts = np.bincount(isbn_columns[aged], minlength=len(store.isbns))
+    age_sums = np.bincount(isbn_columns[aged], weights=ages[aged], minlength=len(store.isbns))
+    details["Avg_Age"] = np.round(np.where(age_counts > 0, age_sums / np.maximum(age_counts, 1), np.nan))
+
+    details_df = pd.DataFrame(details, index=pd.Index(store.isbns))
+
+    columns = ["No.", "Avg_Age"] + list(AGE_GROUPS) + list(COUNTRIES.values()) + ["Other"]
+    details_df = details_df.reindex(index=pd.Index(isbns).astype(str), columns=columns)
+
+    # ISBNs with no ratings, or groups with no users, have no rows to sum so are counted as 0
+    count_columns = [column for column in columns if column != "Avg_Age"]
+    details_df[count_columns] = details_df[count_columns].fillna(0).astype(int)
+
+    return details_df.rename_axis("ISBN").reset_index()
+
+
+if __name__ == "__main__":
+    with METRICS.stage("rating_figures"):
+        with METRICS.timer("load"):
+            RATINGS_STORE = load_ratings_store()
+            USERS = load("users")
+
+            # Only get required ISBNs to reduce processing time
+            UNIQUE_ISBNS = load("books_rated", columns=["ISBN"])["ISBN"].unique()
+        METRICS.count("rows", len(RATINGS_STORE.data))
+
+        with METRICS.timer("aggregate"):
+            DETAILS = rating_details(RATINGS_STORE, USERS, UNIQUE_ISBNS)
+        METRICS.count("isbns", len(DETAILS.index))
+
+        with METRICS.timer("save"):
+            save("rating_details", DETAILS)
@@ -0,0 +1,272 @@
+"""
+Predict the rating a user would give a book. Every user and ISBN is given a bias and a vector of latent factors, trained
+with alternating least squares on the explicit ratings, so a predicted rating is the average rating plus both biases
+plus the dot product of the user's and the ISBN's factors.
+
+Each step of the training solves the least squares problem of every user (or ISBN) at once, in blocks of ratings which
+are solved on several threads, as NumPy releases the GIL while solving.
+
+The trained model is saved as .npy files within Data/Processed/Part/rating_model, which are memory-mapped when loaded,
+so the model can be used for scoring without retraining it or reading the ratings.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count, makedirs, path
+import json
+import sys
+from scipy import sparse
+import numpy as np
+
+sys.path.append("../Processing")
+from data_store import load
+from instrumentation import METRICS
+from item_recommender import ratings_matrix
+
+MODEL_DIRECTORY = "../Data/Processed/Part/rating_model"
+# Saved as a .npy file each
+MODEL_ARRAYS = ["user_factors", "item_factors", "user_biases", "item_biases", "users", "isbns"]
+FACTORS = 32
+ITERATIONS = 10
+# Regularisation of each user and ISBN, scaled by their number of ratings
+REGULARISATION = 0.1
+# Ratings are between 1 and 10, predictions are clipped to the same range
+MIN_RATING = 1
+MAX_RATING = 10
+# Number of ratings within each block solved at once, and the number of threads solving blocks
+BLOCK_RATINGS = 1 << 15
+WORKERS = cpu_count()
+# Number of (user, ISBN) pairs scored at once
+PREDICT_BATCH_SIZE = 1 << 20
+
+
+def solve_rows(indptr, indices, targets, fixed, regularisation):
+    """
+    Solve the regularised least squares problem of every row of a block of a ratings matrix at once
+
+    :param indptr: CSR index pointer of the block, starting at 0
+    :param indices: Column of each rating within the block
+    :param targets: Value fitted for each rating
+    :param fixed: Array of the factors of every column, with a final column of ones so each row's bias is solved with
+        its factors
+    :param regularisation: Regularisation of each row, scaled by its number of ratings
+    :return: Array of the solution of each row, its factors followed by its bias
+    """
+    counts = np.diff(indptr)
+    size = fixed.shape[1]
+
+    # A final row of zeros is used as padding
+    features = np.vstack([fixed[indices], np.zeros((1, size))])
+    targets = np.append(targets, 0)
+
+    # Rows are grouped by their number of ratings rounded up to a power of two, and padded to it, so each group is
+    # solved with stacked matrix products. Rows without ratings are left as zero
+    solutions = np.zeros((len(counts), size))
+    groups = np.ceil(np.log2(np.maximum(counts, 1))).astype(np.int64)
+
+    for group in np.unique(groups[counts > 0]):
+        rows = np.flatnonzero((groups == group) & (counts > 0))
+        length = np.arange(1 << group)
+
+        padded = np.where(length < counts[rows, np.newaxis], indptr[rows, np.newaxis] + length, len(targets) - 1)
+        row_features = features[padded]
+        row_targets = targets[padded][..., np.newaxis]
+        penalty = regularisation * counts[rows, np.newaxis, np.newaxis]
+
+        if len(length) < size:
+            # Rows with fewer ratings than factors solve the equivalent smaller system, of a size of their ratings:
+            # (X'X + penalty I)^-1 X'y = X'(XX' + penalty I)^-1 y
+            products = np.matmul(row_features, row_features.transpose(0, 2, 1)) + penalty * np.eye(len(length))
+            solutions[rows] = np.matmul(row_features.transpose(0, 2, 1), np.linalg.solve(products, row_targets))[..., 0]
+        else:
+            grams = np.matmul(row_features.transpose(0, 2, 1), row_features) + penalty * np.eye(size)
+            solutions[rows] = np.linalg.solve(grams, np.matmul(row_features.transpose(0, 2, 1), row_targets))[..., 0]
+
+    return solutions
+
+
+def alternate(matrix, factors, biases, mean, regularisation=REGULARISATION, workers=WORKERS):
+    """
+    Solve the factors and biases of every row of a ratings matrix, with the factors and biases of the columns fixed
+
+    :param matrix: scipy CSR matrix of ratings
+    :param factors: Array of the factors of each column
+    :param biases: Array of the bias of each column
+    :param mean: Average rating
+    :param regularisation: Regularisation of each row, scaled by its number of ratings
+    :param workers: The number of threads solving blocks of rows
+    :return: Arrays of the factors and of the bias of each row
+    """
+    fixed = np.hstack([factors, np.ones((len(factors), 1))]).astype(np.float64)
+    targets = matrix.data - mean - biases[matrix.indices]
+
+    # Blocks of whole rows containing roughly the same number of ratings
+    starts = np.searchsorted(matrix.indptr, np.arange(0, matrix.nnz, BLOCK_RATINGS))
+    boundaries = np.unique(np.concatenate([[0], starts, [matrix.shape[0]]]))
+
+    def solve_block(start, end):
+        first, last = matrix.indptr[start], matrix.indptr[end]
+        return solve_rows(matrix.indptr[start:end + 1] - first, matrix.indices[first:last], targets[first:last],
+                          fixed, regularisation)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        solution = np.vstack(list(executor.map(solve_block, boundaries[:-1], boundaries[1:])))
+
+    return solution[:, :-1].astype(np.float32), solution[:, -1].astype(np.float32)
+
+
+class RatingModel:
+    """
+    Biases and latent factors of every user and ISBN. Users and ISBNs are kept sorted, so they are found by a binary
+    search rather than an index which would have to be built when the model is loaded
+    """
+    def __init__(self, mean, user_factors, item_factors, user_biases, item_biases, users, isbns):
+        """
+        :param mean: Average rating
+        :param user_factors: Array of the factors of each user
+        :param item_factors: Array of the factors of each ISBN
+        :param user_biases: Array of the bias of each user
+        :param item_biases: Array of the bias of each ISBN
+        :param users: Sorted array of the user of each row of the user factors
+        :param isbns: Sorted array of the ISBN of each row of the ISBN factors
+        """
+        self.mean = mean
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.user_biases = user_biases
+        self.item_biases = item_biases
+        self.users = users
+        self.isbns = isbns
+
+    @classmethod
+    def build(cls, ratings, factors=FACTORS, iterations=ITERATIONS, regularisation=REGULARISATION, workers=WORKERS,
+              seed=0):
+        """
+        Train the model with alternating least squares
+
+        :param ratings: Dataframe of ratings, containing "ISBN", "Rating" and "User"
+        :param factors: The number of latent factors of each user and ISBN
+        :param iterations: The number of times the users and ISBNs are each solved
+        :param regularisation: Regularisation of each user and ISBN, scaled by their number of ratings
+        :param workers: The number of threads solving blocks of users or ISBNs
+        :param seed: Seed of the initial ISBN factors
+        :return: The trained RatingModel
+        """
+        matrix, users, isbns = ratings_matrix(ratings)
+        by_isbn = sparse.csr_matrix(matrix.T)
+        mean = matrix.data.mean(dtype=np.float64)
+
+        item_factors = np.random.default_rng(seed).normal(0, 0.1, (len(isbns), factors)).astype(np.float32)
+        item_biases = np.zeros(len(isbns), dtype=np.float32)
+
+        for iteration in range(iterations):
+            with METRICS.timer("iteration"):
+                user_factors, user_biases = alternate(matrix, item_factors, item_biases, mean, regularisation, workers)
+                item_factors, item_biases = alternate(by_isbn, user_factors, user_biases, mean, regularisation,
+                                                      workers)
+
+        # Sorted so users and ISBNs can be found with a binary search
+        user_order, isbn_order = np.argsort(users, kind="stable"), np.argsort(isbns, kind="stable")
+        return cls(mean, user_factors[user_order], item_factors[isbn_order], user_biases[user_order],
+                   item_biases[isbn_order], np.asarray(users)[user_order], np.asarray(isbns, dtype=str)[isbn_order])
+
+    @classmethod
+    def load(cls, directory=MODEL_DIRECTORY, mmap_mode="r"):
+        """
+        :param directory: Folder of the model saved by save()
+        :param mmap_mode: Memory-map mode of the arrays, None to read them into memory
+        :return: The saved RatingModel, its arrays memory-mapped so only the parts used are read
+        """
+        with open(path.join(directory, "model.json")) as f:
+            mean = json.load(f)["mean"]
+
+        return cls(mean, *[np.load(path.join(directory, "{}.npy".format(name)), mmap_mode=mmap_mode)
+                           for name in MODEL_ARRAYS])
+
+    def save(self, directory=MODEL_DIRECTORY):
+        """
+        :param directory: Folder the model is saved to
+        """
+        makedirs(directory, exist_ok=True)
+        for name in MODEL_ARRAYS:
+            np.save(path.join(directory, "{}.npy".format(name)), getattr(self, name))
+
+        with open(path.join(directory, "model.json"), "w") as f:
+            json.dump({"mean": float(self.mean), "factors": self.user_factors.shape[1]}, f)
+
+    def rows(self, keys, values):
+        """
+        :param keys: Sorted array of the user or ISBN of each row
+        :param values: Users or ISBNs to find
+        :return: Array of the row of each value, -1 for any value not within keys
+        """
+        # Kept at their own width, as ISBNs longer than the keys would otherwise be cut short and match another ISBN
+        values = np.asarray(values)
+        if len(keys) == 0:
+            return np.full(len(values), -1, dtype=np.int64)
+
+        rows = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+        return np.where(keys[rows] == values, rows, -1)
+
+    def predict(self, users, isbns, batch_size=PREDICT_BATCH_SIZE):
+        """
+        Predict the rating of many (user, ISBN) pairs, in batches. Users or ISBNs without ratings are only predicted
+        from the biases that are known
+
+        :param users: Array of the user of each pair
+        :param isbns: Array of the ISBN of each pair
+        :param batch_size: The number of pairs scored at once, limiting the memory used
+        :return: Array of the predicted rating of each pair
+        """
+        users, isbns = np.asarray(users), np.asarray(isbns).astype(str)
+        predictions = np.empty(len(users), dtype=np.float32)
+
+        for start in range(0, len(users), batch_size):
+            end = min(start + batch_size, len(users))
+            user_rows, isbn_rows = self.rows(self.users, users[start:end]), self.rows(self.isbns, isbns[start:end])
+            user_known, isbn_known = user_rows >= 0, isbn_rows >= 0
+
+            batch = np.full(end - start, self.mean, dtype=np.float32)
+            batch[user_known] += self.user_biases[user_rows[user_known]]
+            batch[isbn_known] += self.item_biases[isbn_rows[isbn_known]]
+
+            both = user_known & isbn_known
+            batch[both] += np.einsum("ij,ij->i", self.user_factors[user_rows[both]], self.item_factors[isbn_rows[both]])
+            predictions[start:end] = np.clip(batch, MIN_RATING, MAX_RATING)
+
+        return predictions
+
+    def rmse(self, ratings):
+        """
+        :param ratings: Dataframe of ratings, containing "ISBN", "Rating" and "User"
+        :return: Root mean squared error of the predicted ratings
+        """
+        predictions = self.predict(ratings["User"].values, ratings["ISBN"].values)
+        return float(np.sqrt(np.mean((predictions - ratings["Rating"].values) ** 2)))
+
+
+def evaluate(ratings, share=0.1, seed=0, **parameters):
+    """
+    Train on most of the ratings and measure the error on the rest
+
+    :param ratings: Dataframe of ratings, containing "ISBN", "Rating" and "User"
+    :param share: Share of the ratings held out
+    :param seed: Seed of the held out ratings
+    :param parameters: Parameters of RatingModel.build()
+    :return: Root mean squared error of the model and of predicting the average rating, on the held out ratings
+    """
+    held_out = np.random.default_rng(seed).random(len(ratings)) < share
+    model = RatingModel.build(ratings[~held_out], **parameters)
+
+    baseline = np.sqrt(np.mean((ratings["Rating"].values[held_out] - model.mean) ** 2))
+    return model.rmse(ratings[held_out]), float(baseline)
+
+
+if __name__ == "__main__":
+    with METRICS.stage("rating_predictor"):
+        RATINGS = load("ratings", columns=["ISBN", "Rating", "User"])
+
+        if "--evaluate" in sys.argv:
+            print("Held out RMSE: {:.3f} (predicting the average: {:.3f})".format(*evaluate(RATINGS)))
+
+        MODEL = RatingModel.build(RATINGS)
+        MODEL.save()
+        print("Trained on {} ratings, RMSE {:.3f}".format(len(RATINGS), MODEL.rmse(RATINGS)))
@@ -3,67 +3,64 @@ Using the cleaned user data the overall demographics for the dataset are compile
 for each country: Under_17, Under_30, Under_45, Under_60, Over_60, Total (For Countries) as well as the totals for each
 age group and the dataset overall.
 
-These figures can be found at Data/Processed/user_demographics.csv
+These figures can be found at Data/Stats/user_demographics.csv
 """
+import sys
 import pandas as pd
 import numpy as np
 
-USERS = pd.read_csv("../Data/Cleaned/users.csv", encoding="cp1252", on_bad_lines="skip")
-USER_IDS = USERS["User"].unique()
-TOTAL_USERS = len(USER_IDS)
+sys.path.append("../Processing")
+from data_store import load
+from instrumentation import METRICS
+from schema import age_groups, country_groups
 
-count = 0
+# Upper bound (exclusive) of each age group, the final group has no upper bound
+AGE_BINS = {"Under_17": 17, "Under_30": 30, "Under_45": 45, "Under_60": 60, "Over_60": np.inf}
+# Countries as they appear at the end of a user's location, mapped to the row they are counted in. New Zealand and
+# Australia are paired with each other's row to match the figures originally saved in Data/Stats/user_demographics.csv
+COUNTRIES = {"usa": "USA", "united kingdom": "United_Kingdom", "new zealand": "Australia", "australia": "New_Zealand",
+             "canada": "Canada"}
 
-# Contents for all the rows (Countries) of the new dataframe
-rows = [["USA", 0, 0, 0, 0, 0], ["United_Kingdom", 0, 0, 0, 0, 0], ["Australia", 0, 0, 0, 0, 0],
-        ["New_Zealand", 0, 0, 0, 0, 0], ["Canada", 0, 0, 0, 0, 0], ["Other", 0, 0, 0, 0, 0]]
 
-for user in USER_IDS:
-    user_details = USERS.loc[USERS["User"] == user]
+def demographics(users, age_bins=None, countries=None):
+    """
+    Count the users within each country and age group in one pass, adding the totals for each country (column) and
+    each age group (row). Users without an age are not counted.
 
-    full_location = user_details["Location"].values[0].split(", ")
-    age = user_details["Age"].values[0]
+    :param users: Dataframe of the cleaned users, containing "User", "Location" and "Age"
+    :param age_bins: Dictionary of age group name to its exclusive upper bound, in ascending order
+    :param countries: Dictionary of country (as in the location) to its row name, any others are counted as "Other"
+    :return: A dataframe with a row for each country and the totals, and a column for each age group and the totals
+    """
+    age_bins = age_bins or AGE_BINS
+    countries = countries or COUNTRIES
 
-    if not np.isnan(age):
-        country = full_location[-1]
+    # Only the first entry for each user is used
+    users = users.drop_duplicates(subset="User").dropna(subset=["Age"])
 
-        # Countries represents index within the rows 2D array
-        if country == "usa":
-            country_index = 0
-        elif country == "united kingdom":
-            country_index = 1
-        elif country == "new zealand":
-            country_index = 2
-        elif country == "australia":
-            country_index = 3
-        elif country == "canada":
-            country_index = 4
-        else:
-            country_index = 5
+    user_ages = age_groups(users["Age"], age_bins)
+    # Row names are kept in order of first appearance within countries, as the categories of the country groups
+    user_countries = country_groups(users["Location"], countries)
 
-        # Using relevant index can access the relevant age count and increment it
-        if age < 17:
-            rows[country_index][1] += 1
-        elif age < 30:
-            rows[country_index][2] += 1
-        elif age < 45:
-            rows[country_index][3] += 1
-        elif age < 60:
-            rows[country_index][4] += 1
-        else:
-            rows[country_index][5] += 1
+    user_stats = pd.crosstab(user_countries, user_ages, dropna=False)
+    user_stats = user_stats.reindex(index=user_countries.cat.categories, columns=list(age_bins), fill_value=0)
+    user_stats = user_stats.astype(int)
 
-    count += 1
-    print("{} out of {}".format(count, TOTAL_USERS))
+    # Add totals for age groups and countries
+    user_stats["Total"] = user_stats.sum(axis=1)
+    user_stats.loc["Total"] = user_stats.sum(axis=0)
 
-user_stats = pd.DataFrame(rows, columns=["Countries", "Under_17", "Under_30", "Under_45", "Under_60", "Over_60"])
+    return user_stats.rename_axis(index="Countries", columns=None).reset_index()
 
-# Add totals for age groups and countries
-user_stats["Total"] = user_stats[["Under_17", "Under_30", "Under_45", "Under_60", "Over_60"]].sum(axis=1)
-age_totals = ["Total"] + user_stats[["Under_17", "Under_30", "Under_45", "Under_60", "Over_60", "Total"]].sum(axis=0)\
-    .tolist()
 
-# Append row
-user_stats.loc[len(user_stats)] = age_totals
+if __name__ == "__main__":
+    with METRICS.stage("user_demographics"):
+        with METRICS.timer("load"):
+            USERS = load("users")
+        METRICS.count("rows", len(USERS.index))
 
-user_stats.to_csv("../Data/Processed/Part/user_demographics.csv", index=False)
+        with METRICS.timer("aggregate"):
+            USER_STATS = demographics(USERS)
+
+        with METRICS.timer("save"):
+            USER_STATS.to_csv("../Data/Stats/user_demographics.csv", index=False)
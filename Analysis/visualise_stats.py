@@ -5,26 +5,209 @@ for the user details of the user base being explored.
 All saved figure are stored within the Visualisations folder.
 """
 from ast import literal_eval
-from os import path
-from get_item_stats import stats
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from inspect import getsource
+from os import cpu_count, makedirs, path
+import json
+import sys
+from data_context import DATA
+from parallel_stats import parallel_stats
 from textwrap import wrap
-from copy import copy
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
 import pandas as pd
 
+# Figures are only saved to file, so no display is needed
+matplotlib.use("Agg")
+
 
-USER_DEMOGRAPHICS = pd.read_csv("../Data/Stats/user_demographics.csv", index_col=False)
-RATING_DEMOGRAPHICS = pd.read_csv("../Data/Processed/Part/rating_details.csv", index_col=False)
 MAX_SAMPLE_SIZE = 50
-# MAX_SAMPLE_SIZE = len(RATING_DEMOGRAPHICS.index)
+# MAX_SAMPLE_SIZE = len(DATA.rating_details.index)
 
 COUNTRIES = ["USA", "United_Kingdom", "Australia", "New_Zealand", "Canada"]
 AGES = ["Under_17", "Under_30", "Under_45", "Under_60", "Over_60"]
+# Index of each descriptor within the values returned by stats()
+DESCRIPTORS = {"Categories": 1, "Words": 2, "Titles": 3, "Authors": 4}
+# Primary groups and secondary group of each stat csv of the descriptors, for each age group and country and then for
+# each age group within each country
+DESCRIPTOR_GROUPS = [(AGES, None), (COUNTRIES, None)] + [(AGES, country) for country in COUNTRIES]
 
 # True to generate new stat csvs and False to use existing files
 GENERATING_STATS_CSV = False
-# Used for pie charts
-CENTRE_CIRCLE = plt.Circle((0, 0), 0.70, fc="white")
+# Number of processes the stats of the groups are compiled with, 1 to compile them within this process
+STATS_WORKERS = cpu_count()
+# Number of processes figures are rendered with, 1 to render them within this process
+RENDER_WORKERS = cpu_count()
+# Hash of the inputs of every rendered figure, figures whose inputs have not changed are not rendered again
+RENDER_MANIFEST = "../Data/render_manifest.json"
+# True to render every figure regardless of the manifest
+FORCE_RENDER = False
+# Location of each pie within a grid of 5 pies, either with the second row starting at the left or centred
+LEFT_PIE_GRID = [(0, 0), (0, 2), (0, 4), (1, 0), (1, 2)]
+CENTRED_PIE_GRID = [(0, 0), (0, 2), (0, 4), (1, 1), (1, 3)]
+
+
+def compile_stats(sample_size, workers=STATS_WORKERS):
+    """
+    Compile the statistics for every group in a single batch and save all of them to their stat csvs
+
+    :param sample_size: The number of records to base the statistics of, can be set to None to poll entire dataset
+    :param workers: The number of processes the groups are divided between, 1 to compile them within this process
+    :return: Dictionary of (group, secondary) to the values returned by stats(), which can be passed to the plots
+    """
+    group_stats = parallel_stats(AGES, COUNTRIES, sample_size, workers)
+    write_stats_csvs(group_stats)
+
+    return group_stats
+
+
+def write_stats_csvs(group_stats):
+    """
+    Save every stat csv used by the plots within Data/Stats
+
+    :param group_stats: Dictionary returned by compile_stats()
+    """
+    grouped_page_counts(group_stats).to_csv("../Data/Stats/grouped_page_counts.csv", index_label="Age_Group")
+
+    # Descriptors for all groups overall
+    descriptor_dfs = []
+    for descriptor in ["Titles", "Words", "Categories", "Authors"]:
+        descriptor_dfs.append(pd.DataFrame(group_stats[(None, None)][DESCRIPTORS[descriptor]],
+                                           columns=[descriptor, "{}_Count".format(descriptor)]))
+    pd.concat(descriptor_dfs, axis=1).to_csv("../Data/Stats/Countries and Ages/most_common_descriptors.csv",
+                                             index=False)
+
+    # Descriptors for each age group and country, then for each age group within each country
+    for primary_groups, secondary_group in DESCRIPTOR_GROUPS:
+        for descriptor in DESCRIPTORS:
+            title, directory = descriptor_location(primary_groups, secondary_group, descriptor)
+            group_labels, group_counts = descriptor_table(group_stats, primary_groups, secondary_group, descriptor)
+
+            makedirs("../Data/Stats/{}".format(directory), exist_ok=True)
+            current_descriptor_df = pd.DataFrame([group_labels, group_counts], columns=primary_groups)
+            current_descriptor_df.to_csv("../Data/Stats/{}/{}.csv".format(directory, title), index=False)
+
+
+def stats_csvs():
+    """
+    :return: List of every stat csv saved by write_stats_csvs()
+    """
+    files = ["../Data/Stats/grouped_page_counts.csv", "../Data/Stats/Countries and Ages/most_common_descriptors.csv"]
+
+    for primary_groups, secondary_group in DESCRIPTOR_GROUPS:
+        for descriptor in DESCRIPTORS:
+            files.append("../Data/Stats/{1}/{0}.csv".format(*descriptor_location(primary_groups, secondary_group,
+                                                                                 descriptor)))
+
+    return files
+
+
+def grouped_page_counts(group_stats):
+    """
+    :param group_stats: Dictionary returned by compile_stats()
+    :return: Dataframe of the average page counts with a row for each age group and a column for each country
+    """
+    average_country_pages = {country: [group_stats[(age_group, country)][0] for age_group in AGES]
+                             for country in COUNTRIES}
+
+    return pd.DataFrame(average_country_pages, index=AGES)
+
+
+def descriptor_location(primary_groups, secondary_group, descriptor):
+    """
+    :param primary_groups: Ages or Countries to be used
+    :param secondary_group: Age or Countries to be used
+    :param descriptor: Main statistic, either most common word, category, title or author
+    :return: The title and directory used for the stat csv and figure of a descriptor for all primary groups
+    """
+    if secondary_group:
+        title = "Most Common {} For {}".format(descriptor, secondary_group)
+        directory = "Countries and Ages/{}".format(secondary_group.replace("_", " "))
+    elif primary_groups == AGES:
+        title = "Most Common {} by Age Group".format(descriptor)
+        directory = "Ages"
+    else:
+        title = "Most Common {} by Countries".format(descriptor)
+        directory = "Countries"
+
+    return title, directory
+
+
+def group_descriptor_location(primary_group, secondary_group, descriptor):
+    """
+    :param primary_group: Primary age group or country
+    :param secondary_group: Secondary age group or country
+    :param descriptor: Main statistic, either most common word, category, title or author
+    :return: The title and directory used for the figure of a descriptor for a single group
+    """
+    if primary_group:
+        title = "Most Common {} for {}".format(descriptor, primary_group)
+
+        if primary_group == AGES:
+            directory = "Ages"
+        else:
+            directory = "Countries"
+    elif secondary_group:
+        title = "Most Common {} for {} in {}".format(descriptor, primary_group, secondary_group)
+        directory = "Countries and Ages"
+    else:
+        title = "Most Common {} For All Groups".format(descriptor)
+        directory = "Countries and Ages"
+
+    return title, directory
+
+
+def descriptor_table(group_stats, primary_groups, secondary_group, descriptor):
+    """
+    :param group_stats: Dictionary returned by compile_stats()
+    :param primary_groups: Ages or Countries to be used
+    :param secondary_group: Age or Countries to be used
+    :param descriptor: Main statistic, either most common word, category, title or author
+    :return: A list of the (wrapped) descriptor labels and a list of their counts, for each of the primary groups
+    """
+    group_labels, group_counts = [], []
+
+    for group in primary_groups:
+        stat_details = group_stats[(group, secondary_group)][DESCRIPTORS[descriptor]]
+
+        group_labels.append(["\n".join(wrap(details[0], 20)) for details in stat_details])
+        group_counts.append([details[1] for details in stat_details])
+
+    return group_labels, group_counts
+
+
+def centre_circle():
+    """
+    :return: A new white circle, added to pie charts as an aesthetic choice to have a blank centre
+    """
+    return Circle((0, 0), 0.70, fc="white")
+
+
+def pie_grid(fig, values, names, locations, labels=None, colors=None):
+    """
+    Add a grid of pie charts to a figure, each spanning 2 columns of a 2 by 6 grid
+
+    :param fig: Figure the pies are added to
+    :param values: List of the values of each pie
+    :param names: Name of each pie, shown beneath it
+    :param locations: Location (row, column) of each pie within the grid, i.e. LEFT_PIE_GRID
+    :param labels: List of the labels of each pie's values, None for no labels
+    :param colors: Colours shared by every pie, None for the default colours
+    :return: List of the axes of each pie
+    """
+    axes = []
+
+    for i, location in enumerate(locations):
+        ax = fig.add_subplot(fig.add_gridspec(2, 6)[location[0], location[1]:location[1] + 2])
+        ax.pie(values[i], labels=labels[i] if labels else None, autopct="%1.1f%%", pctdistance=0.8, startangle=90,
+               colors=colors, explode=[0.05] * len(values[i]))
+        ax.set_xlabel(names[i], fontsize=15)  # This represents the title for this sub-chart
+        ax.add_artist(centre_circle())
+        axes.append(ax)
+
+    return axes
 
 
 def plot_user_demographics():
@@ -33,65 +216,61 @@ def plot_user_demographics():
     both groups are plotted within the same figure on separate pie charts.
     """
     # Getting last row which contains the total for each age group (Column)
-    age_totals = USER_DEMOGRAPHICS.tail(1)
+    age_totals = DATA.user_demographics.tail(1)
     age_totals = age_totals[["Under_17", "Under_30", "Under_45", "Under_60", "Over_60"]].values[0].tolist()
     # Getting final column which contains the totals for each country (Row)
-    country_totals = USER_DEMOGRAPHICS[["Total"]]
+    country_totals = DATA.user_demographics[["Total"]]
     country_totals = country_totals[:-1].squeeze().tolist()
 
-    plt.subplot(211)
-    plt.pie(age_totals, pctdistance=1.3, autopct="%1.1f%%", explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-    plt.legend(bbox_to_anchor=(1.30, 1), loc="upper left", labels=AGES, fancybox=True)
-    plt.ylabel("Age Group", labelpad=30)
+    fig = Figure()
+
+    ax = fig.add_subplot(211)
+    ax.pie(age_totals, pctdistance=1.3, autopct="%1.1f%%", explode=(0.05, 0.05, 0.05, 0.05, 0.05))
+    ax.add_artist(centre_circle())
+    ax.legend(bbox_to_anchor=(1.30, 1), loc="upper left", labels=AGES, fancybox=True)
+    ax.set_ylabel("Age Group", labelpad=30)
 
-    plt.subplot(212)
-    plt.pie(country_totals, pctdistance=1.3, autopct="%1.1f%%")
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-    plt.legend(bbox_to_anchor=(1.30, 1), loc="upper left", labels=COUNTRIES + ["Other"], fancybox=True)
-    plt.ylabel("Countries", labelpad=30)
+    ax = fig.add_subplot(212)
+    ax.pie(country_totals, pctdistance=1.3, autopct="%1.1f%%")
+    ax.add_artist(centre_circle())
+    ax.legend(bbox_to_anchor=(1.30, 1), loc="upper left", labels=COUNTRIES + ["Other"], fancybox=True)
+    ax.set_ylabel("Countries", labelpad=30)
 
-    plt.suptitle("User Demographics")
-    plt.savefig("../Visualisations/Demographics/User Demographics.png", dpi=300)
+    fig.suptitle("User Demographics")
+    fig.savefig("../Visualisations/Demographics/User Demographics.png", dpi=300)
 
 
-def plot_grouped_page_counts(sample_size):
+def plot_grouped_page_counts(group_stats=None):
     """
     Produces a grouped bar chart containing all COUNTRIES and age groups, showing for each of these groups (grouped by
     country) the average page counts for each reader.
 
-    :param sample_size: The number of records to base the statistics of, can be set to None to poll entire dataset
+    :param group_stats: Dictionary returned by compile_stats(), None to use the existing stat csv
     """
-    if GENERATING_STATS_CSV:
-        average_country_pages = {"Age_Group": AGES, "USA": [], "United_Kingdom": [], "Australia": [], "New_Zealand": [],
-                                 "Canada": []}
-
-        for country in COUNTRIES:
-            for age_group in AGES:
-                page_count = stats(age_group, country, sample_size)[0]
-                average_country_pages[country].append(page_count)
-
-        average_country_pages_df = pd.DataFrame.from_dict(average_country_pages)
-        average_country_pages_df.to_csv("../Data/Stats/grouped_page_counts.csv", index=False)
+    if group_stats:
+        average_country_pages_df = grouped_page_counts(group_stats).reset_index(drop=True)
+    else:
+        average_country_pages_df = pd.read_csv("../Data/Stats/grouped_page_counts.csv", usecols=COUNTRIES)
 
-    average_country_pages_df = pd.read_csv("../Data/Stats/grouped_page_counts.csv", usecols=COUNTRIES)
+    fig = Figure()
+    ax = fig.add_subplot()
 
     # Bars
-    ax = average_country_pages_df.plot.bar(rot=0, xlabel="Age Group", ylabel="Page Count")
+    average_country_pages_df.plot.bar(ax=ax, rot=0, xlabel="Age Group", ylabel="Page Count")
     # Average line
     average_country_pages_df.mean(axis=1).plot(ax=ax, color="brown", linestyle="--", linewidth=3, label="Overall Average")
     print(average_country_pages_df.mean(axis=1))
 
     ax.set_axisbelow(True)
     ax.yaxis.grid(color="gray", linestyle="dashed")
-    plt.ylim(200, 375)  # Limits selected so all bars still visible whist maximising difference between bars
-    plt.legend(bbox_to_anchor=(0, 1.02, 1, 0.2), loc="lower left",
-               mode="expand", borderaxespad=0, ncol=3, fancybox=True)
+    ax.set_ylim(200, 375)  # Limits selected so all bars still visible whist maximising difference between bars
+    ax.legend(bbox_to_anchor=(0, 1.02, 1, 0.2), loc="lower left",
+              mode="expand", borderaxespad=0, ncol=3, fancybox=True)
     # Remove spines
-    plt.gca().spines['top'].set_visible(False)
-    plt.gca().spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
 
-    plt.savefig("../Visualisations/Countries and Ages/Average Page Counts by Countries and Age.png", dpi=300)
+    fig.savefig("../Visualisations/Countries and Ages/Average Page Counts by Countries and Age.png", dpi=300)
 
 
 def plot_country_demographics():
@@ -99,261 +278,249 @@ def plot_country_demographics():
     For each country plot a pie chart representing the breakdown of ages for all users within that country, this results
     in 5 pie charts (one for each country) and a legend showing colours for age groups as all colours are shared
     """
-    age_totals = USER_DEMOGRAPHICS[["Under_17", "Under_30", "Under_45", "Under_60", "Over_60"]].drop([5, 6])
+    age_totals = DATA.user_demographics[["Under_17", "Under_30", "Under_45", "Under_60", "Over_60"]].drop([5, 6])
     # Colour dictionary for labels so legend is universal
     colours = {"Under_17": "tab:blue", "Under_30": "tab:orange", "Under_45": "tab:green", "Under_60": "tab:red",
                "Over_60": "tab:purple"}
 
-    plt.figure(figsize=(20, 10), dpi=200)
-
-    ax1 = plt.subplot2grid(shape=(2, 6), loc=(0, 0), colspan=2)
-    ax1.pie(age_totals.loc[0].values.tolist(), autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            colors=[colours[key] for key in AGES],  # Applying colour dictionary
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(COUNTRIES[0], fontsize=15)  # This represents the title for this sub-chart
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))  # Aesthetic choice to have blank centre
-
-    ax2 = plt.subplot2grid((2, 6), (0, 2), colspan=2)
-    ax2.pie(age_totals.loc[1].values.tolist(), autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            colors=[colours[key] for key in AGES],
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(COUNTRIES[1], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-
-    ax3 = plt.subplot2grid((2, 6), (0, 4), colspan=2)
-    ax3.pie(age_totals.loc[2].values.tolist(), autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            colors=[colours[key] for key in AGES],
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(COUNTRIES[2], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-
-    ax4 = plt.subplot2grid((2, 6), (1, 0), colspan=2)
-    ax4.pie(age_totals.loc[3].values.tolist(), autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            colors=[colours[key] for key in AGES],
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(COUNTRIES[3], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-
-    ax5 = plt.subplot2grid((2, 6), (1, 2), colspan=2)
-    ax5.pie(age_totals.loc[4].values.tolist(), autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            colors=[colours[key] for key in AGES],
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(COUNTRIES[4], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
+    fig = Figure(figsize=(20, 10), dpi=200)
+    axes = pie_grid(fig, age_totals.values.tolist(), COUNTRIES, LEFT_PIE_GRID,
+                    colors=[colours[key] for key in AGES])  # Applying colour dictionary
 
     # Universal legend due to colour dictionary
-    ax5.legend(colours, prop={"size": 20}, loc="center left", bbox_to_anchor=(1.6, 0.5), fancybox=True)
+    axes[-1].legend(colours, prop={"size": 20}, loc="center left", bbox_to_anchor=(1.6, 0.5), fancybox=True)
 
-    plt.suptitle("Countries Demographics", fontsize=20)
-    plt.savefig("../Visualisations/Demographics/Countries Demographics.png", dpi=300)
+    fig.suptitle("Countries Demographics", fontsize=20)
+    fig.savefig("../Visualisations/Demographics/Countries Demographics.png", dpi=300)
 
 
-def plot_descriptors_for_group(primary_group, secondary_group, descriptor, sample_size):
+def plot_descriptors_for_group(primary_group, secondary_group, descriptor, group_stats=None):
     """
     Given a group and country (both optional) plot a descriptor (category or words) for that given subset
     :param primary_group: Primary age group or country
     :param secondary_group: Secondary age group or country
-    :param descriptor: Main statistic, either most common word or country
-    :param sample_size: The number of records to base the statistics of, can be set to None to poll entire dataset
+    :param descriptor: Main statistic, either most common word, category, title or author
+    :param group_stats: Dictionary returned by compile_stats(), None to use the existing stat csv
     """
-    if descriptor == "Categories":
-        i = 1
-    elif descriptor == "Words":
-        i = 2
-    else:
-        i = 3
-
-    fig1, ax1 = plt.subplots()
+    fig = Figure()
+    ax = fig.add_subplot()
 
     # Figure out the title and directory for the final figure
-    if primary_group:
-        title = "Most Common {} for {}".format(descriptor, primary_group)
+    title, directory = group_descriptor_location(primary_group, secondary_group, descriptor)
 
-        if primary_group == AGES:
-            directory = "Ages"
-        else:
-            directory = "Countries"
-    elif secondary_group:
-        title = "Most Common {} for {} in {}".format(descriptor, primary_group, secondary_group)
-        directory = "Countries and Ages"
+    if group_stats:
+        stat_details = group_stats[(primary_group, secondary_group)][DESCRIPTORS[descriptor]]
+        stat_labels = [details[0] for details in stat_details]
+        counts = [details[1] for details in stat_details]
     else:
-        title = "Most Common {} For All Groups".format(descriptor)
-        directory = "Countries and Ages"
-
-    if GENERATING_STATS_CSV:
-        # New dataframe with columns named uniquely
-        current_descriptor_df = pd.DataFrame(stats(primary_group, secondary_group, sample_size)[i],
-                                             columns=[descriptor, "{}_Count".format(descriptor)])
-
-        # Check if stats already exist, if so append to this file
-        if path.isfile("../data/Stats/{}/most_common_descriptors.csv".format(directory)):
-            try:
-                current_stats = pd.read_csv("../data/Stats/{}/most_common_descriptors.csv".format(directory))
-                current_stats = current_stats.join(current_descriptor_df)
-                current_stats.to_csv("../data/Stats/{}/most_common_descriptors.csv".format(directory), index=False)
-            except ValueError:
-                print("Unable to append to file, it may already be populated with requested data. No changes made.")
-        else:  # Initial save
-            current_descriptor_df.to_csv("../Data/Stats/{}/most_common_descriptors.csv".format(directory),
-                                         index=False)
-
-    # Open stored stats and retrieve relevant descriptor and their counts
-    stat_details = pd.read_csv("../data/Stats/{}/most_common_descriptors.csv".format(directory))
-    stat_labels = stat_details[descriptor]
-    counts = stat_details["{}_Count".format(descriptor)]
+        # Open stored stats and retrieve relevant descriptor and their counts
+        stat_details = pd.read_csv("../Data/Stats/{}/most_common_descriptors.csv".format(directory))
+        stat_labels = stat_details[descriptor]
+        counts = stat_details["{}_Count".format(descriptor)]
 
-    ax1.pie(counts, labels=stat_labels, autopct="%1.1f%%", pctdistance=0.8, startangle=90, explode=(0.05, 0.05, 0.05,
-                                                                                                    0.05, 0.05))
-    fig = plt.gcf()
-    fig.gca().add_artist(copy(CENTRE_CIRCLE))
+    ax.pie(counts, labels=stat_labels, autopct="%1.1f%%", pctdistance=0.8, startangle=90, explode=(0.05, 0.05, 0.05,
+                                                                                                   0.05, 0.05))
+    ax.add_artist(centre_circle())
 
-    plt.title(title)
-    plt.savefig("../Visualisations/{}/{}.png".format(directory, title), dpi=300)
+    ax.set_title(title)
+    fig.savefig("../Visualisations/{}/{}.png".format(directory, title), dpi=300)
 
 
-def plot_descriptors_for_all_groups(primary_groups, secondary_group, descriptor, sample_size):
+def plot_descriptors_for_all_groups(primary_groups, secondary_group, descriptor, group_stats=None):
     """
     Given a list of groups e.g. Ages, plot all the most common given descriptors for each element of that group
 
     :param primary_groups: Ages or Countries to be used
     :param secondary_group: Age or Countries to be used
-    :param descriptor: Main statistic, either most common word, category or title
-    :param sample_size: The number of records to base the statistics of, can be set to None to poll entire dataset
+    :param descriptor: Main statistic, either most common word, category, title or author
+    :param group_stats: Dictionary returned by compile_stats(), None to use the existing stat csvs
     """
-    # Potentially share colours for common labels
-    if descriptor == "Categories":
-        i = 1
-    elif descriptor == "Words":
-        i = 2
-    elif descriptor == "Titles":
-        i = 3
-    else:
-        i = 4
+    title, directory = descriptor_location(primary_groups, secondary_group, descriptor)
 
-    if secondary_group:
-        title = "Most Common {} For {}".format(descriptor, secondary_group)
-        directory = "Countries and Ages/{}".format(secondary_group.replace("_", " "))
-    elif primary_groups == AGES:
-        title = "Most Common {} by Age Group".format(descriptor)
-        directory = "Ages"
+    if group_stats:
+        group_labels, group_counts = descriptor_table(group_stats, primary_groups, secondary_group, descriptor)
     else:
-        title = "Most Common {} by Countries".format(descriptor)
-        directory = "Countries"
+        group_labels, group_counts = [], []
+        df = pd.read_csv("../Data/Stats/{}/{}.csv".format(directory, title))
 
-    group_labels, group_counts = [], []
+        for i in range(len(df.columns)):
+            group_labels.append(literal_eval(df.iloc[0].values[i]))
+            group_counts.append(literal_eval(df.iloc[1].values[i]))
 
-    if GENERATING_STATS_CSV:
-        for group in primary_groups:
-            stat_labels, counts = [], []
+    fig = Figure(figsize=(20, 10), dpi=200)
+    pie_grid(fig, group_counts, primary_groups, CENTRED_PIE_GRID, labels=group_labels)
+    fig.tight_layout()
 
-            stat_details = stats(group, secondary_group, sample_size)[i]
+    fig.suptitle(title, fontsize=20)
 
-            for details in stat_details:
-                stat_label = details[0]
-                count = details[1]
+    makedirs("../Visualisations/{}".format(directory), exist_ok=True)
+    fig.savefig("../Visualisations/{}/{}.png".format(directory, title), dpi=300)
 
-                stat_labels.append(stat_label)
-                counts.append(count)
 
-            stat_labels = ["\n".join(wrap(label, 20)) for label in stat_labels]
-            group_labels.append(stat_labels)
-            group_counts.append(counts)
+class FigureJob:
+    """
+    A single figure, as the plot function and its arguments along with the figure's inputs and output. Each job creates
+    and saves its own figure, so jobs can be rendered in any order or in separate processes.
+    """
+    def __init__(self, function, arguments, output, files=(), data=None):
+        """
+        :param function: The plot function
+        :param arguments: Tuple of the arguments the plot function is called with
+        :param output: Location the figure is saved to
+        :param files: The files read by the plot function
+        :param data: The statistics plotted, when they are passed to the plot function rather than read from files
+        """
+        self.function = function
+        self.arguments = arguments
+        self.output = output
+        self.files = files
+        self.data = data
+
+    def missing_files(self):
+        """
+        :return: List of the files read by the plot function which do not exist
+        """
+        return [filename for filename in self.files if not path.isfile(filename)]
+
+    def fingerprint(self):
+        """
+        :return: Hash of the figure's inputs, plot parameters and plot function, which changes whenever the figure
+            would change
+        """
+        figure_hash = sha256()
+        # Statistics are passed as an argument but hashed through data, so only the statistics plotted are included
+        parameters = [argument for argument in self.arguments if not isinstance(argument, dict)]
+        # The source of the plot function is included, so editing a plot renders its figures again
+        figure_hash.update(repr((getsource(self.function), parameters, self.data)).encode("utf-8"))
+
+        for filename in self.files:
+            with open(filename, "rb") as f:
+                figure_hash.update(f.read())
+
+        return figure_hash.hexdigest()
+
+
+def figure_jobs(group_stats=None):
+    """
+    Every figure that can be plotted, along with the inputs of each figure
 
-        current_descriptor_df = pd.DataFrame([group_labels, group_counts], columns=primary_groups)
-        current_descriptor_df.to_csv("../Data/Stats/{}/{}.csv".format(directory, title), index=False)
+    :param group_stats: Dictionary returned by compile_stats(), None to use the existing stat csvs
+    :return: List of FigureJob for every figure
+    """
+    demographics = "../Data/Stats/user_demographics.csv"
+    jobs = [FigureJob(plot_user_demographics, (), "../Visualisations/Demographics/User Demographics.png",
+                      files=[demographics]),
+            FigureJob(plot_country_demographics, (), "../Visualisations/Demographics/Countries Demographics.png",
+                      files=[demographics])]
+
+    output = "../Visualisations/Countries and Ages/Average Page Counts by Countries and Age.png"
+    if group_stats:
+        jobs.append(FigureJob(plot_grouped_page_counts, (group_stats,), output,
+                              data=grouped_page_counts(group_stats).values.tolist()))
     else:
-        df = pd.read_csv("../Data/Stats/{}/{}.csv".format(directory, title))
+        jobs.append(FigureJob(plot_grouped_page_counts, (group_stats,), output,
+                              files=["../Data/Stats/grouped_page_counts.csv"]))
+
+    for descriptor in DESCRIPTORS:
+        title, directory = group_descriptor_location(None, None, descriptor)
+        output = "../Visualisations/{}/{}.png".format(directory, title)
+
+        if group_stats:
+            jobs.append(FigureJob(plot_descriptors_for_group, (None, None, descriptor, group_stats), output,
+                                  data=group_stats[(None, None)][DESCRIPTORS[descriptor]]))
+        else:
+            jobs.append(FigureJob(plot_descriptors_for_group, (None, None, descriptor, group_stats), output,
+                                  files=["../Data/Stats/{}/most_common_descriptors.csv".format(directory)]))
+
+    for primary_groups, secondary_group in DESCRIPTOR_GROUPS:
+        for descriptor in DESCRIPTORS:
+            title, directory = descriptor_location(primary_groups, secondary_group, descriptor)
+            output = "../Visualisations/{}/{}.png".format(directory, title)
+            arguments = (primary_groups, secondary_group, descriptor, group_stats)
+
+            if group_stats:
+                jobs.append(FigureJob(plot_descriptors_for_all_groups, arguments, output,
+                                      data=descriptor_table(group_stats, primary_groups, secondary_group, descriptor)))
+            else:
+                jobs.append(FigureJob(plot_descriptors_for_all_groups, arguments, output,
+                                      files=["../Data/Stats/{}/{}.csv".format(directory, title)]))
+
+    return jobs
+
+
+def render(job):
+    """
+    :param job: FigureJob to render
+    """
+    job.function(*job.arguments)
+
+
+def render_all(jobs, workers=RENDER_WORKERS, force=FORCE_RENDER, manifest_file=RENDER_MANIFEST):
+    """
+    Render figure jobs across a pool of processes, each job is independent so rendering scales with the number of cores.
+    Figures whose inputs and parameters match those recorded within the render manifest, and which still exist, are
+    skipped. Figures whose stat csvs do not exist are skipped, the other figures are still rendered.
+
+    :param jobs: List of FigureJob to render
+    :param workers: Number of processes, 1 to render every figure within this process
+    :param force: True to render every figure regardless of the manifest
+    :param manifest_file: Location of the render manifest
+    :return: List of the jobs which were rendered
+    """
+    manifest = {}
+    if path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    available = []
+    for job in jobs:
+        missing = job.missing_files()
+        if missing:
+            print("Skipping {}, missing {}".format(job.output, ", ".join(missing)))
+        else:
+            available.append(job)
+
+    fingerprints = [job.fingerprint() for job in available]
+    changed = [(job, fingerprint) for job, fingerprint in zip(available, fingerprints)
+               if force or manifest.get(job.output) != fingerprint or not path.isfile(job.output)]
+
+    try:
+        if workers and workers > 1 and len(changed) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [(executor.submit(render, job), job, fingerprint) for job, fingerprint in changed]
+
+                # Only figures which rendered successfully are recorded, an error in any job is raised afterwards
+                for future, job, fingerprint in futures:
+                    if future.exception() is None:
+                        manifest[job.output] = fingerprint
+                for future, _, _ in futures:
+                    future.result()
+        else:
+            for job, fingerprint in changed:
+                render(job)
+                manifest[job.output] = fingerprint
+    finally:
+        with open(manifest_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    print("Rendered {} of {} figures, {} are unchanged and {} were skipped".format(
+        len(changed), len(jobs), len(available) - len(changed), len(jobs) - len(available)))
+    return [job for job, _ in changed]
+
+
+def plot_all(workers=RENDER_WORKERS, force=FORCE_RENDER):
+    """
+    Plot all potential plots, only rendering figures whose inputs have changed
+
+    :param workers: Number of processes the figures are rendered with
+    :param force: True to render every figure, even if unchanged
+    """
+    # Statistics for every group are compiled in one batch, otherwise the existing stat csvs are used
+    group_stats = compile_stats(MAX_SAMPLE_SIZE) if GENERATING_STATS_CSV else None
+
+    render_all(figure_jobs(group_stats), workers, force)
+    print("All plots completed.")
 
-        for i in range(len(df.columns)):
-            group_labels.append(literal_eval(df.iloc[0].values[i]))
-            group_counts.append(literal_eval(df.iloc[1].values[i]))
 
-    plt.figure(figsize=(20, 10), dpi=200)
-
-    ax1 = plt.subplot2grid(shape=(2, 6), loc=(0, 0), colspan=2)
-    ax1.pie(group_counts[0], labels=group_labels[0], autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(primary_groups[0], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-
-    ax2 = plt.subplot2grid((2, 6), (0, 2), colspan=2)
-    ax2.pie(group_counts[1], labels=group_labels[1], autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(primary_groups[1], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-
-    ax3 = plt.subplot2grid((2, 6), (0, 4), colspan=2)
-    ax3.pie(group_counts[2], labels=group_labels[2], autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(primary_groups[2], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-
-    ax4 = plt.subplot2grid((2, 6), (1, 1), colspan=2)
-    ax4.pie(group_counts[3], labels=group_labels[3], autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(primary_groups[3], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-
-    ax5 = plt.subplot2grid((2, 6), (1, 3), colspan=2)
-    ax5.pie(group_counts[4], labels=group_labels[4], autopct="%1.1f%%", pctdistance=0.8, startangle=90,
-            explode=(0.05, 0.05, 0.05, 0.05, 0.05))
-    plt.xlabel(primary_groups[4], fontsize=15)
-    plt.gca().add_artist(copy(CENTRE_CIRCLE))
-    plt.tight_layout()
-
-    plt.suptitle(title, fontsize=20)
-
-    plt.savefig("../Visualisations/{}/{}.png".format(directory, title), dpi=300)
-
-
-def plot_all():
-    """
-    Plot all potential plots
-    """
-    # Single call plots
-    # plot_user_demographics()
-    # plot_country_demographics()
-    # print("O of 13")
-    plot_grouped_page_counts(MAX_SAMPLE_SIZE)
-    #
-    # print("1 of 13")
-    # plot_descriptors_for_group(None, None, "Titles", MAX_SAMPLE_SIZE)
-    # print("2 of 13")
-    # plot_descriptors_for_group(None, None, "Words", MAX_SAMPLE_SIZE)
-    # print("3 of 13")
-    # plot_descriptors_for_group(None, None, "Categories", MAX_SAMPLE_SIZE)
-    # print("4 of 13")
-    # plot_descriptors_for_group(None, None, "Authors", MAX_SAMPLE_SIZE)
-    # print("5 of 13")
-    #
-    # plot_descriptors_for_all_groups(AGES, None, "Categories", MAX_SAMPLE_SIZE)
-    # print("6 of 13")
-    # plot_descriptors_for_all_groups(AGES, None, "Words", MAX_SAMPLE_SIZE)
-    # print("7 of 13")
-    # plot_descriptors_for_all_groups(AGES, None, "Titles", MAX_SAMPLE_SIZE)
-    # print("8 of 13")
-    # plot_descriptors_for_all_groups(AGES, None, "Authors", MAX_SAMPLE_SIZE)
-    # print("9 of 13")
-    # plot_descriptors_for_all_groups(COUNTRIES, None, "Categories", MAX_SAMPLE_SIZE)
-    # print("10 of 13")
-    # plot_descriptors_for_all_groups(COUNTRIES, None, "Words", MAX_SAMPLE_SIZE)
-    # print("11 of 13")
-    # plot_descriptors_for_all_groups(COUNTRIES, None, "Titles", MAX_SAMPLE_SIZE)
-    # print("12 of 13")
-    # plot_descriptors_for_all_groups(COUNTRIES, None, "Authors", MAX_SAMPLE_SIZE)
-    # print("13 of 13")
-    #
-    # print("Single call plots completed.")
-    #
-    # # Multiple call plots
-    # for country in COUNTRIES:
-    #     plot_descriptors_for_all_groups(AGES, country, "Categories", MAX_SAMPLE_SIZE)
-    #     plot_descriptors_for_all_groups(AGES, country, "Words", MAX_SAMPLE_SIZE)
-    #     plot_descriptors_for_all_groups(AGES, country, "Titles", MAX_SAMPLE_SIZE)
-    #     plot_descriptors_for_all_groups(AGES, country, "Authors", MAX_SAMPLE_SIZE)
-    #     print("{} plots completed".format(country))
-    #
-    # print("Multiple call plots completed.")
-
-
-plot_all()
+if __name__ == "__main__":
+    plot_all(force=FORCE_RENDER or "--force" in sys.argv)
@@ -0,0 +1,143 @@
+"""
+The words of every shortened summary are counted once and stored as a sparse ISBN x vocabulary matrix, so the most
+common words for any group of ISBNs is a single sparse reduction over the group's rows rather than splitting and
+counting every summary of the group again.
+
+The matrix is saved to Data/Processed/Part/word_matrix.npz
+"""
+from os import path
+from scipy import sparse
+import numpy as np
+import pandas as pd
+
+WORD_MATRIX_FILE = "../Data/Processed/Part/word_matrix.npz"
+
+
+class WordMatrix:
+    """
+    Sparse matrix of word counts with a row for each ISBN and a column for each word of the vocabulary. Words are
+    capitalised, as they are shown within the stats. The position each word first appears within a summary is also
+    kept, so words with equal counts are ordered as they would be by Counter.
+    """
+    def __init__(self, counts, positions, isbns, vocabulary):
+        """
+        :param counts: scipy CSR matrix of word counts, with a row for each ISBN and column for each word
+        :param positions: scipy CSR matrix with the same entries as counts, of the position (starting at 1) each word
+        first appears within the summary
+        :param isbns: Array of the ISBN of each row
+        :param vocabulary: Array of the word of each column
+        """
+        self.counts = counts
+        self.positions = positions
+        self.isbns = pd.Index(isbns)
+        self.vocabulary = np.asarray(vocabulary)
+
+    @classmethod
+    def build(cls, isbns, short_summaries):
+        """
+        Split and count the words of every summary a single time
+
+        :param isbns: The ISBN of each summary
+        :param short_summaries: The shortened summaries, as produced by process_summary()
+        :return: WordMatrix of the summaries
+        """
+        words = pd.Series(short_summaries).fillna("").str.split()
+        lengths = words.str.len().values
+        all_words = words.explode().dropna().str.capitalize()
+
+        # Vocabulary is in order of first appearance
+        columns, vocabulary = pd.factorize(all_words.values)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        positions = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + 1
+
+        # Each (row, column) entry is the count of the word within the summary and where it first appears
+        entries = pd.DataFrame({"Row": rows, "Column": columns, "Position": positions})
+        entries = entries.groupby(["Row", "Column"])["Position"].agg(["size", "min"])
+        entry_rows = entries.index.get_level_values("Row")
+        entry_columns = entries.index.get_level_values("Column")
+        shape = (len(lengths), len(vocabulary))
+
+        counts = sparse.csr_matrix((entries["size"].values.astype(np.int32), (entry_rows, entry_columns)), shape=shape)
+        positions = sparse.csr_matrix((entries["min"].values.astype(np.int32), (entry_rows, entry_columns)),
+                                      shape=shape)
+
+        return cls(counts, positions, np.asarray(isbns, dtype=str), np.asarray(vocabulary, dtype=str))
+
+    @classmethod
+    def load(cls, filename=WORD_MATRIX_FILE):
+        """
+        :param filename: Location of the matrix saved by save()
+        :return: The saved WordMatrix
+        """
+        with np.load(filename) as saved:
+            shape = tuple(saved["shape"])
+            counts = sparse.csr_matrix((saved["data"], saved["indices"], saved["indptr"]), shape=shape)
+            positions = sparse.csr_matrix((saved["positions"], saved["indices"], saved["indptr"]), shape=shape)
+
+            return cls(counts, positions, saved["isbns"], saved["vocabulary"])
+
+    def save(self, filename=WORD_MATRIX_FILE):
+        """
+        :param filename: Location the matrix is saved to
+        """
+        np.savez(filename, data=self.counts.data, positions=self.positions.data, indices=self.counts.indices,
+                 indptr=self.counts.indptr, shape=np.array(self.counts.shape), isbns=np.asarray(self.isbns, dtype=str),
+                 vocabulary=self.vocabulary)
+
+    def rows(self, isbns):
+        """
+        :param isbns: ISBNs to find the rows of
+        :return: Array of the row of each ISBN, -1 for any ISBN without a summary
+        """
+        return self.isbns.get_indexer(isbns)
+
+    def top_words(self, rows, k=5, weights=None):
+        """
+        Sum the word counts of a group of rows, weighting each row, and find the most common words
+
+        :param rows: The rows of the group, rows of -1 are ignored
+        :param k: The number of words to return
+        :param weights: Weight of each row, None to count every row once
+        :return: A list of up to k (word, count) tuples, most common first
+        """
+        rows = np.asarray(rows)
+        weights = np.ones(len(rows), dtype=np.int64) if weights is None else np.asarray(weights)
+        weights, rows = weights[rows >= 0], rows[rows >= 0]
+
+        word_counts = np.asarray(self.counts[rows].T @ weights).ravel()
+
+        # Equal counts are ordered by where the word first appears within the group, the same as Counter
+        group_positions = self.positions[rows].tocoo()
+        first_appearance = np.full(len(word_counts), np.iinfo(np.int64).max)
+        np.minimum.at(first_appearance, group_positions.col,
+                      group_positions.row.astype(np.int64) * (group_positions.data.max(initial=0) + 1)
+                      + group_positions.data)
+
+        top = np.flatnonzero(word_counts)
+        top = top[np.lexsort((first_appearance[top], -word_counts[top]))][:k]
+
+        return [(str(self.vocabulary[i]), word_counts[i].item()) for i in top]
+
+
+def load_word_matrix(isbns, short_summaries, source_file, filename=WORD_MATRIX_FILE):
+    """
+    Load the saved word matrix, building and saving it first if it does not exist, is older than the summaries or was
+    built for different books
+
+    :param isbns: The ISBN of each summary, used to check the saved matrix has a row for every book and if building it
+    :param short_summaries: The shortened summaries, used if building the matrix
+    :param source_file: File the summaries were read from, used to check whether the saved matrix is out of date
+    :param filename: Location of the saved matrix
+    :return: WordMatrix of the summaries
+    """
+    if path.isfile(filename) and path.getmtime(filename) >= path.getmtime(source_file):
+        word_matrix = WordMatrix.load(filename)
+
+        # The books can change without the summaries changing, the rows of new books would otherwise be missing
+        if np.array_equal(word_matrix.isbns.values, np.asarray(isbns, dtype=str)):
+            return word_matrix
+
+    word_matrix = WordMatrix.build(isbns, short_summaries)
+    word_matrix.save(filename)
+
+    return word_matrix
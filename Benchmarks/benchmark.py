@@ -0,0 +1,230 @@
+"""
+This file measures how each stage of the project scales, by generating a synthetic dataset of a given size and running
+every stage on it within a separate working folder. Each stage is run in its own process, so the time taken and the
+peak memory of every stage is measured independently. The Books API is replaced by a local stub, so no network
+connection is needed.
+
+The results are saved as JSON within Benchmarks/Results, named by scale and commit so runs can be compared, e.g.
+    python benchmark.py --scale 1m
+    python benchmark.py --compare Results/1m_abc1234.json Results/1m_def5678.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from os import listdir, makedirs, path
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from stub_api import start_stub
+from synthetic_data import SCALES, generate, scale_sizes
+
+BENCHMARK_DIRECTORY = path.dirname(path.abspath(__file__))
+ROOT = path.dirname(BENCHMARK_DIRECTORY)
+RESULTS_DIRECTORY = path.join(BENCHMARK_DIRECTORY, "Results")
+# Folders within a working folder, matching the layout of the project
+DIRECTORIES = ["Data/Unprocessed", "Data/Cleaned", "Data/Processed/Part", "Data/Stats", "Data/Cache", "Run"]
+
+# Each stage and the code run to measure it, in order. Scripts are run as they would be on their own
+STAGES = {
+    "cleaning": "runpy.run_path(r'{Processing}/cleaning.py', run_name='__main__')",
+    "average_ratings": "runpy.run_path(r'{Processing}/average_ratings.py', run_name='__main__')",
+    "merge_ratings": "import data_merging\ndata_merging.merge_books_with_ratings()",
+    "get_details": "import get_details\n"
+                   "from progress_journal import ProgressJournal\n"
+                   "from response_cache import ResponseCache\n"
+                   "cache, journal = ResponseCache(), ProgressJournal()\n"
+                   "get_details.get_details_concurrently(get_details.remaining_isbns(journal), journal, rate={rate}, "
+                   "host='127.0.0.1', port={port}, secure=False, cache=cache)\n"
+                   "cache.close()",
+    "merge_details": "import data_merging\ndata_merging.merge_books_and_ratings_with_details()",
+    "rating_figures": "runpy.run_path(r'{Analysis}/rating_figures.py', run_name='__main__')",
+    "user_demographics": "runpy.run_path(r'{Analysis}/user_demographics.py', run_name='__main__')",
+    "summaries": "import get_item_stats\nget_item_stats.process_summary()",
+    "group_stats": "import get_item_stats\n"
+                   "from rating_figures import AGE_GROUPS, COUNTRIES\n"
+                   "get_item_stats.all_stats(list(AGE_GROUPS), list(COUNTRIES.values()), None)",
+    "parallel_group_stats": "import parallel_stats\n"
+                            "from rating_figures import AGE_GROUPS, COUNTRIES\n"
+                            "parallel_stats.parallel_stats(list(AGE_GROUPS), list(COUNTRIES.values()), None)",
+}
+# Run within each stage's process, the measurements are written to a JSON file
+MEASURE = """
+import json, runpy, sys
+from time import perf_counter
+sys.path[:0] = {paths!r}
+from benchmark import peak_memory
+baseline = peak_memory()
+start = perf_counter()
+{statement}
+seconds = perf_counter() - start
+from instrumentation import METRICS
+with open({result_file!r}, "w") as f:
+    json.dump({{"seconds": seconds, "baseline_memory_mb": baseline, "peak_memory_mb": peak_memory(),
+               **METRICS.as_dict()}}, f)
+"""
+
+
+def peak_memory():
+    """
+    :return: Peak resident memory of the current process in MB, or None if it can not be measured on this platform
+    """
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Measured in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_commit():
+    """
+    :return: The short hash of the checked out commit, or "unknown" outside of a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_stage(name, workspace, port, rate):
+    """
+    Run a single stage in its own process, within the working folder
+
+    :param name: Name of the stage, must be within STAGES
+    :param workspace: Working folder containing the generated dataset
+    :param port: Port of the stub API
+    :param rate: Maximum number of requests per second made to the stub API
+    :return: Dictionary of the stage's measurements
+    """
+    result_file = path.join(workspace, "{}.json".format(name))
+    statement = STAGES[name].format(Processing=path.join(ROOT, "Processing"), Analysis=path.join(ROOT, "Analysis"),
+                                    port=port, rate=rate)
+    code = MEASURE.format(paths=[path.join(ROOT, "Processing"), path.join(ROOT, "Analysis"), BENCHMARK_DIRECTORY],
+                          statement=statement, result_file=result_file)
+
+    # Output of the stage is kept within the working folder rather than shown
+    with open(path.join(workspace, "{}.log".format(name)), "w") as log:
+        process = subprocess.run([sys.executable, "-c", code], cwd=path.join(workspace, "Run"), stdout=log,
+                                 stderr=subprocess.STDOUT)
+
+    if process.returncode != 0:
+        return {"stage": name, "status": "failed"}
+
+    with open(result_file) as f:
+        return {"stage": name, "status": "ok", **json.load(f)}
+
+
+def run_benchmark(scale, seed=0, stages=None, workspace=None, rate=100000, rate_limited=0.0):
+    """
+    Generate a dataset and measure every stage on it, stages after a failed stage are not run
+
+    :param scale: The number of ratings, or the name of a scale within SCALES
+    :param seed: Seed of the generated dataset
+    :param stages: Names of the stages to measure, defaults to all stages. Earlier stages are still run so later stages
+        have their inputs, but are not measured
+    :param workspace: Working folder to use, which must be empty or not yet exist. A temporary folder is used if None
+    :param rate: Maximum number of requests per second made to the stub API
+    :param rate_limited: Share of requests rate limited by the stub API
+    :return: Dictionary of the results
+    """
+    # Outputs, caches and journals left by an earlier run would be reused, so stages would skip work or resume
+    if workspace and path.isdir(workspace) and listdir(workspace):
+        raise ValueError("Workspace {} is not empty, use an empty or new folder".format(workspace))
+
+    workspace = workspace or tempfile.mkdtemp(prefix="book_stats_benchmark_")
+    for directory in DIRECTORIES:
+        makedirs(path.join(workspace, directory), exist_ok=True)
+
+    n_books, n_users, n_ratings = scale_sizes(scale)
+    results = {"commit": current_commit(), "scale": str(scale), "seed": seed, "books": n_books, "users": n_users,
+               "ratings": n_ratings, "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+               "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+               "platform": platform.platform(), "workspace": workspace, "stages": []}
+
+    start = perf_counter()
+    generate(path.join(workspace, "Data/Unprocessed"), scale, seed)
+    results["generate_seconds"] = round(perf_counter() - start, 3)
+    print("Generated {} ratings in {:.2f}s".format(n_ratings, results["generate_seconds"]))
+
+    stub = start_stub(rate_limited, seed)
+    try:
+        # Stages are run in order up to the last measured stage, as each uses the outputs of the previous stages
+        measured = stages or list(STAGES)
+        last = max(list(STAGES).index(stage) for stage in measured)
+
+        for name in list(STAGES)[:last + 1]:
+            stage_result = run_stage(name, workspace, stub.server_address[1], rate)
+            if name == "get_details":
+                stage_result["api_requests"] = stub.requests
+
+            if name in measured:
+                results["stages"].append(stage_result)
+                print("{:<20}{:<8}{:>10}{:>12}".format(name, stage_result["status"],
+                                                        round(stage_result.get("seconds", 0), 3),
+                                                        str(stage_result.get("peak_memory_mb"))))
+            if stage_result["status"] != "ok":
+                break
+    finally:
+        stub.shutdown()
+
+    return results
+
+
+def save_results(results):
+    """
+    :param results: Dictionary returned by run_benchmark()
+    :return: Location of the saved results
+    """
+    makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    filename = path.join(RESULTS_DIRECTORY, "{}_{}.json".format(results["scale"], results["commit"]))
+
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2)
+
+    return filename
+
+
+def compare(old_file, new_file):
+    """
+    Print the change in time taken and peak memory of each stage between two saved results
+
+    :param old_file: Results to compare against
+    :param new_file: Results to compare
+    """
+    with open(old_file) as f:
+        old = {stage["stage"]: stage for stage in json.load(f)["stages"]}
+    with open(new_file) as f:
+        new = {stage["stage"]: stage for stage in json.load(f)["stages"]}
+
+    print("{:<20}{:>10}{:>10}{:>8}{:>12}{:>12}".format("Stage", "Old (s)", "New (s)", "Ratio", "Old (MB)", "New (MB)"))
+    for name in [stage for stage in STAGES if stage in old and stage in new]:
+        old_seconds, new_seconds = old[name].get("seconds"), new[name].get("seconds")
+        ratio = new_seconds / old_seconds if old_seconds and new_seconds is not None else float("nan")
+        print("{:<20}{:>10.3f}{:>10.3f}{:>8.2f}{:>12}{:>12}".format(
+            name, old_seconds or float("nan"), new_seconds if new_seconds is not None else float("nan"), ratio,
+            str(old[name].get("peak_memory_mb")), str(new[name].get("peak_memory_mb"))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the time and peak memory of every stage")
+    parser.add_argument("--scale", default="10k", help="Number of ratings, or one of: " + ", ".join(SCALES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), help="Stages to measure, defaults to all")
+    parser.add_argument("--workspace", help="Empty folder to generate the dataset in, defaults to a temporary one")
+    parser.add_argument("--rate-limited", type=float, default=0.0, help="Share of stub API requests rate limited")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two saved results")
+    arguments = parser.parse_args()
+
+    if arguments.compare:
+        compare(*arguments.compare)
+    else:
+        scale = arguments.scale if arguments.scale in SCALES else int(arguments.scale)
+        print("Saved results to {}".format(save_results(run_benchmark(
+            scale, arguments.seed, arguments.stages, arguments.workspace, rate_limited=arguments.rate_limited))))
@@ -0,0 +1,106 @@
+"""
+This file measures the recall and time taken of the hashed search for the books most similar to a profile (see
+Analysis/book_vectors.py), against comparing every profile with every book, for several numbers of tables and bits.
+
+The book vectors of the project are used, with the profiles of a sample of users, e.g.
+    python nearest_neighbours.py --queries 500
+or synthetic vectors of a given number of books, with profiles of a few books on the same subject, so it runs without
+the dataset, e.g.
+    python nearest_neighbours.py --synthetic 200000
+"""
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+sys.path[:0] = ["../Processing", "../Analysis"]
+from book_vectors import book_vectors, load_vector_index, normalise_rows, recall_benchmark
+from data_store import load
+from word_matrix import WordMatrix
+
+# Subjects and vocabulary of the synthetic books, each book's words are mostly from its subject and otherwise follow
+# Zipf's law, as words of natural language do
+SUBJECTS = 200
+CATEGORIES = 50
+VOCABULARY = 20000
+WORDS_PER_BOOK = 40
+SUBJECT_SHARE = 0.6
+# Number of books of a subject within each synthetic profile
+BOOKS_PER_PROFILE = 5
+
+
+def synthetic_vectors(books, seed=0):
+    """
+    :param books: The number of books
+    :param seed: Seed of the generated vectors
+    :return: scipy CSR matrix of book vectors built by book_vectors(), and array of the subject of each book
+    """
+    rng = np.random.default_rng(seed)
+    subjects = rng.integers(0, SUBJECTS, books)
+    subject_words = rng.integers(0, VOCABULARY, (SUBJECTS, 100))
+    word_frequencies = 1 / np.arange(1, VOCABULARY + 1)
+
+    # Each word is either one of the book's subject words or any word of the vocabulary
+    from_subject = rng.random((books, WORDS_PER_BOOK)) < SUBJECT_SHARE
+    subject_choices = subject_words[subjects[:, np.newaxis], rng.integers(0, 100, (books, WORDS_PER_BOOK))]
+    words = np.where(from_subject, subject_choices,
+                     rng.choice(VOCABULARY, (books, WORDS_PER_BOOK), p=word_frequencies / word_frequencies.sum()))
+
+    counts = sparse.csr_matrix((np.ones(words.size, dtype=np.int32),
+                                (np.repeat(np.arange(books), WORDS_PER_BOOK), words.ravel())),
+                               shape=(books, VOCABULARY))
+    counts.sum_duplicates()
+    isbns = np.arange(books).astype(str)
+
+    # Categories follow the subject, with some books missing a category or page count
+    categories = pd.Series((subjects % CATEGORIES).astype(str)).where(rng.random(books) > 0.2)
+    page_counts = pd.Series(rng.normal(300, 100, books).round().clip(20)).where(rng.random(books) > 0.1)
+    descriptors = pd.DataFrame({"Page_Count": page_counts.values, "Category": categories.values,
+                                "Word_Row": np.arange(books)}, index=isbns)
+
+    return book_vectors(descriptors, WordMatrix(counts, counts, isbns, np.arange(VOCABULARY).astype(str))), subjects
+
+
+def synthetic_profiles(vectors, subjects, queries, seed=0):
+    """
+    :param vectors: Book vectors returned by synthetic_vectors()
+    :param subjects: Subject of each book
+    :param queries: The number of profiles
+    :param seed: Seed of the chosen books
+    :return: scipy CSR matrix of profiles, each the sum of a few books of the same subject
+    """
+    rng = np.random.default_rng(seed)
+    by_subject = [np.flatnonzero(subjects == subject) for subject in range(SUBJECTS)]
+
+    books = [rng.choice(by_subject[subject], BOOKS_PER_PROFILE)
+             for subject in rng.choice(np.flatnonzero([len(b) > 0 for b in by_subject]), queries)]
+    selection = sparse.csr_matrix((np.ones(queries * BOOKS_PER_PROFILE, dtype=np.float32),
+                                   (np.repeat(np.arange(queries), BOOKS_PER_PROFILE), np.concatenate(books))),
+                                  shape=(queries, vectors.shape[0]))
+
+    return normalise_rows(selection @ vectors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the recall and time taken of the hashed profile search")
+    parser.add_argument("--queries", type=int, default=500, help="Number of profiles searched for")
+    parser.add_argument("--k", type=int, default=10, help="Number of books found for each profile")
+    parser.add_argument("--synthetic", type=int, help="Number of synthetic books, rather than the project's books")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    if arguments.synthetic:
+        VECTORS, SUBJECT_OF_BOOK = synthetic_vectors(arguments.synthetic, arguments.seed)
+        PROFILES = synthetic_profiles(VECTORS, SUBJECT_OF_BOOK, arguments.queries, arguments.seed)
+    else:
+        VECTOR_INDEX = load_vector_index()
+        VECTORS = VECTOR_INDEX.vectors
+        PROFILES, _, _ = VECTOR_INDEX.profiles(load("ratings", columns=["ISBN", "Rating", "User"]))
+
+        # Only users who rated a book with a vector have a profile
+        PROFILES = PROFILES[np.flatnonzero(PROFILES.getnnz(axis=1))]
+        PROFILES = PROFILES[np.random.default_rng(arguments.seed).permutation(PROFILES.shape[0])[:arguments.queries]]
+
+    print("{} books, {} features, {} profiles".format(VECTORS.shape[0], VECTORS.shape[1], PROFILES.shape[0]))
+    print(recall_benchmark(VECTORS, PROFILES, arguments.k).to_string(index=False))
@@ -0,0 +1,82 @@
+"""
+A local stand in for the Google Books API, so get_details.py can be run and measured without a network connection or
+using any of the API quota. Every ISBN always gets the same response, and a share of requests can be rate limited to
+exercise the retries.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+import numpy as np
+from synthetic_data import WORDS
+
+CATEGORIES = ["Fiction", "History", "Biography", "Juvenile Fiction", "Religion", "Cooking", "Poetry", "Drama"]
+
+
+def volume(isbn):
+    """
+    The response for an ISBN, derived from the ISBN itself so the same details are always returned. Roughly one in ten
+    ISBNs have no details, as with the real API.
+
+    :param isbn: The requested ISBN
+    :return: The decoded JSON response
+    """
+    isbn_hash = int.from_bytes(isbn.encode(), "little") % 2147483647
+    if isbn_hash % 10 == 0:
+        return {}
+
+    rng = np.random.default_rng(isbn_hash)
+
+    return {"items": [{
+        "volumeInfo": {"categories": [CATEGORIES[rng.integers(0, len(CATEGORIES))]],
+                       "pageCount": int(rng.integers(50, 900))},
+        "searchInfo": {"textSnippet": " ".join(np.array(WORDS)[rng.integers(0, len(WORDS), 25)])}}]}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers volume requests in the format of /books/v1/volumes?q=isbn:<ISBN>, keeping connections alive
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so without this every response waits on a delayed acknowledgement
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        isbn = self.path.split("isbn:")[-1].split("&")[0]
+
+        with self.server.lock:
+            self.server.requests += 1
+            limited = self.server.random.random() < self.server.rate_limited
+
+        if limited:
+            status, body = 429, b"Rate limit exceeded"
+        else:
+            status, body = 200, json.dumps(volume(isbn)).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(rate_limited=0.0, seed=0):
+    """
+    Start the stub API on a free local port, in a background thread
+
+    :param rate_limited: Share of requests answered with 429 (Too Many Requests)
+    :param seed: Seed used to choose the rate limited requests
+    :return: The running server, its port is server.server_address[1] and it is stopped with server.shutdown()
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.requests = 0
+    server.rate_limited = rate_limited
+    server.random = Random(seed)
+    server.lock = threading.Lock()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
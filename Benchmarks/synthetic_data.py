@@ -0,0 +1,143 @@
+"""
+This file generates synthetic raw datasets in the Book-Crossing schema (the format of the files within
+Data/Unprocessed), so every stage can be run on data of any size without downloading the original dataset. The same
+seed always generates the same data.
+
+The number of books and users is scaled from the number of ratings with the proportions of the original dataset, and
+the files are written in chunks so datasets larger than memory can be generated.
+"""
+import csv
+from os import makedirs, path
+import numpy as np
+import pandas as pd
+
+# Named scales, as the number of ratings generated
+SCALES = {"10k": 10000, "100k": 100000, "1m": 1000000, "10m": 10000000}
+# Proportions of the original dataset, roughly 1.15 million ratings from 279 thousand users of 271 thousand books
+BOOKS_PER_RATING = 0.24
+USERS_PER_RATING = 0.24
+# Share of ratings which are implicit (a rating of 0), these are removed when cleaned
+IMPLICIT_RATINGS = 0.62
+# Share of users without an age
+MISSING_AGES = 0.4
+CHUNK_SIZE = 1000000
+
+WORDS = ["love", "war", "night", "secret", "garden", "house", "river", "city", "girl", "boy", "time", "king", "queen",
+         "shadow", "summer", "winter", "dark", "light", "road", "sea", "heart", "blood", "stone", "fire", "dream",
+         "island", "murder", "family", "journey", "letters", "mountain", "storm", "silent", "last", "lost", "golden"]
+SURNAMES = ["Smith", "Jones", "Brown", "Taylor", "Wilson", "Davies", "Evans", "Thomas", "Johnson", "Roberts", "King",
+            "Austen", "Christie", "Grisham", "Rowling", "Steel", "Koontz", "Patterson", "Clancy", "Crichton"]
+INITIALS = list("ABCDEFGHIJKLMNOPRSTW")
+PUBLISHERS = ["Penguin", "Ballantine Books", "Harlequin", "Bantam Books", "Pocket", "Warner Books", "Signet Book"]
+# Countries in roughly the proportions of the original users, with the format of the locations
+COUNTRIES = {"usa": 0.6, "canada": 0.08, "united kingdom": 0.07, "germany": 0.06, "spain": 0.05, "australia": 0.04,
+             "italy": 0.03, "france": 0.02, "portugal": 0.02, "new zealand": 0.01, "n/a": 0.02}
+CITIES = ["springfield", "london", "toronto", "madrid", "berlin", "sydney", "auckland", "paris", "rome", "lisbon"]
+REGIONS = ["california", "ontario", "england", "bayern", "new south wales", "texas", "n/a", "madrid", "lazio"]
+
+
+def scale_sizes(ratings):
+    """
+    :param ratings: The number of ratings, or the name of a scale within SCALES
+    :return: The number of books, users and ratings to generate
+    """
+    ratings = SCALES.get(ratings, ratings)
+
+    return max(1, int(ratings * BOOKS_PER_RATING)), max(1, int(ratings * USERS_PER_RATING)), int(ratings)
+
+
+def generate_isbns(count, rng):
+    """
+    :param count: The number of ISBNs
+    :param rng: Numpy random generator
+    :return: Array of unique ten character ISBNs, with a check character of 0-9 or X
+    """
+    bodies = rng.choice(10 ** 9, size=count, replace=False)
+    checks = np.array(list("0123456789X"))[rng.integers(0, 11, count)]
+
+    return np.char.add(np.char.zfill(bodies.astype(str), 9), checks)
+
+
+def random_phrases(rng, count, lengths):
+    """
+    :param rng: Numpy random generator
+    :param count: The number of phrases
+    :param lengths: Tuple of the minimum and maximum number of words (inclusive)
+    :return: Array of title cased phrases made from WORDS
+    """
+    phrase_lengths = rng.integers(lengths[0], lengths[1] + 1, count)
+    words = np.array(WORDS)[rng.integers(0, len(WORDS), (count, lengths[1]))]
+
+    return np.array([" ".join(row[:length]).title() for row, length in zip(words, phrase_lengths)])
+
+
+def write_csv(dataset, filename, append):
+    """
+    Write part of a raw file in the format of the original dataset, i.e. semicolon separated with every value quoted
+
+    :param dataset: Dataframe of the rows to write
+    :param filename: Location of the file
+    :param append: True to append to the file without a header
+    """
+    dataset.to_csv(filename, sep=";", index=False, header=not append, mode="a" if append else "w",
+                   encoding="cp1252", quoting=csv.QUOTE_ALL)
+
+
+def generate(directory, ratings, seed=0, chunk_size=CHUNK_SIZE):
+    """
+    Generate books.csv, ratings.csv and users.csv within a directory
+
+    :param directory: Folder the raw files are written to, usually Data/Unprocessed of a separate working folder
+    :param ratings: The number of ratings, or the name of a scale within SCALES
+    :param seed: Seed of the random generator
+    :param chunk_size: The maximum number of rows generated at once
+    :return: Dictionary of each file to the number of rows written
+    """
+    rng = np.random.default_rng(seed)
+    n_books, n_users, n_ratings = scale_sizes(ratings)
+    makedirs(directory, exist_ok=True)
+
+    isbns = generate_isbns(n_books, rng)
+    for start in range(0, n_books, chunk_size):
+        count = min(chunk_size, n_books - start)
+        authors = np.char.add(np.char.add(np.array(INITIALS)[rng.integers(0, len(INITIALS), count)], ". "),
+                              np.array(SURNAMES)[rng.integers(0, len(SURNAMES), count)])
+        write_csv(pd.DataFrame({
+            "ISBN": isbns[start:start + count],
+            "Book-Title": random_phrases(rng, count, (1, 4)),
+            "Book-Author": authors,
+            "Year-Of-Publication": rng.integers(1950, 2005, count),
+            "Publisher": np.array(PUBLISHERS)[rng.integers(0, len(PUBLISHERS), count)],
+            "Image-URL-S": "http://images.amazon.com/images/P/S.jpg",
+            "Image-URL-M": "http://images.amazon.com/images/P/M.jpg",
+            "Image-URL-L": "http://images.amazon.com/images/P/L.jpg"}), path.join(directory, "books.csv"), start > 0)
+
+    countries = list(COUNTRIES)
+    country_weights = np.array(list(COUNTRIES.values())) / sum(COUNTRIES.values())
+    for start in range(0, n_users, chunk_size):
+        count = min(chunk_size, n_users - start)
+        locations = pd.Series(np.array(CITIES)[rng.integers(0, len(CITIES), count)]) + ", " + \
+            np.array(REGIONS)[rng.integers(0, len(REGIONS), count)] + ", " + \
+            np.array(countries)[rng.choice(len(countries), count, p=country_weights)]
+        ages = np.clip(rng.normal(35, 14, count).round(), 0, 100)
+        write_csv(pd.DataFrame({
+            "User-ID": np.arange(start + 1, start + count + 1),
+            "Location": locations,
+            "Age": np.where(rng.random(count) < MISSING_AGES, np.nan, ages)}), path.join(directory, "users.csv"),
+            start > 0)
+
+    # A few books and users account for most ratings, as in the original dataset
+    book_popularity = 1 / np.arange(1, n_books + 1) ** 0.8
+    book_popularity /= book_popularity.sum()
+    user_activity = 1 / np.arange(1, n_users + 1) ** 0.9
+    user_activity /= user_activity.sum()
+    for start in range(0, n_ratings, chunk_size):
+        count = min(chunk_size, n_ratings - start)
+        write_csv(pd.DataFrame({
+            "User-ID": rng.choice(n_users, count, p=user_activity) + 1,
+            "ISBN": isbns[rng.choice(n_books, count, p=book_popularity)],
+            "Book-Rating": np.where(rng.random(count) < IMPLICIT_RATINGS, 0, rng.integers(1, 11, count))}),
+            path.join(directory, "ratings.csv"), start > 0)
+
+    return {"books.csv": n_books, "users.csv": n_users, "ratings.csv": n_ratings}
+
@@ -3,37 +3,63 @@ This file is used to calculate the average ratings for all books in the availabl
 
 The final can be located within Data/Processed/Part/isbn_ratings.csv
 """
+from data_store import save
+from instrumentation import METRICS
+from ratings_store import load_ratings_store
+import numpy as np
 import pandas as pd
 
-RATING_DATA = pd.read_csv("../data/Cleaned/ratings.csv", encoding="cp1252", on_bad_lines="skip")
 
-# Store average ratings to be appended to book_data
-ratings = []
-counter = 0
+def rating_aggregates(store):
+    """
+    Compute the mean rating, number of ratings and rating variance for every ISBN by counting over the columns of the
+    ratings store, rather than filtering the whole table once per ISBN.
 
-# Get all ISBNs in dataset
-UNIQUE_ISBNS = RATING_DATA["ISBN"].unique()
+    :param store: RatingsStore of the ratings (i.e. Data/Cleaned/ratings.csv)
+    :return: A dataframe indexed by ISBN, in order of first appearance, with the columns "Mean", "Count" and "Variance"
+    """
+    columns, ratings = store.indices, store.data.astype(np.float64)
 
-# Go through each ISBN and get their average rating
-for isbn in UNIQUE_ISBNS:
-    counter += 1
-    print("\r{} out of {}\r".format(counter, len(UNIQUE_ISBNS)))
+    counts = np.bincount(columns, minlength=len(store.isbns))
+    means = np.bincount(columns, weights=ratings, minlength=len(store.isbns)) / np.maximum(counts, 1)
+    squares = np.bincount(columns, weights=(ratings - means[columns]) ** 2, minlength=len(store.isbns))
 
-    # Select all rows with current ISBN
-    isbn_data = RATING_DATA.loc[RATING_DATA["ISBN"] == isbn]
-    # Get average rating and round it to 1 decimal place
-    isbn_rating = isbn_data.loc[:, "Rating"].mean().round(1)
+    # The sample variance, which is missing for ISBNs with a single rating
+    variances = np.full(len(counts), np.nan)
+    np.divide(squares, counts - 1, out=variances, where=counts > 1)
 
-    # A rating of 0 is invalid
-    if isbn_rating == 0:
-        ratings.append("N/A")
-    else:
-        # Dividing by two because it will be merged with other ratings out of 5
-        ratings.append(isbn_rating / 2)
+    return pd.DataFrame({"Mean": means, "Count": counts, "Variance": variances},
+                        index=pd.Index(store.isbns, name="ISBN"))
 
-# Add ISBNs and their average ratings to new dataframe
-average_ratings = pd.DataFrame(UNIQUE_ISBNS, columns=["ISBN"])
-average_ratings["Rating"] = ratings
 
-# Save dataframe, this is merged with book data in data_merging.py
-average_ratings.to_csv("../data/Processed/Part/isbn_ratings", header=True, index=False)
+def average_ratings(aggregates):
+    """
+    Convert the per ISBN aggregates into the format stored within isbn_ratings.csv, the average is rounded to 1 decimal
+    place and halved so that it is out of 5 like the other ratings it is merged with.
+
+    :param aggregates: Dataframe returned by rating_aggregates()
+    :return: A dataframe containing the columns "ISBN" and "Rating"
+    """
+    mean_ratings = aggregates["Mean"].round(1)
+
+    # A rating of 0 is invalid, dividing by two because it will be merged with other ratings out of 5
+    ratings = (mean_ratings / 2).astype(object)
+    ratings[mean_ratings == 0] = "N/A"
+
+    return pd.DataFrame({"ISBN": aggregates.index.values, "Rating": ratings.values})
+
+
+if __name__ == "__main__":
+    with METRICS.stage("average_ratings"):
+        with METRICS.timer("load"):
+            RATINGS_STORE = load_ratings_store()
+        METRICS.count("rows", len(RATINGS_STORE.data))
+
+        with METRICS.timer("aggregate"):
+            isbn_ratings = average_ratings(rating_aggregates(RATINGS_STORE))
+        METRICS.count("isbns", len(isbn_ratings.index))
+
+        # Save dataframe, this is merged with book data in data_merging.py. "N/A" is read as missing, so stored as such
+        with METRICS.timer("save"):
+            isbn_ratings["Rating"] = pd.to_numeric(isbn_ratings["Rating"], errors="coerce")
+            save("isbn_ratings", isbn_ratings, na_rep="N/A")
@@ -2,56 +2,109 @@
 This file is used to clean the initial dataset, so it can be used as desired. This cleaning involves removing incomplete
 or irrelevant data, renaming columns and standardising column names.
 
+The raw files can either be read whole, or streamed in chunks of a fixed number of rows so memory use stays the same
+regardless of the size of the raw files.
+
 All the cleaned files can be found within Data/Cleaned
 """
 from os import path
+from time import perf_counter
+from data_store import save, save_chunks
+from instrumentation import METRICS
 import pandas as pd
 
+# Stream the raw files in chunks rather than reading each one whole
+STREAMING = True
+CHUNK_SIZE = 100000
+# For each file: the raw columns to read and their dtypes, the new name of each column and the order they are saved in
+CLEANING = {
+    "books": ({"ISBN": str, "Book-Title": str, "Book-Author": str, "Year-Of-Publication": str},
+              {'Book-Title': 'Title', 'Book-Author': 'Author', "Year-Of-Publication": "Year"},
+              ['ISBN', 'Title', 'Author', 'Year']),
+    "ratings": ({"User-ID": "int32", "ISBN": str, "Book-Rating": "int8"},
+                {"User-ID": "User", 'Book-Rating': 'Rating'},
+                ['ISBN', 'Rating', 'User']),
+    "users": ({"User-ID": "int32", "Location": str, "Age": "float32"},
+              {"User-ID": "User"},
+              ['User', 'Location', 'Age']),
+}
+
 
-def clean(filename):
+def clean_chunk(filename, chunk):
+    """
+    Standardise and remove irrelevant/incomplete data from part of a raw file
+
+    :param filename: Name of the raw file the chunk is from
+    :param chunk: Dataframe of the raw rows
+    :return: Dataframe of the cleaned rows
+    """
+    dtypes, names, columns = CLEANING[filename]
+
+    # Removing irrelevant columns and standardising names
+    cleaned = chunk.rename(columns=names)[columns]
+
+    if filename == "ratings":
+        # Remove rows with no usable rating
+        cleaned = cleaned[cleaned.Rating != 0]
+
+    return cleaned
+
+
+def read_raw(filename, chunk_size=None):
+    """
+    :param filename: file to read, must be within Data/Unprocessed/
+    :param chunk_size: Number of rows in each chunk, None to read the whole file
+    :return: Dataframe of the raw file, or an iterator of dataframes if a chunk size is given
+    """
+    dtypes = CLEANING[filename][0]
+
+    # Only the columns that are kept are parsed, with explicit dtypes so every chunk has the same types
+    return pd.read_csv('../Data/Unprocessed/{}.csv'.format(filename), encoding='cp1252', on_bad_lines='skip', sep=";",
+                       usecols=list(dtypes), dtype=dtypes, chunksize=chunk_size)
+
+
+def clean(filename, streaming=STREAMING, chunk_size=CHUNK_SIZE):
     """
     Clean a given file by standardising and removing irrelevant/incomplete data.
 
     :param filename: file to clean, must be within Data/Unprocessed/
+    :param streaming: True to clean the file in chunks, writing each one as it is cleaned
+    :param chunk_size: Number of raw rows in each chunk when streaming
     """
     # All cleaned files are saved to Data/Cleaned/
-    if not path.isfile('../data/Cleaned/{}.csv'.format(filename)):
-        if filename == "books":
-            book_details = pd.read_csv('../data/Unprocessed/{}.csv'.format(filename), encoding='cp1252',
-                                       on_bad_lines='skip', sep=";")
-            # Removing irrelevant columns and standardising names
-            book_details.drop(columns=book_details.columns[[4, 5, 6, 7]], axis=1, inplace=True)
-            book_details.rename({'Book-Title': 'Title', 'Book-Author': 'Author', "Year-Of-Publication": "Year"}, axis=1,
-                                inplace=True)
-            books_file = book_details[['ISBN', 'Title', 'Author', 'Year']]  # Changing order
-
-            books_file.to_csv('../data/Cleaned/{}.csv'.format(filename), index=False)
-            print("{}.csv contains: {}".format(filename, books_file.columns.values))
-
-        elif filename == "ratings":
-            ratings_file = pd.read_csv('../data/Unprocessed/{}.csv'.format(filename), encoding='cp1252',
-                                       on_bad_lines='skip', sep=";")
+    if path.isfile('../Data/Cleaned/{}.csv'.format(filename)):
+        return
 
-            ratings_file.rename({"User-ID": "User", 'Book-Rating': 'Rating'}, axis=1, inplace=True)
-            ratings_file = ratings_file[['ISBN', 'Rating', 'User']]
+    start = perf_counter()
 
-            # Remove rows with no usable rating
-            ratings_file = ratings_file[ratings_file.Rating != 0]
+    if streaming:
+        raw_rows = 0
 
-            ratings_file.to_csv('../data/Cleaned/{}.csv'.format(filename), header=True, index=False)
-            print("{}.csv contains: {}".format(filename, ratings_file.columns.values))
+        def cleaned_chunks():
+            nonlocal raw_rows
+            for chunk in read_raw(filename, chunk_size):
+                raw_rows += len(chunk)
+                yield clean_chunk(filename, chunk)
 
-        elif filename == "users":
-            users_file = pd.read_csv('../data/Unprocessed/{}.csv'.format(filename), encoding='cp1252',
-                                     on_bad_lines='skip', sep=";")
+        rows = save_chunks(filename, cleaned_chunks())
+    else:
+        raw = read_raw(filename)
+        raw_rows = len(raw)
 
-            users_file.rename({"User-ID": "User"}, axis=1, inplace=True)
-            users_file = users_file[['User', 'Location', 'Age']]
+        cleaned = clean_chunk(filename, raw)
+        rows = len(cleaned)
+        save(filename, cleaned)
 
-            users_file.to_csv('../data/Cleaned/{}.csv'.format(filename), header=True, index=False)
-            print("{}.csv contains: {}".format(filename, users_file.columns.values))
+    seconds = perf_counter() - start
+    METRICS.count("{}_rows".format(filename), raw_rows)
+    METRICS.count("{}_cleaned_rows".format(filename), rows)
+    print("{}.csv contains: {}".format(filename, CLEANING[filename][2]))
+    print("Cleaned {} of {} rows in {:.2f}s ({:.0f} rows/sec)".format(rows, raw_rows, seconds,
+                                                                      raw_rows / max(seconds, 1e-9)))
 
 
-clean("books")
-clean("ratings")
-clean("users")
+if __name__ == "__main__":
+    with METRICS.stage("cleaning"):
+        for FILENAME in CLEANING:
+            with METRICS.timer(FILENAME):
+                clean(FILENAME)
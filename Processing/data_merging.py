@@ -1,7 +1,9 @@
 """
 This file contains the code used to merge incomplete data together to result in a complete dataset
 """
-import pandas as pd
+from data_store import load, save
+from instrumentation import METRICS
+from schema import align_isbns
 
 
 def merge_books_with_ratings():
@@ -11,15 +13,21 @@ def merge_books_with_ratings():
 
     The final output is located within Data/Processed/Part/isbn_details.csv
     """
-    book_data = pd.read_csv("../Data/Cleaned/books.csv", encoding="cp1252")
-    isbn_ratings = pd.read_csv("../Data/Processed/Part/isbn_ratings.csv", encoding="cp1252")
+    with METRICS.timer("load"):
+        book_data = load("books")
+        isbn_ratings = load("isbn_ratings")
 
     # Removing any entries missing data
     isbn_ratings.dropna(inplace=True)
 
     # Merge book data with average ratings using ISBN, using inner so only entries with ratings kept
-    books_with_ratings = book_data.merge(isbn_ratings, left_on="ISBN", right_on="ISBN")
-    books_with_ratings.to_csv("../data/Processed/books_rated.csv", header=True, index=False)
+    with METRICS.timer("merge"):
+        book_data, isbn_ratings = align_isbns(book_data, isbn_ratings)
+        books_with_ratings = book_data.merge(isbn_ratings, left_on="ISBN", right_on="ISBN")
+    METRICS.count("rows", len(books_with_ratings.index))
+
+    with METRICS.timer("save"):
+        save("books_rated", books_with_ratings)
 
 
 def merge_books_and_ratings_with_details():
@@ -30,8 +38,9 @@ def merge_books_and_ratings_with_details():
 
     The final output is located within Data/Processed/books_complete_details.csv
     """
-    books_with_ratings = pd.read_csv("../Data/Processed/books_rated.csv", encoding="cp1252")
-    isbn_details = pd.read_csv("../Data/Processed/Part/isbn_details.csv")
+    with METRICS.timer("load"):
+        books_with_ratings = load("books_rated")
+        isbn_details = load("isbn_details")
 
     # Some categories overlap, so they are combined here
     isbn_details.loc[isbn_details['Categories'].str.contains('biography', na=False), 'Categories'] = "['Biography']"
@@ -48,6 +57,11 @@ def merge_books_and_ratings_with_details():
     isbn_details.dropna(inplace=True)
 
     # Merge book data with average ratings using ISBN, using inner as only keeping complete records
-    books_with_complete_details = books_with_ratings.merge(isbn_details, left_on="ISBN", right_on="ISBN")
+    with METRICS.timer("merge"):
+        books_with_ratings, isbn_details = align_isbns(books_with_ratings, isbn_details)
+        books_with_complete_details = books_with_ratings.merge(isbn_details, left_on="ISBN", right_on="ISBN")
+    METRICS.count("rows", len(books_with_complete_details.index))
+
     # Adding shortened summaries
-    books_with_complete_details.to_csv("../data/Processed/books_complete_details.csv", header=True, index=False)
+    with METRICS.timer("save"):
+        save("books_complete_details", books_with_complete_details)
@@ -0,0 +1,137 @@
+"""
+All cleaned and processed datasets are accessed through this file. Each dataset is stored once in the typed, columnar
+Feather (Arrow IPC) format, so it can be memory-mapped and only the required columns read, rather than parsing the
+whole csv every time. The csv files are kept as an export of each dataset.
+
+The binary datasets can be found within Data/Binary/
+"""
+from os import makedirs, path, remove, replace
+from pyarrow import feather
+import pandas as pd
+import pyarrow as pa
+from schema import apply_schema
+
+BINARY_DIRECTORY = "../Data/Binary"
+# The csv of each dataset and the options used to parse it
+DATASETS = {
+    "books": ("../Data/Cleaned/books.csv", {"encoding": "cp1252", "on_bad_lines": "skip"}),
+    "ratings": ("../Data/Cleaned/ratings.csv", {"encoding": "cp1252", "on_bad_lines": "skip"}),
+    "users": ("../Data/Cleaned/users.csv", {"encoding": "cp1252", "on_bad_lines": "skip"}),
+    "isbn_ratings": ("../Data/Processed/Part/isbn_ratings.csv", {"encoding": "cp1252"}),
+    "isbn_details": ("../Data/Processed/Part/isbn_details.csv", {"on_bad_lines": "skip"}),
+    "books_rated": ("../Data/Processed/books_rated.csv", {"encoding": "cp1252", "on_bad_lines": "skip"}),
+    "rating_details": ("../Data/Processed/Part/rating_details.csv", {"encoding": "cp1252"}),
+    "books_complete_details": ("../Data/Processed/books_complete_details.csv", {}),
+}
+
+
+def binary_file(name):
+    """
+    :param name: Name of the dataset, must be within DATASETS
+    :return: Location of the binary file of the dataset
+    """
+    return path.join(BINARY_DIRECTORY, "{}.feather".format(name))
+
+
+def load(name, columns=None):
+    """
+    Load a dataset from its binary file, which is created from the csv first if it does not exist or the csv has been
+    changed since.
+
+    :param name: Name of the dataset, must be within DATASETS
+    :param columns: List of the columns to load, None to load all columns
+    :return: Dataframe of the dataset, with the column types of schema.SCHEMA
+    """
+    csv_file, read_options = DATASETS[name]
+    binary = binary_file(name)
+
+    if path.isfile(csv_file) and (not path.isfile(binary) or path.getmtime(csv_file) > path.getmtime(binary)):
+        convert(name)
+
+    # Uncompressed so columns are read straight from the memory-mapped file
+    return apply_schema(name, feather.read_table(binary, columns=columns, memory_map=True))
+
+
+def convert(name):
+    """
+    Parse the csv of a dataset a single time and store it within its binary file
+
+    :param name: Name of the dataset, must be within DATASETS
+    """
+    csv_file, read_options = DATASETS[name]
+    # ISBNs are kept as strings so leading zeros are not lost
+    dataset = pd.read_csv(csv_file, dtype={"ISBN": str}, **read_options)
+    save(name, dataset, export_csv=False)
+
+
+def save(name, dataset, export_csv=True, na_rep=""):
+    """
+    Store a dataset within its binary file, and export it to its csv
+
+    :param name: Name of the dataset, must be within DATASETS
+    :param dataset: Dataframe of the dataset
+    :param export_csv: True to also save the dataset as a csv
+    :param na_rep: How missing values are written within the csv
+    """
+    csv_file = DATASETS[name][0]
+    dataset = dataset.reset_index(drop=True)
+
+    if export_csv:
+        dataset.to_csv(csv_file, header=True, index=False, na_rep=na_rep)
+
+    # Saved after the csv so the binary file is never older than it
+    makedirs(BINARY_DIRECTORY, exist_ok=True)
+    feather.write_feather(dataset, binary_file(name), compression="uncompressed")
+
+
+def save_chunks(name, chunks, na_rep=""):
+    """
+    Store a dataset that is produced in chunks, each chunk is appended to the csv and binary file as it is produced so
+    only a single chunk is held in memory at a time. Every chunk must have the same columns and dtypes. Both files are
+    written to temporary files which only replace the dataset once every chunk is written, so a dataset is never left
+    partially written.
+
+    :param name: Name of the dataset, must be within DATASETS
+    :param chunks: Iterable of dataframes making up the dataset, in order, containing at least one dataframe
+    :param na_rep: How missing values are written within the csv
+    :return: Number of rows saved
+    """
+    csv_file = DATASETS[name][0]
+    temporary_csv, temporary_binary = csv_file + ".tmp", binary_file(name) + ".tmp"
+    makedirs(BINARY_DIRECTORY, exist_ok=True)
+
+    rows, writer = 0, None
+    try:
+        with open(temporary_csv, "w", newline="") as csv:
+            try:
+                for chunk in chunks:
+                    chunk = chunk.reset_index(drop=True)
+                    chunk.to_csv(csv, header=writer is None, index=False, na_rep=na_rep)
+
+                    # The schema of the first chunk is used for the whole file
+                    if writer is None:
+                        schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                        writer = pa.ipc.new_file(temporary_binary, schema,
+                                                 options=pa.ipc.IpcWriteOptions(compression=None))
+
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                    rows += len(chunk)
+            finally:
+                csv.close()
+                # Closed after the csv so the binary file is never older than it
+                if writer is not None:
+                    writer.close()
+
+        # Without a chunk there are no columns, so nothing can be saved
+        if writer is None:
+            raise ValueError("No chunks of {} to save".format(name))
+
+        # The csv is replaced last, as a cleaned dataset is complete once its csv exists
+        replace(temporary_binary, binary_file(name))
+        replace(temporary_csv, csv_file)
+    finally:
+        for temporary_file in [temporary_csv, temporary_binary]:
+            if path.isfile(temporary_file):
+                remove(temporary_file)
+
+    return rows
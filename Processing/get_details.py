@@ -2,119 +2,384 @@
 The initial dataset does not include all desired details for the books, so using this file and Googles "Books" API, this
 data is retrieved and stored for later merging within "data_merging.py" within the processing folder.
 """
+import http.client
+import threading
 import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from itertools import islice
 from json import loads
-from os import path
-from time import sleep
+from random import uniform
+from time import monotonic, sleep
 from urllib.error import HTTPError
+from data_store import load
+from instrumentation import METRICS, Progress
+from progress_journal import ProgressJournal
+from response_cache import ResponseCache
 import pandas as pd
 
+API_HOST = "www.googleapis.com"
+API_PATH = "/books/v1/volumes?q=isbn:"
+# Request only the volume and search details, these are cached in full so more fields can be extracted later
+FIELDS = "&fields=items(volumeInfo,searchInfo)"
+# Responses worth retrying, i.e. rate limited or a temporary server error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Response once the daily quota is used up, no later request succeeds until the quota is reset
+QUOTA_STATUS = 403
 
-def remaining_isbns():
+# True to fetch ISBNs with several concurrent workers, False to fetch them one at a time
+CONCURRENT = True
+CONCURRENT_WORKERS = 8
+# Number of ISBNs queued for each worker at a time, rather than queueing every remaining ISBN at once
+QUEUED_PER_WORKER = 4
+# Maximum number of requests per second across all workers
+REQUEST_RATE = 10
+# True to extract details from cached responses only, making no requests
+REPROCESS = False
+
+
+def remaining_isbns(journal):
     """
     Ensure only necessary ISBNs are having data retrieved
 
+    :param journal: ProgressJournal containing the ISBNs already completed
     :return: A list containing all the remaining ISBNs that are not completed yet.
     """
-    books_with_ratings = pd.read_csv("../Data/Processed/books_rated.csv", encoding="cp1252", on_bad_lines="skip")
-
-    # Some ISBNs have already been processed so need to exclude them from the list
-    if path.isfile("../Data/Processed/Part/isbn_details.csv"):
-        isbn_details = pd.read_csv("../Data/Processed/Part/isbn_details.csv", on_bad_lines="skip")
+    books_with_ratings = load("books_rated", columns=["ISBN"])
 
-        # Get shared ISBNs
-        shared_isbns = pd.merge(books_with_ratings, isbn_details, left_on="ISBN", right_on="ISBN")
-        shared_isbns = shared_isbns["ISBN"]
+    # Some ISBNs have already been processed so need to exclude them, these are stored using their last 10 characters
+    remaining = [isbn for isbn in books_with_ratings["ISBN"] if isbn[-10:] not in journal]
 
-        # Remove the common ISBNs from the list so only required ones remain
-        remaining = books_with_ratings[~books_with_ratings["ISBN"].isin(shared_isbns)]
+    print("Remaining ISBNs: {}".format(len(remaining)))
+    return remaining
 
-        print("Remaining ISBNs: {}".format(len(remaining["ISBN"].index)))
-        return remaining["ISBN"].values
-    # First run so all ISBNs required
-    else:
-        print("Remaining ISBNs: {}".format(len(books_with_ratings["ISBN"].index)))
-        return books_with_ratings["ISBN"].values
 
-
-def get_details(all_isbns):
+def get_details(all_isbns, journal, cache=None):
     """
     Use the Google Books API to complete the known details for all possible ISBNs currently stored
 
     :param all_isbns: A list containing the ISBNs which are not yet completed
+    :param journal: ProgressJournal the retrieved details are recorded to
+    :param cache: ResponseCache checked before making a request, None to not use a cache
     """
-    api = "https://www.googleapis.com/books/v1/volumes?q=isbn:"
-    # Request only specific fields to save time
-    fields = "&fields=items(volumeInfo(categories,%20pageCount),searchInfo(textSnippet))"
-    # All relevant columns to be used
-    stored_isbns, summaries, categories, page_counts = [], [], [], []
+    api = "https://" + API_HOST + API_PATH
     # Used to show progress in console
-    count = 0
-    total = len(all_isbns)
+    progress = Progress(len(all_isbns), "ISBNs")
+    # Number of requests failed in a row, each failure waits for longer before the next request
+    failures = 0
 
     for isbn in all_isbns:
-        count += 1
         if len(isbn) > 10:
             isbn = isbn[-10:]
         try:
-            # Get relevant data from API with a request
-            with urllib.request.urlopen(api + isbn + fields) as f:
-                content = f.read()
-
-            obj = loads(content.decode("utf-8"))
-            items = obj["items"][0]
-            # Selecting relevant fields
-            page_count = items["volumeInfo"]["pageCount"]
-            category = items["volumeInfo"]["categories"]
-            summary = items["searchInfo"]["textSnippet"]
-
-            stored_isbns.append(isbn)
-            summaries.append(summary)
-            categories.append(category)
-            page_counts.append(page_count)
-
-        except KeyError as e:  # Error will occur if any required details not available so catch them and continue
-            print("ISBN missing details {}".format(e))
-            # Still add to dataframe to avoid going over them again, and so they can be flagged for deletion when merged
-            stored_isbns.append(isbn)
-            summaries.append(None)
-            categories.append(None)
-            page_counts.append(None)
-        except HTTPError as e:  # Server timed out so temporarily pause
+            obj = cache.get(isbn) if cache else None
+
+            if obj is None:
+                # Get relevant data from API with a request
+                METRICS.count("api_calls")
+                with urllib.request.urlopen(api + isbn + FIELDS) as f:
+                    content = f.read()
+
+                obj = loads(content.decode("utf-8"))
+                if cache:
+                    cache.put(isbn, obj)
+            else:
+                METRICS.count("cache_hits")
+
+            journal.record(isbn, *extract_details(obj))
+            failures = 0
+
+        except KeyError:  # Error will occur if any required details not available so catch them and continue
+            METRICS.count("missing_details")
+            # Still recorded to avoid going over them again, and so they can be flagged for deletion when merged
+            journal.record(isbn, None, None, None)
+        except HTTPError as e:  # Rate limited or server timed out so temporarily pause, as request_volume() does
+            METRICS.count("failures")
             print(e)
-            sleep(10)
+            if e.code == QUOTA_STATUS:  # No later request can succeed, so every remaining ISBN is left for later
+                break
+
+            delay = retry_after(e.headers)
+            sleep(backoff_delay(failures) if delay is None else delay)
+            failures += 1
         except Exception as e:  # Quota reached, save current progress
+            METRICS.count("failures")
             print(e)
-            save_details(stored_isbns, summaries, categories, page_counts)
+            journal.flush()
+
+        progress.update()
+
+    journal.close()
+
+
+def extract_details(obj):
+    """
+    Select the relevant fields from a Books API response, a KeyError is raised if any of them are not available
+
+    :param obj: The decoded JSON response for a single ISBN
+    :return: The summary, categories and page count of the first matching volume
+    """
+    items = obj["items"][0]
+
+    return items["searchInfo"]["textSnippet"], items["volumeInfo"]["categories"], items["volumeInfo"]["pageCount"]
+
 
-        print("{} out of {}".format(count, total))
+class TokenBucket:
+    """
+    Thread safe token bucket used to keep requests across all workers within the API quota. Tokens are refilled at a
+    fixed rate up to the capacity, and each request has to take a token before it is sent.
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: The number of tokens added per second
+        :param capacity: The maximum number of tokens stored, allowing short bursts. Defaults to the rate
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
 
-    save_details(stored_isbns, summaries, categories, page_counts)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
 
+            sleep(wait)
 
-def save_details(stored_isbns, summaries, categories, page_counts):
+
+class QuotaExceeded(HTTPError):
+    """
+    Raised when a request is refused as the API quota has been used up
     """
-    Save newly retrieved ISBNs details to their own csv file, this function can be called with a new batch of ISBN
-    details and these details will appended to the existing file.
 
-    :param stored_isbns: The isbns which have been completed within this batch
-    :param summaries: All the summaries retrieved for the given ISBNs
-    :param categories: All the categories retrieved for the given ISBNs
-    :param page_counts: All the page counts retrieved for the given ISBNs
+
+def retry_after(headers):
+    """
+    :param headers: Headers of a response
+    :return: The number of seconds to wait given by the Retry-After header, either as seconds or a date, None if the
+        header is not given or can not be read
     """
+    value = headers.get("Retry-After") if headers is not None else None
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            retry_date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        # Dates without a time zone are in UTC
+        if retry_date.tzinfo is None:
+            retry_date = retry_date.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base=1, cap=60):
+    """
+    Exponential backoff with full jitter, so workers which failed together do not all retry together
+
+    :param attempt: The number of attempts already made, starting at 0
+    :param base: The delay in seconds for the first retry
+    :param cap: The maximum delay in seconds
+    :return: The number of seconds to wait before the next attempt
+    """
+    return uniform(0, min(cap, base * 2 ** attempt))
+
+
+def request_volume(connection, isbn, bucket, max_retries=5):
+    """
+    Request the details of a single ISBN over an existing keep-alive connection, retrying with backoff when the
+    request is rate limited, the server has a temporary error or the connection was dropped. A rate limited request
+    waits for as long as its Retry-After header asks, if it has one.
+
+    :param connection: A http.client connection to the Books API, which is reused between requests
+    :param isbn: The ISBN to request
+    :param bucket: TokenBucket shared between all workers
+    :param max_retries: The number of retries before giving up on the ISBN
+    :return: The decoded JSON response
+    """
+    url = API_PATH + isbn + FIELDS
+
+    for attempt in range(max_retries + 1):
+        if attempt:
+            METRICS.count("retries")
+        delay = None
+
+        bucket.acquire()
+        METRICS.count("api_calls")
+        try:
+            connection.request("GET", url)
+            response = connection.getresponse()
+            content = response.read()  # Response must be fully read before the connection can be reused
+        except (http.client.HTTPException, ConnectionError, TimeoutError):
+            # Connection dropped by the server so open a new one with the next request
+            connection.close()
+            if attempt == max_retries:
+                raise
+        else:
+            if response.status == 200:
+                return loads(content.decode("utf-8"))
+            if response.status == QUOTA_STATUS:
+                raise QuotaExceeded(url, response.status, response.reason, response.headers, None)
+            if response.status not in RETRY_STATUSES or attempt == max_retries:
+                raise HTTPError(url, response.status, response.reason, response.headers, None)
+            delay = retry_after(response.headers)
+
+        sleep(backoff_delay(attempt) if delay is None else delay)
+
+
+def get_details_concurrently(all_isbns, journal, workers=CONCURRENT_WORKERS, rate=REQUEST_RATE, host=API_HOST,
+                             port=None, secure=True, cache=None):
+    """
+    Use the Google Books API to complete the known details for all possible ISBNs currently stored, with a pool of
+    workers which each keep their own connection open and share a rate limit.
+
+    :param all_isbns: A list containing the ISBNs which are not yet completed
+    :param journal: ProgressJournal the retrieved details are recorded to
+    :param workers: The number of requests made concurrently
+    :param rate: The maximum number of requests per second across all workers
+    :param host: The API host, can be changed to use a local server
+    :param port: The API port, None for the default port
+    :param secure: True to use HTTPS, False to use HTTP
+    :param cache: ResponseCache checked before making a request, None to not use a cache
+    """
+    bucket = TokenBucket(rate)
+    local = threading.local()
+    connections = []
+    # Used to show progress in console
+    progress = Progress(len(all_isbns), "ISBNs")
+
+    def fetch(isbn):
+        obj = cache.get(isbn) if cache else None
+        if obj is not None:
+            METRICS.count("cache_hits")
+            return obj
+
+        # Each worker thread opens one connection and reuses it for all of its requests
+        if not hasattr(local, "connection"):
+            connection_type = http.client.HTTPSConnection if secure else http.client.HTTPConnection
+            local.connection = connection_type(host, port, timeout=30)
+            connections.append(local.connection)
+
+        obj = request_volume(local.connection, isbn, bucket)
+        if cache:
+            cache.put(isbn, obj)
+
+        return obj
+
+    remaining = iter(all_isbns)
+    futures = {}
+    quota_reached = False
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    try:
+        while True:
+            # Only a small window of ISBNs is queued at a time, topped up as each ISBN completes
+            for isbn in islice(remaining, workers * QUEUED_PER_WORKER - len(futures)):
+                futures[executor.submit(fetch, isbn[-10:])] = isbn[-10:]
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                isbn = futures.pop(future)
+                if future.cancelled():
+                    continue
+
+                progress.update()
+                try:
+                    summary, category, page_count = extract_details(future.result())
+                except KeyError:  # Required details not available, still stored so they are not requested again
+                    METRICS.count("missing_details")
+                    summary, category, page_count = None, None, None
+                except QuotaExceeded as e:  # No later request can succeed, so every remaining ISBN is left for later
+                    METRICS.count("failures")
+                    if not quota_reached:
+                        print("Quota reached, stopping: {}".format(e))
+                    quota_reached, remaining = True, iter(())
+                    for queued in futures:
+                        queued.cancel()
+                    continue
+                except Exception as e:  # Request failed after retries, left for the next run
+                    METRICS.count("failures")
+                    print(e)
+                    continue
+
+                journal.record(isbn, summary, category, page_count)
+    finally:
+        # ISBNs still queued are cancelled when stopped early, i.e. with Ctrl-C, only waiting on requests already made
+        executor.shutdown(cancel_futures=True)
+
+        for connection in connections:
+            connection.close()
+
+        journal.close()
+
+
+def reprocess_cached(cache, journal):
+    """
+    Extract the details for every cached response without making any requests, replacing the stored details of the
+    cached ISBNs. Used when the extracted fields change, as every response does not need to be requested again. Details
+    of ISBNs without a cached response, such as those retrieved before the cache existed, are kept as they are.
+
+    :param cache: ResponseCache containing the responses to extract details from
+    :param journal: ProgressJournal whose details are replaced
+    """
+    stored_isbns, summaries, categories, page_counts = [], [], [], []
+
+    for isbn, obj in cache.items():
+        try:
+            summary, category, page_count = extract_details(obj)
+        except KeyError:  # Still stored so they can be flagged for deletion when merged
+            summary, category, page_count = None, None, None
+
+        stored_isbns.append(isbn)
+        summaries.append(summary)
+        categories.append(category)
+        page_counts.append(page_count)
+
     details_df = pd.DataFrame(
         {"ISBN": stored_isbns, "Summary": summaries, "Categories": categories, "Page_Count": page_counts})
 
-    if path.isfile("../Data/Processed/Part/isbn_details.csv"):
-        print("Appending save")
-        current_details = pd.read_csv("../Data/Processed/Part/isbn_details.csv", on_bad_lines="skip")
-        complete_details = pd.concat([current_details, details_df], axis=0)
-        complete_details.drop_duplicates(subset="ISBN", inplace=True)
-        complete_details.to_csv("../Data/Processed/Part/isbn_details.csv", index=False)
-    else:
-        print("New save")
-        details_df.to_csv("../Data/Processed/Part/isbn_details.csv", index=False)
+    journal.flush()
+    current_details = journal.details()
+    current_details = current_details[~current_details["ISBN"].isin(details_df["ISBN"])]
+
+    journal.rewrite(pd.concat([current_details, details_df], axis=0, ignore_index=True))
+    print("Reprocessed {} cached responses".format(len(details_df.index)))
+
+
+if __name__ == "__main__":
+    response_cache = ResponseCache()
+    progress_journal = ProgressJournal()
+
+    with METRICS.stage("get_details"):
+        if REPROCESS:
+            with METRICS.timer("reprocess"):
+                reprocess_cached(response_cache, progress_journal)
+        else:
+            with METRICS.timer("select"):
+                ISBNS = remaining_isbns(progress_journal)
 
+            with METRICS.timer("fetch"):
+                if CONCURRENT:
+                    get_details_concurrently(ISBNS, progress_journal, cache=response_cache)
+                else:
+                    get_details(ISBNS, progress_journal, cache=response_cache)
 
-isbns = remaining_isbns()
-get_details(isbns)
+    response_cache.close()
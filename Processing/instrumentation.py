@@ -0,0 +1,176 @@
+"""
+Shared instrumentation for every stage: progress which is only printed every few seconds rather than for every item,
+timers and counters for each stage and the phases within it, and profiling of a single named stage.
+
+A stage is profiled by setting the environment variable BOOK_STATS_PROFILE to its name, with BOOK_STATS_PROFILER set to
+"cprofile" (the default) or "tracemalloc". The profile is saved within Data/Profiles, e.g.
+    BOOK_STATS_PROFILE=get_details python get_details.py
+"""
+import cProfile
+import json
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from os import environ, makedirs, path
+from time import monotonic, perf_counter
+
+PROFILE_STAGE = environ.get("BOOK_STATS_PROFILE")
+PROFILER = environ.get("BOOK_STATS_PROFILER", "cprofile")
+PROFILE_DIRECTORY = "../Data/Profiles"
+# Minimum number of seconds between progress updates
+PROGRESS_INTERVAL = 5
+
+
+class Progress:
+    """
+    Progress through a known number of items, printed at most once every interval with the rate and time remaining
+    """
+    def __init__(self, total, label, interval=PROGRESS_INTERVAL):
+        """
+        :param total: The number of items
+        :param label: Shown at the start of every update
+        :param interval: Minimum number of seconds between updates
+        """
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.done = 0
+        self.start = monotonic()
+        self.printed = self.start
+        self.lock = threading.Lock()
+
+    def update(self, count=1):
+        """
+        :param count: The number of items completed since the last update
+        """
+        with self.lock:
+            self.done += count
+            now = monotonic()
+
+            if now - self.printed >= self.interval or self.done >= self.total:
+                self.printed = now
+                self.show(now)
+
+    def show(self, now):
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        remaining = (self.total - self.done) / rate if rate else float("inf")
+
+        print("{}: {} out of {} ({:.1f}%) {:.1f}/s, {:.0f}s remaining".format(
+            self.label, self.done, self.total, 100 * self.done / max(self.total, 1), rate, remaining))
+
+
+class Metrics:
+    """
+    Thread safe timers and counters. Names are recorded within the stages that are currently running, i.e. a phase
+    "fetch" within the stage "get_details" is recorded as "get_details.fetch"
+    """
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def key(self, name):
+        return ".".join(self.stages + [name])
+
+    def count(self, name, count=1):
+        """
+        :param name: Name of the counter, i.e. "rows" or "api_calls"
+        :param count: Amount added to the counter
+        """
+        key = self.key(name)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + count
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Time a phase, the time of every run of the phase is added together
+
+        :param name: Name of the phase
+        """
+        key = self.key(name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.timers[key] = self.timers.get(key, 0) + perf_counter() - start
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a whole stage, profiling it if requested, and print its timers and counters once completed
+
+        :param name: Name of the stage
+        """
+        self.stages.append(name)
+        try:
+            with profile(name), self.timer("total"):
+                yield
+        finally:
+            prefix = ".".join(self.stages)
+            self.stages.pop()
+            print(self.report(prefix))
+
+    def report(self, prefix=""):
+        """
+        :param prefix: Only include timers and counters within this stage
+        :return: The timers and counters as lines of text
+        """
+        lines = ["{:<40}{:>12.3f}s".format(key, seconds) for key, seconds in self.timers.items()
+                 if key.startswith(prefix)]
+        lines += ["{:<40}{:>12}".format(key, count) for key, count in self.counters.items() if key.startswith(prefix)]
+
+        return "\n".join(lines)
+
+    def as_dict(self):
+        with self.lock:
+            return {"timers": dict(self.timers), "counters": dict(self.counters)}
+
+    def save(self, filename):
+        """
+        :param filename: JSON file the timers and counters are saved to
+        """
+        with open(filename, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+@contextmanager
+def profile(name):
+    """
+    Profile a stage if it is the stage named by BOOK_STATS_PROFILE, saving a cProfile dump (.prof) or a tracemalloc
+    snapshot (.tracemalloc) within PROFILE_DIRECTORY
+
+    :param name: Name of the stage
+    """
+    if name != PROFILE_STAGE:
+        yield
+        return
+
+    makedirs(PROFILE_DIRECTORY, exist_ok=True)
+
+    if PROFILER == "tracemalloc":
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(path.join(PROFILE_DIRECTORY, "{}.tracemalloc".format(name)))
+
+            for statistic in snapshot.statistics("lineno")[:10]:
+                print(statistic)
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path.join(PROFILE_DIRECTORY, "{}.prof".format(name)))
+
+
+# Shared by all modules
+METRICS = Metrics()
@@ -0,0 +1,149 @@
+"""
+Progress of get_details.py is recorded within an append-only journal, so saving a batch only writes the new details
+rather than rewriting every detail retrieved so far. The journal is periodically compacted into the canonical
+Data/Processed/Part/isbn_details.csv.
+
+The journal is located within Data/Processed/Part/isbn_details.journal
+"""
+import os
+from json import dumps, loads
+from os import path
+import pandas as pd
+
+JOURNAL_FILE = "../Data/Processed/Part/isbn_details.journal"
+DETAILS_FILE = "../Data/Processed/Part/isbn_details.csv"
+COLUMNS = ["ISBN", "Summary", "Categories", "Page_Count"]
+
+
+class ProgressJournal:
+    """
+    Details are buffered and appended to the journal in batches, with each batch flushed to disk before it is
+    considered saved. A crash can only lose the current batch, and a partially written line is ignored when read.
+    """
+    def __init__(self, journal_file=JOURNAL_FILE, details_file=DETAILS_FILE, batch_size=100, compact_every=50):
+        """
+        :param journal_file: Location of the journal, created if it does not exist
+        :param details_file: Location of the canonical details csv the journal is compacted into
+        :param batch_size: The number of details buffered before they are appended to the journal
+        :param compact_every: The number of batches appended between each compaction, None to only compact on close
+        """
+        self.journal_file = journal_file
+        self.details_file = details_file
+        self.batch_size = batch_size
+        self.compact_every = compact_every
+        self.buffer = []
+        self.batches = 0
+
+        # Every ISBN already completed, either within the details csv or the journal
+        self.completed = set(self.read_journal()["ISBN"])
+        if path.isfile(details_file):
+            self.completed.update(pd.read_csv(details_file, usecols=["ISBN"], dtype=str, on_bad_lines="skip")["ISBN"])
+
+    def __contains__(self, isbn):
+        return isbn in self.completed
+
+    def record(self, isbn, summary, categories, page_count):
+        """
+        Add the details of a completed ISBN, these are saved once the batch is full
+
+        :param isbn: The ISBN which has been completed
+        :param summary: The summary retrieved, None if not available
+        :param categories: The categories retrieved, None if not available
+        :param page_count: The page count retrieved, None if not available
+        """
+        self.buffer.append(dict(zip(COLUMNS, [isbn, summary, categories, page_count])))
+        self.completed.add(isbn)
+
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Append all buffered details to the journal and ensure they are written to disk
+        """
+        if not self.buffer:
+            return
+
+        lines = "".join(dumps(details) + "\n" for details in self.buffer)
+
+        # A line left incomplete by a crash is ended, so it does not corrupt the first line of this batch
+        if path.isfile(self.journal_file) and path.getsize(self.journal_file) > 0:
+            with open(self.journal_file, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    lines = "\n" + lines
+
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.buffer = []
+        self.batches += 1
+
+        if self.compact_every and self.batches % self.compact_every == 0:
+            self.compact()
+
+    def read_journal(self):
+        """
+        :return: A dataframe containing all details within the journal, in the order they were recorded
+        """
+        rows = []
+
+        if path.isfile(self.journal_file):
+            with open(self.journal_file, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rows.append(loads(line))
+                    except ValueError:  # Line may be incomplete if the process stopped while writing it
+                        continue
+
+        return pd.DataFrame(rows, columns=COLUMNS)
+
+    def details(self):
+        """
+        :return: A dataframe containing every saved detail, from the details csv followed by the journal. Details
+        already saved are kept over any later details for the same ISBN, as the original save did
+        """
+        journal_details = self.read_journal()
+
+        if path.isfile(self.details_file):
+            current_details = pd.read_csv(self.details_file, on_bad_lines="skip", dtype={"ISBN": str})
+            journal_details = pd.concat([current_details, journal_details], axis=0)
+
+        return journal_details.drop_duplicates(subset="ISBN")
+
+    def compact(self):
+        """
+        Merge the journal into the details csv, which is then replaced in a single step so it is never left partially
+        written. The journal is emptied afterwards.
+        """
+        self.rewrite(self.details())
+
+    def rewrite(self, details_df):
+        """
+        Replace the details csv and empty the journal
+
+        :param details_df: Dataframe containing the complete details, with the columns ISBN, Summary, Categories and
+        Page_Count
+        """
+        temporary_file = self.details_file + ".tmp"
+        with open(temporary_file, "w", encoding="utf-8", newline="") as f:
+            details_df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_file, self.details_file)
+
+        # Journal is only emptied once its details are safely within the csv
+        with open(self.journal_file, "w", encoding="utf-8") as f:
+            os.fsync(f.fileno())
+
+        self.completed.update(details_df["ISBN"].astype(str))
+        print("Compacted {} ISBN details".format(len(details_df.index)))
+
+    def close(self):
+        """
+        Save any buffered details and compact the journal
+        """
+        self.flush()
+        self.compact()
@@ -0,0 +1,145 @@
+"""
+The cleaned ratings stored as a compressed sparse row (CSR) matrix, with a row for each user and a column for each ISBN.
+Each part of the matrix is saved as its own .npy file and memory-mapped when opened, so every process using the ratings
+shares a single page-cached copy of them, and nothing is parsed or converted when they are opened.
+
+The store can be found within Data/Binary/ratings_csr/
+"""
+import json
+from os import makedirs, path, remove, replace
+import numpy as np
+import pandas as pd
+from data_store import DATASETS, load
+from scipy import sparse
+
+RATINGS_STORE_DIRECTORY = "../Data/Binary/ratings_csr"
+# Saved as a .npy file each
+STORE_ARRAYS = ["indptr", "indices", "data", "users", "isbns"]
+# Removed before any array is replaced and written after every array, so the store is only used once it is complete
+STORE_FILE = "store.json"
+
+
+class RatingsStore:
+    """
+    Ratings as CSR arrays: the ratings of the user of row i are data[indptr[i]:indptr[i + 1]], of the ISBNs of the
+    columns indices[indptr[i]:indptr[i + 1]]. Users are sorted so they are found by a binary search, ISBNs are in order
+    of their first rating within the cleaned ratings. Every rating is kept, in the order they were made by each user.
+    """
+    def __init__(self, indptr, indices, data, users, isbns):
+        """
+        :param indptr: Array of the position of the first rating of each row, followed by the number of ratings
+        :param indices: Array of the column of each rating
+        :param data: Array of each rating, as int8
+        :param users: Sorted array of the user of each row
+        :param isbns: Array of the ISBN of each column
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.users = users
+        self.isbns = isbns
+
+    @classmethod
+    def build(cls, ratings):
+        """
+        :param ratings: Dataframe of ratings, containing "ISBN", "Rating" and "User"
+        :return: RatingsStore of the ratings
+        """
+        columns, isbns = pd.factorize(ratings["ISBN"])
+        users, rows = np.unique(ratings["User"].values, return_inverse=True)
+
+        # Sorted by user, keeping the order of each user's ratings
+        order = np.argsort(rows, kind="stable")
+        index_type = np.int32 if len(rows) < np.iinfo(np.int32).max else np.int64
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(users)))]).astype(index_type)
+
+        return cls(indptr, columns[order].astype(index_type), ratings["Rating"].values[order].astype(np.int8),
+                   users.astype(np.int32), np.asarray(isbns.astype(str), dtype=str))
+
+    @classmethod
+    def load(cls, directory=RATINGS_STORE_DIRECTORY, mmap_mode="r"):
+        """
+        :param directory: Folder of the store saved by save()
+        :param mmap_mode: Memory-map mode of the arrays, None to read them into memory
+        :return: The saved RatingsStore, its arrays memory-mapped so only the parts used are read
+        """
+        with open(path.join(directory, STORE_FILE)) as f:
+            sizes = json.load(f)
+
+        store = cls(*[np.load(path.join(directory, "{}.npy".format(name)), mmap_mode=mmap_mode)
+                      for name in STORE_ARRAYS])
+
+        # Arrays from different saves can only be opened together if the store was saved again while it was opened
+        saved_sizes = (sizes["ratings"], sizes["users"], sizes["isbns"], sizes["users"] + 1)
+        if (len(store.data), len(store.users), len(store.isbns), len(store.indptr)) != saved_sizes:
+            raise ValueError("Ratings store within {} changed while it was opened".format(directory))
+
+        return store
+
+    def save(self, directory=RATINGS_STORE_DIRECTORY):
+        """
+        Each array is written to a temporary file and then moved into place, so processes which already have the store
+        open keep reading the arrays they opened. The store file is removed first and only written once every array is
+        in place, so a store which is partially saved, or whose save was interrupted, is never opened
+
+        :param directory: Folder the store is saved to
+        """
+        makedirs(directory, exist_ok=True)
+        store_file = path.join(directory, STORE_FILE)
+        if path.isfile(store_file):
+            remove(store_file)
+
+        for name in STORE_ARRAYS:
+            temporary = path.join(directory, "{}.tmp.npy".format(name))
+            np.save(temporary, getattr(self, name))
+            replace(temporary, path.join(directory, "{}.npy".format(name)))
+
+        with open(store_file + ".tmp", "w") as f:
+            json.dump({"ratings": len(self.data), "users": len(self.users), "isbns": len(self.isbns)}, f)
+        replace(store_file + ".tmp", store_file)
+
+    @property
+    def shape(self):
+        return len(self.users), len(self.isbns)
+
+    def rows(self):
+        """
+        :return: Array of the row (user) of each rating
+        """
+        return np.repeat(np.arange(len(self.users), dtype=self.indices.dtype), np.diff(self.indptr))
+
+    def user_rows(self, users):
+        """
+        :param users: Users to find the rows of
+        :return: Array of the row of each user, -1 for any user without ratings
+        """
+        users = np.asarray(users)
+        if len(self.users) == 0:
+            return np.full(len(users), -1, dtype=np.int64)
+
+        rows = np.minimum(np.searchsorted(self.users, users), len(self.users) - 1)
+        return np.where(self.users[rows] == users, rows, -1)
+
+    def matrix(self):
+        """
+        :return: scipy CSR matrix of the ratings, sharing the arrays of the store. Repeated ratings of an ISBN by a user
+            are kept as separate entries
+        """
+        return sparse.csr_matrix((self.data, self.indices, self.indptr), shape=self.shape, copy=False)
+
+
+def load_ratings_store(source_file=DATASETS["ratings"][0], directory=RATINGS_STORE_DIRECTORY):
+    """
+    Open the saved store, building and saving it first if it does not exist or is older than the cleaned ratings
+
+    :param source_file: File the ratings were read from, used to check whether the saved store is out of date
+    :param directory: Folder of the saved store
+    :return: RatingsStore of the cleaned ratings, memory-mapped
+    """
+    store_file = path.join(directory, STORE_FILE)
+
+    if not path.isfile(store_file) or (path.isfile(source_file)
+                                       and path.getmtime(source_file) > path.getmtime(store_file)):
+        RatingsStore.build(load("ratings", columns=["ISBN", "Rating", "User"])).save(directory)
+
+    return RatingsStore.load(directory)
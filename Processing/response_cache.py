@@ -0,0 +1,101 @@
+"""
+Raw Books API responses are stored within a local SQLite database, so details can be re-extracted from them without
+requesting them again, i.e. when a new field is required.
+
+The cache is located within Data/Cache/books_api.sqlite
+"""
+import sqlite3
+import threading
+from json import dumps, loads
+from os import makedirs, path
+from time import time
+
+CACHE_FILE = "../Data/Cache/books_api.sqlite"
+# Number of seconds a response is valid for, responses without any volumes are requested again sooner
+TTL = 90 * 24 * 60 * 60
+NEGATIVE_TTL = 7 * 24 * 60 * 60
+
+
+def normalise_isbn(isbn):
+    """
+    Standardise an ISBN so the same book always has the same key, only the last 10 characters are used as these are
+    what is requested from the API
+
+    :param isbn: ISBN as stored in the datasets
+    :return: The ISBN without separators, in upper case (for the "X" check digit) and at most 10 characters long
+    """
+    return str(isbn).strip().replace("-", "").replace(" ", "").upper()[-10:]
+
+
+class ResponseCache:
+    """
+    Key-value store of Books API responses keyed by normalised ISBN. Responses which did not contain any volumes are
+    stored as negative results, so they are not requested on every run, but expire sooner in case they are added.
+    """
+    def __init__(self, filename=CACHE_FILE, ttl=TTL, negative_ttl=NEGATIVE_TTL):
+        """
+        :param filename: Location of the SQLite database, created if it does not exist
+        :param ttl: Number of seconds a response with volumes is valid for, None to never expire
+        :param negative_ttl: Number of seconds a response without volumes is valid for, None to never expire
+        """
+        if path.dirname(filename):
+            makedirs(path.dirname(filename), exist_ok=True)
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Shared between fetching threads, so all access is behind the lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (isbn TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+                                "found INTEGER NOT NULL, fetched REAL NOT NULL)")
+        self.connection.commit()
+
+    def get(self, isbn, expired=False):
+        """
+        Retrieve the cached response for an ISBN
+
+        :param isbn: ISBN to look up, normalised before use
+        :param expired: True to also return responses which are older than their TTL
+        :return: The decoded JSON response, or None if it is not cached or has expired
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT payload, found, fetched FROM responses WHERE isbn = ?",
+                                          (normalise_isbn(isbn),)).fetchone()
+
+        if row is None:
+            return None
+
+        payload, found, fetched = row
+        ttl = self.ttl if found else self.negative_ttl
+
+        if not expired and ttl is not None and time() - fetched > ttl:
+            return None
+
+        return loads(payload)
+
+    def put(self, isbn, obj):
+        """
+        Store the response for an ISBN, replacing any existing response
+
+        :param isbn: ISBN the response is for, normalised before use
+        :param obj: The decoded JSON response
+        """
+        found = int(bool(obj.get("items")))
+
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                    (normalise_isbn(isbn), dumps(obj), found, time()))
+            self.connection.commit()
+
+    def items(self):
+        """
+        :return: A list of (ISBN, decoded JSON response) for every cached response, including expired responses
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT isbn, payload FROM responses").fetchall()
+
+        return [(isbn, loads(payload)) for isbn, payload in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,93 @@
+"""
+The compact types used for the columns of every dataset. ISBNs and other repeated strings are stored as categoricals,
+i.e. integer codes into a single dictionary of their values, user ids as int32 and ratings as int8. Datasets are given
+these types as they are loaded, so every stage uses them without converting the columns itself.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+
+ISBN = "category"
+USER = "int32"
+RATING = "int8"
+AGE = "float32"
+COUNT = "int32"
+
+# The type of each column within each dataset, columns not listed keep the type they are stored with
+SCHEMA = {
+    "books": {"ISBN": ISBN},
+    "ratings": {"ISBN": ISBN, "Rating": RATING, "User": USER},
+    "users": {"User": USER, "Location": "category", "Age": AGE},
+    "isbn_ratings": {"ISBN": ISBN},
+    "isbn_details": {"ISBN": ISBN},
+    "books_rated": {"ISBN": ISBN},
+    "rating_details": {"ISBN": ISBN},
+    "books_complete_details": {"ISBN": ISBN, "Categories": "category"},
+}
+
+
+def apply_schema(name, table):
+    """
+    Give the columns of a dataset their compact types. Categorical columns are dictionary encoded within Arrow, so the
+    strings of each value are only created once rather than once per row.
+
+    :param name: Name of the dataset, must be within SCHEMA
+    :param table: Arrow table of the dataset
+    :return: Dataframe of the dataset with the types of SCHEMA
+    """
+    types = {column: dtype for column, dtype in SCHEMA[name].items() if column in table.column_names}
+
+    for column, dtype in types.items():
+        index = table.column_names.index(column)
+        if dtype == "category" and not str(table.schema.field(index).type).startswith("dictionary"):
+            table = table.set_column(index, column, pc.dictionary_encode(table.column(column)))
+
+    dataset = table.to_pandas()
+
+    numeric = {column: dtype for column, dtype in types.items()
+               if dtype != "category" and dataset[column].dtype != dtype}
+    return dataset.astype(numeric) if numeric else dataset
+
+
+def align_isbns(*datasets, column="ISBN"):
+    """
+    Give the ISBNs of several datasets the same categories, so merges between them are made on the integer codes of the
+    ISBNs rather than by comparing strings
+
+    :param datasets: Dataframes containing an ISBN column
+    :param column: Name of the ISBN column
+    :return: List of the dataframes, with the ISBN columns sharing one categorical dtype
+    """
+    categories = [dataset[column].astype("category").cat.categories for dataset in datasets]
+    isbn_type = pd.CategoricalDtype(categories[0].append(categories[1:]).unique())
+
+    return [dataset.assign(**{column: dataset[column].astype(isbn_type)}) for dataset in datasets]
+
+
+def age_groups(ages, bins):
+    """
+    :param ages: Series of ages
+    :param bins: Dictionary of age group name to its exclusive upper bound, in ascending order
+    :return: Ordered categorical of the age group of each age, missing ages have no group
+    """
+    return pd.cut(ages, bins=[-np.inf] + list(bins.values()), labels=list(bins), right=False)
+
+
+def country_groups(locations, countries):
+    """
+    :param locations: Series of user locations, with the country at the end
+    :param countries: Dictionary of country (as in the location) to its group name, any others are grouped as "Other"
+    :return: Categorical of the country group of each location, with the groups in order of first appearance within
+        countries followed by "Other"
+    """
+    groups = list(dict.fromkeys(countries.values())) + ["Other"]
+
+    # Each distinct location is only split once
+    locations = locations.astype("category")
+    location_groups = locations.cat.categories.str.split(", ").str[-1].map(countries).fillna("Other")
+
+    # Missing locations have a code of -1, which is the final group code appended for "Other"
+    group_codes = np.append(pd.Index(groups).get_indexer(location_groups), groups.index("Other"))
+
+    return pd.Series(pd.Categorical.from_codes(group_codes[locations.cat.codes], categories=groups),
+                     index=locations.index)
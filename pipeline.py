@@ -0,0 +1,242 @@
+"""
+This file runs every stage of the project in order, from cleaning the initial dataset to producing the visualisations.
+Each stage declares the files it reads and writes, and the content of its inputs is fingerprinted, so a stage is only
+run again when its inputs have changed since it was last run (or an output is missing). Stages which do not depend on
+each other are run in parallel, and the time taken by each stage is reported.
+
+The fingerprints of the last successful run of each stage are stored within Data/pipeline_state.json
+"""
+import json
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hashlib import sha256
+from os import path, remove
+from time import perf_counter
+
+ROOT = path.dirname(path.abspath(__file__))
+STATE_FILE = path.join(ROOT, "Data", "pipeline_state.json")
+WORKERS = 4
+# Stages which are a function rather than a script are run within an instrumented stage, given the module, the name of
+# the stage and the call
+STAGE_FUNCTION = "import {0}\nfrom instrumentation import METRICS\nwith METRICS.stage('{1}'):\n    {0}.{2}"
+
+
+class Stage:
+    """
+    A single step of the pipeline, which is a script (or function) run within its own folder
+    """
+    def __init__(self, name, directory, command, inputs, outputs, clear_outputs=False):
+        """
+        :param name: Unique name of the stage
+        :param directory: Folder the command is run within, either "Processing" or "Analysis"
+        :param command: Arguments passed to python, i.e. the script and any arguments
+        :param inputs: Files read by the stage, relative to the project folder
+        :param outputs: Files written by the stage, relative to the project folder
+        :param clear_outputs: True to delete the outputs before running, for scripts that skip existing outputs
+        """
+        self.name = name
+        self.directory = directory
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.clear_outputs = clear_outputs
+
+
+def visualise_files():
+    """
+    The files of the stats and visualise stages are taken from visualise_stats, so every stat csv and figure is declared
+
+    :return: List of the stat csvs written by compile_stats(), list of the files read by the figures and list of the
+        figures, relative to the project folder
+    """
+    sys.path.extend([path.join(ROOT, "Analysis"), path.join(ROOT, "Processing")])
+    import visualise_stats
+
+    def relative(filenames):
+        # Files within visualise_stats are relative to the Analysis folder
+        return list(dict.fromkeys(path.normpath(path.join("Analysis", filename)) for filename in filenames))
+
+    jobs = visualise_stats.figure_jobs()
+    return (relative(visualise_stats.stats_csvs()), relative(f for job in jobs for f in job.files),
+            relative(job.output for job in jobs))
+
+
+STATS_CSVS, FIGURE_INPUTS, FIGURES = visualise_files()
+
+STAGES = [
+    Stage("clean", "Processing", ["cleaning.py"],
+          ["Data/Unprocessed/books.csv", "Data/Unprocessed/ratings.csv", "Data/Unprocessed/users.csv"],
+          ["Data/Cleaned/books.csv", "Data/Cleaned/ratings.csv", "Data/Cleaned/users.csv"], clear_outputs=True),
+    Stage("ratings_store", "Processing",
+          ["-c", STAGE_FUNCTION.format("ratings_store", "ratings_store", "load_ratings_store()")],
+          ["Data/Cleaned/ratings.csv"],
+          ["Data/Binary/ratings_csr/store.json"]),
+    # Stages reading the ratings store also fingerprint the cleaned ratings, as store.json only records the number of
+    # ratings, users and ISBNs, while depending on store.json so they are run after ratings_store
+    Stage("average_ratings", "Processing", ["average_ratings.py"],
+          ["Data/Cleaned/ratings.csv", "Data/Binary/ratings_csr/store.json"],
+          ["Data/Processed/Part/isbn_ratings.csv"]),
+    Stage("merge_ratings", "Processing",
+          ["-c", STAGE_FUNCTION.format("data_merging", "merge_ratings", "merge_books_with_ratings()")],
+          ["Data/Cleaned/books.csv", "Data/Processed/Part/isbn_ratings.csv"],
+          ["Data/Processed/books_rated.csv"]),
+    Stage("get_details", "Processing", ["get_details.py"],
+          ["Data/Processed/books_rated.csv"],
+          ["Data/Processed/Part/isbn_details.csv"]),
+    Stage("merge_details", "Processing",
+          ["-c", STAGE_FUNCTION.format("data_merging", "merge_details", "merge_books_and_ratings_with_details()")],
+          ["Data/Processed/books_rated.csv", "Data/Processed/Part/isbn_details.csv"],
+          ["Data/Processed/books_complete_details.csv"]),
+    Stage("rating_figures", "Analysis", ["rating_figures.py"],
+          ["Data/Cleaned/ratings.csv", "Data/Binary/ratings_csr/store.json", "Data/Cleaned/users.csv",
+           "Data/Processed/books_rated.csv"],
+          ["Data/Processed/Part/rating_details.csv"]),
+    Stage("user_demographics", "Analysis", ["user_demographics.py"],
+          ["Data/Cleaned/users.csv"],
+          ["Data/Stats/user_demographics.csv"]),
+    Stage("summaries", "Analysis", ["-c", STAGE_FUNCTION.format("get_item_stats", "summaries", "process_summary()")],
+          ["Data/Processed/books_complete_details.csv"],
+          ["Data/Processed/Part/shortened_summaries.csv"]),
+    Stage("keyword_index", "Analysis", ["keyword_search.py"],
+          ["Data/Processed/books_complete_details.csv"],
+          ["Data/Processed/Part/keyword_index.npz"]),
+    Stage("stats", "Analysis",
+          ["-c", STAGE_FUNCTION.format("visualise_stats", "stats",
+                                       "compile_stats(visualise_stats.MAX_SAMPLE_SIZE)")],
+          ["Data/Processed/Part/rating_details.csv", "Data/Processed/books_complete_details.csv",
+           "Data/Processed/Part/shortened_summaries.csv"],
+          STATS_CSVS),
+    Stage("visualise", "Analysis", ["visualise_stats.py"], FIGURE_INPUTS, FIGURES),
+]
+
+
+def fingerprint(filename):
+    """
+    :param filename: File to fingerprint, relative to the project folder
+    :return: SHA-256 of the file's content, or None if it does not exist
+    """
+    filename = path.join(ROOT, filename)
+
+    if not path.isfile(filename):
+        return None
+
+    file_hash = sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def dependencies(stages):
+    """
+    :param stages: List of all stages
+    :return: Dictionary of each stage's name to the names of the stages which produce its inputs
+    """
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+
+    return {stage.name: {producers[i] for i in stage.inputs if i in producers and producers[i] != stage.name}
+            for stage in stages}
+
+
+def run_stage(stage, state, force):
+    """
+    Run a stage if its inputs have changed since it was last run, or any of its outputs are missing
+
+    :param stage: Stage to run
+    :param state: Dictionary of each stage's name to the input fingerprints of its last successful run
+    :param force: True to run the stage regardless
+    :return: The status ("ran", "skipped" or "failed"), the fingerprints of its inputs and the seconds taken
+    """
+    start = perf_counter()
+    fingerprints = {i: fingerprint(i) for i in stage.inputs}
+    outputs_exist = all(path.isfile(path.join(ROOT, output)) for output in stage.outputs)
+
+    if not force and outputs_exist and state.get(stage.name) == fingerprints:
+        return "skipped", fingerprints, perf_counter() - start
+
+    if stage.clear_outputs:
+        for output in stage.outputs:
+            if path.isfile(path.join(ROOT, output)):
+                remove(path.join(ROOT, output))
+
+    result = subprocess.run([sys.executable] + stage.command, cwd=path.join(ROOT, stage.directory))
+
+    return "ran" if result.returncode == 0 else "failed", fingerprints, perf_counter() - start
+
+
+def run_pipeline(stages=None, workers=WORKERS, force=False):
+    """
+    Run every stage whose inputs have changed, with stages that do not depend on each other run in parallel. A stage is
+    only started once all the stages producing its inputs have finished, and is blocked if any of them failed.
+
+    :param stages: List of stages to run, defaults to STAGES
+    :param workers: Maximum number of stages run at the same time
+    :param force: True to run every stage regardless of whether its inputs have changed
+    :return: Dictionary of each stage's name to its status and the seconds taken
+    """
+    start = perf_counter()
+    stages = stages or STAGES
+    state = {}
+    if path.isfile(STATE_FILE):
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+
+    waiting_on = dependencies(stages)
+    pending = {stage.name: stage for stage in stages}
+    running, report = {}, {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                upstream = waiting_on[name]
+
+                if any(report.get(u, ("",))[0] in ("failed", "blocked") for u in upstream):
+                    report[name] = ("blocked", 0.0)
+                    del pending[name]
+                elif all(u in report for u in upstream):
+                    running[executor.submit(run_stage, stage, state, force)] = name
+                    del pending[name]
+
+            if not running:
+                # Nothing left to wait for, so any stage still pending is within or after a cycle of stages
+                for name in pending:
+                    print("Stage {} can not start, it depends on a cycle of stages".format(name))
+                    report[name] = ("blocked", 0.0)
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                status, fingerprints, seconds = future.result()
+                report[name] = (status, seconds)
+
+                # Only successful runs are recorded, so failed stages are run again next time
+                if status == "ran":
+                    state[name] = fingerprints
+                    with open(STATE_FILE, "w") as f:
+                        json.dump(state, f, indent=2)
+
+    print_report(stages, report, perf_counter() - start)
+    return report
+
+
+def print_report(stages, report, elapsed):
+    """
+    Print the status and time taken by every stage
+
+    :param stages: List of the stages run, in order
+    :param report: Dictionary returned by run_pipeline()
+    :param elapsed: Seconds taken by the whole pipeline, less than the total of the stages when run in parallel
+    """
+    print("{:<20}{:<10}{:>10}".format("Stage", "Status", "Seconds"))
+    for stage in stages:
+        status, seconds = report[stage.name]
+        print("{:<20}{:<10}{:>10.2f}".format(stage.name, status, seconds))
+    print("{:<30}{:>10.2f}".format("Total", sum(seconds for _, seconds in report.values())))
+    print("{:<30}{:>10.2f}".format("Elapsed", elapsed))
+
+
+if __name__ == "__main__":
+    run_pipeline(force="--force" in sys.argv)